@@ -1,37 +1,225 @@
-from flask import Flask, jsonify
+import os
+import sys
+import click
+from flask import Flask, g, jsonify, request, session, has_app_context, has_request_context
 from flask_sqlalchemy import SQLAlchemy
-from flask_cors import CORS
-from flask_migrate import Migrate
 from flask_login import LoginManager
 from .config import Config
-from flask_admin import Admin
-from flask_admin.contrib.sqla import ModelView
+from .cache import AsyncCache, Cache
+from .events import EventBroker
+from .inbox import Inbox
+from .metrics import Metrics
+from .log import configure_logging, init_request_ids, init_celery_request_ids
+from .database import AsyncDatabase, RoutingSession, configure_engines, use_read_replica
 from werkzeug.exceptions import HTTPException
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from sqlalchemy import event
+from celery import Celery
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager() # Initialize LoginManager
-limiter = Limiter(
-        key_func=get_remote_address,
-        default_limits=["200 per day", "50 per hour"]
-    )
+celery = Celery('tasks')
+cache = Cache()
+events = EventBroker()
+inbox = Inbox()
+metrics = Metrics()
+#  Only set up by app.asgi, for the coroutine routes
+async_db = AsyncDatabase()
+async_cache = AsyncCache(cache)
+
+
+def rate_limit_key():
+    #  Students behind a campus NAT share one address, so once they are
+    #  logged in each is counted separately. The id comes from the signed
+    #  session Flask-Login keeps, rather than current_user, so the limiter
+    #  never loads the user itself.
+    user_id = session.get('_user_id')
+    if user_id:
+        return f"user:{user_id}"
+    return f"ip:{get_remote_address()}"
+
+
+#  Storage, strategy and default limits come from the RATELIMIT_* config
+limiter = Limiter(key_func=rate_limit_key)
+
+
+def _sqlite_disable_implicit_transactions(dbapi_connection, connection_record):
+    #  pysqlite delays BEGIN until the first DML statement, which turns a
+    #  leading SAVEPOINT into its own committed transaction. Let SQLAlchemy
+    #  emit BEGIN itself instead so savepoints nest properly.
+    dbapi_connection.isolation_level = None
+
+
+def _sqlite_begin(conn):
+    #  A deferred transaction that reads and then writes can't wait on the
+    #  write lock, so it fails at once with "database is locked" whenever
+    #  another process is writing. Write requests are short, so they take
+    #  the lock up front unless they opted out with defer_write_lock().
+    #  Background tasks and CLI commands keep deferred transactions, as they
+    #  may read and then wait on the network or solve for a while; their
+    #  read-then-write steps take the lock with write_transaction().
+    mode = g.get('sqlite_begin') if has_app_context() else None
+    if mode is None:
+        write_request = has_request_context() and request.method not in ('GET', 'HEAD')
+        mode = 'IMMEDIATE' if write_request else 'DEFERRED'
+    conn.exec_driver_sql(f"BEGIN {mode}")
 
 
-def create_app():
+def _sqlite_pragmas(config):
+    #  WAL lets readers proceed while one process writes, and a busy timeout
+    #  makes writers wait for the lock rather than fail with "database is locked"
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}")
+        cursor.execute(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+        cursor.execute(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}")
+        cursor.close()
+    return set_pragmas
+
+
+PROFILES = ('web', 'worker', 'cli')
+
+
+def create_app(profile=None):
+    """
+    Builds the app for one role, initializing only what that role uses:
+
+    - 'web': everything, including routes, the limiter, CORS, login and Flask-Admin
+    - 'worker': the database, cache and event publishing for Celery tasks
+    - 'cli': the database, migrations and CLI commands
+
+    The profile defaults to the APP_PROFILE environment variable, or 'web'.
+    Heavy extensions are imported inside the profiles that need them, so
+    e.g. a worker never imports the admin stack.
+    """
+    profile = profile or os.getenv('APP_PROFILE', 'web')
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown app profile {profile!r}, expected one of {PROFILES}")
+
     app = Flask(__name__)
     app.config.from_object(Config)
+    app.config['APP_PROFILE'] = profile
+    configure_logging(app.config)
+    configure_engines(app.config)
+    celery.conf.update(
+        broker_url=app.config['CELERY_BROKER_URL'],
+        result_backend=app.config['CELERY_RESULT_BACKEND'],
+    )
+    if profile == 'web':
+        #  Requests publish tasks inline, and by default kombu retries a
+        #  broker connection for seconds before giving up
+        timeout = app.config['CELERY_PUBLISH_TIMEOUT']
+        celery.conf.update(
+            broker_connection_timeout=timeout,
+            broker_transport_options={'max_retries': 1, 'interval_start': 0, 'interval_step': timeout,
+                                      'interval_max': timeout, 'socket_connect_timeout': timeout,
+                                      'socket_timeout': timeout},
+        )
+    init_celery_request_ids()
+
+    db.init_app(app)
+    cache.init_app(app)
+    events.init_app(app)
+    inbox.init_app(app)
+    metrics.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            metrics.track_queries(engine)
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', _sqlite_disable_implicit_transactions)
+                event.listen(engine, 'connect', _sqlite_pragmas(app.config))
+                event.listen(engine, 'begin', _sqlite_begin)
+
+    if profile in ('web', 'cli'):
+        from flask_migrate import Migrate
+        migrate = Migrate(app, db)
+
+        @app.cli.command('load-localities')
+        @click.argument('csv_path', required=False)
+        def load_localities_command(csv_path):
+            """Load localities from a CSV, or the bundled seed list."""
+            from app.locations import SEED_LOCALITIES, load_localities, read_localities_csv
+            rows = read_localities_csv(csv_path) if csv_path else SEED_LOCALITIES
+            click.echo(f"Loaded {load_localities(rows)} localities")
+
+        @app.cli.command('import-data')
+        @click.argument('kind', type=click.Choice(['users', 'availability', 'requests']))
+        @click.argument('path')
+        @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+                      help='Defaults to the file extension, else CSV.')
+        def import_data_command(kind, path, fmt):
+            """Import users, host availability or student requests from a CSV or JSONL file ('-' for stdin)."""
+            from app.bulk import format_for, import_records
+            fmt = fmt or format_for(path)
+            if path == '-':
+                report = import_records(kind, sys.stdin, fmt)
+            else:
+                with open(path, encoding='utf-8', newline='') as lines:
+                    report = import_records(kind, lines, fmt)
+            for error in report['errors']:
+                click.echo(f"line {error['line']}: {error['error']}", err=True)
+            click.echo(f"Read {report['rows']} {kind} rows: {report['inserted']} inserted, "
+                       f"{report['updated']} updated, {report['skipped']} skipped")
+
+        @app.cli.command('rebuild-features')
+        def rebuild_features_command():
+            """Recompute every user's preference vector."""
+            from app.bulk import rebuild_features
+            click.echo(f"Rebuilt preference vectors for {rebuild_features()} users")
+
+        @app.cli.command('export-matches')
+        @click.argument('path', default='-')
+        @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+                      help='Defaults to the file extension, else CSV.')
+        @click.option('--after-id', type=int, default=0, help='Only export matches with a greater id.')
+        def export_matches_command(path, fmt, after_id):
+            """Export the match history as CSV or JSONL to a file ('-' for stdout)."""
+            from app.bulk import export_matches, format_for
+            fmt = fmt or format_for(path)
+            if path == '-':
+                sys.stdout.writelines(export_matches(fmt, after_id))
+                return
+            with open(path, 'w', encoding='utf-8', newline='') as out:
+                out.writelines(export_matches(fmt, after_id))
+
+    if profile == 'web':
+        _init_web(app)
+    elif profile == 'worker':
+        metrics.instrument_celery(app.config['WORKER_METRICS_PORT'])
+
+    return app
+
+
+def _init_web(app):
+    from flask_cors import CORS
+    from flask_admin import Admin
+    from flask_admin.contrib.sqla import ModelView
+
+    #  First, so the request id and timers are set before any other hook can reject the request
+    init_request_ids(app)
+    metrics_view = metrics.instrument_requests(app)
+
     from app.routes import main
     app.register_blueprint(main)
 
-    from flask_limiter import Limiter
-    from flask_limiter.util import get_remote_address
     limiter.init_app(app)
-    
+    if metrics_view is not None:
+        limiter.exempt(metrics_view)
 
+    @limiter.request_filter
+    def skip_preflight():
+        #  CORS preflights carry no credentials and should not use up a quota
+        return request.method == 'OPTIONS'
     CORS(app)
-    db.init_app(app)
-    migrate = Migrate(app, db)
+
+    if app.config.get('READ_REPLICA_URL'):
+        @app.before_request
+        def route_reads_to_replica():
+            #  Reads in GET requests may lag the primary by the replication delay
+            if request.method in ('GET', 'HEAD'):
+                use_read_replica()
+
     login_manager.init_app(app) # Initialize within create_app
     login_manager.login_view = 'main.login'  #  Set the login view
 
@@ -42,10 +230,9 @@ def create_app():
             code = e.code
         return jsonify(error=str(e)), code
 
-    from app.models import User, HostAvailability
+    from app.models import User, HostAvailability, OutboundMessage
 
     admin = Admin(app, name='Anywhere in Israel', template_mode='bootstrap3')
     admin.add_view(ModelView(User, db.session))
     admin.add_view(ModelView(HostAvailability, db.session))
-
-    return app
\ No newline at end of file
+    admin.add_view(ModelView(OutboundMessage, db.session))
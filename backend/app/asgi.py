@@ -0,0 +1,173 @@
+"""
+ASGI deployment of the web app, for I/O-bound traffic. Serve it with
+(from backend/):
+
+    uvicorn asgi:app --workers 4
+
+The read endpoints and the WhatsApp webhook in app.async_routes run as
+coroutines on each worker's event loop, awaiting the database through an
+async driver (aiosqlite or asyncpg) and Redis through asyncio clients, so
+one worker keeps hundreds of them in flight where a WSGI worker holds a
+thread per request. They still run inside a Flask request context with
+the app's before and after request hooks (request ids, metrics, rate
+limits, CORS), so their responses match the Flask views'. The rate
+limiter's Redis check is the one blocking call left on the loop.
+
+Every other route goes to the Flask app unchanged, on a pool of
+ASGI_WSGI_THREADS threads per worker. Keep the Server-Sent Events stream
+on the gevent WSGI deployment: here each open stream would hold one of
+those threads.
+"""
+import io
+import sys
+
+from flask import request
+from flask.signals import request_started
+from sqlalchemy import event
+from werkzeug.exceptions import HTTPException
+
+from app import async_cache, async_db, create_app, inbox, metrics, _sqlite_pragmas
+from app.async_routes import ASYNC_VIEWS
+
+
+def path_info(scope):
+    #  ASGI paths include the root path and are decoded; WSGI's are neither
+    path = scope['path']
+    root_path = scope.get('root_path', '')
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    return path.encode().decode('latin-1')
+
+
+def build_environ(scope, body):
+    """
+    Returns the WSGI environ for an ASGI HTTP request with this body.
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': path_info(scope),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f"HTTP_{name}"
+        value = value.decode('latin-1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+class AsgiApp:
+    """
+    Serves the endpoints in ASYNC_VIEWS with their coroutines and hands
+    every other request to the Flask app on a thread pool.
+    """
+
+    def __init__(self, flask_app):
+        from a2wsgi import WSGIMiddleware
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=flask_app.config['ASGI_WSGI_THREADS'])
+        self.urls = flask_app.url_map.bind('localhost')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        view = self.async_view(scope) if scope['type'] == 'http' else None
+        if view is None:
+            return await self.wsgi(scope, receive, send)
+
+        environ = build_environ(scope, await read_body(receive))
+        status, headers, body = await self.dispatch(view, environ)
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    def async_view(self, scope):
+        if scope['method'] not in ('GET', 'POST'):
+            return None
+        try:
+            endpoint, _ = self.urls.match(path_info(scope), scope['method'])
+        except HTTPException:
+            #  Not found, wrong method or a redirect: Flask answers those
+            return None
+        return ASYNC_VIEWS.get(endpoint)
+
+    async def dispatch(self, view, environ):
+        """
+        Flask's wsgi_app and full_dispatch_request, awaiting `view` in place
+        of the Flask view. Returns the status code, headers and body.
+        """
+        app = self.flask_app
+        ctx = app.request_context(environ)
+        error = None
+        try:
+            try:
+                ctx.push()
+                try:
+                    request_started.send(app, _async_wrapper=app.ensure_sync)
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        rv = await view(**request.view_args)
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                response = app.finalize_request(rv)
+            except Exception as e:
+                error = e
+                response = app.handle_exception(e)
+            app_iter, status, headers = response.get_wsgi_response(environ)
+            return int(status.split(' ', 1)[0]), headers, b''.join(app_iter)
+        finally:
+            ctx.pop(error)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await async_db.dispose()
+                await async_cache.close()
+                await inbox.close_async()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_asgi_app():
+    """
+    Builds the web app with async database and cache access and wraps it
+    for an ASGI server.
+    """
+    flask_app = create_app('web')
+    async_db.init_app(flask_app)
+    for engine in async_db.engines.values():
+        metrics.track_queries(engine.sync_engine)
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine.sync_engine, 'connect', _sqlite_pragmas(flask_app.config))
+    async_cache.init_app(flask_app)
+    return AsgiApp(flask_app)
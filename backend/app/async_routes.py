@@ -0,0 +1,136 @@
+"""
+Coroutine versions of the read endpoints and the WhatsApp webhook, served
+on the event loop by app.asgi. Each stands in for the Flask view with the
+same endpoint name and gives the same response: the same cache keys,
+serializers and paging headers, and the same queue for webhook messages.
+"""
+import logging
+
+from flask import current_app, jsonify, request
+from sqlalchemy import select
+
+from app import async_cache, async_db, inbox
+from app.cache import profile_key, request_key, match_key
+from app.inbox import parse_webhook_messages, valid_signature
+from app.models import User, StudentRequest, Match
+from app.pagination import BadPageRequest, conditional_page, page_args, split_page
+from app.routes import serialize_user, serialize_request, serialize_match
+
+log = logging.getLogger(__name__)
+
+
+async def cached_json(key, build):
+    """
+    Returns a JSON response for `key` from the cache, or awaits `build` and
+    caches the serialized result. Returns None if `build` returns None.
+    """
+    body = await async_cache.get(key)
+    if body is None:
+        data = await build()
+        if data is None:
+            return None
+        body = current_app.json.dumps(data) + "\n"
+        await async_cache.set(key, body)
+    return current_app.response_class(body, mimetype='application/json')
+
+
+async def paginated(stmt, id_column, serialize):
+    """
+    Returns one keyset page of `stmt` as a conditional JSON response, or a
+    400 if the limit or cursor is malformed.
+    """
+    try:
+        limit, cursor = page_args()
+    except BadPageRequest as e:
+        return jsonify({'error': str(e)}), 400
+    if cursor is not None:
+        stmt = stmt.where(id_column > cursor)
+    async with async_db.session() as session:
+        rows = (await session.scalars(stmt.order_by(id_column).limit(limit + 1))).all()
+    rows, next_cursor = split_page(rows, limit)
+    return conditional_page([serialize(row) for row in rows], next_cursor)
+
+
+async def load(model, row_id):
+    async with async_db.session() as session:
+        return await session.get(model, row_id)
+
+
+async def get_user_profile(user_id):
+    async def build():
+        user = await load(User, user_id)
+        return serialize_user(user) if user else None
+
+    response = await cached_json(profile_key(user_id), build)
+    if response is None:
+        return jsonify({'error': 'User not found'}), 404
+    return response, 200
+
+
+async def get_student_request(request_id):
+    async def build():
+        request_obj = await load(StudentRequest, request_id)
+        return serialize_request(request_obj) if request_obj else None
+
+    response = await cached_json(request_key(request_id), build)
+    if response is None:
+        return jsonify({'error': 'Request not found'}), 404
+    return response, 200
+
+
+async def get_student_requests(student_id):
+    stmt = select(StudentRequest).where(StudentRequest.student_id == student_id)
+    return await paginated(stmt, StudentRequest.id, serialize_request)
+
+
+async def get_match(match_id):
+    async def build():
+        match = await load(Match, match_id)
+        return serialize_match(match) if match else None
+
+    response = await cached_json(match_key(match_id), build)
+    if response is None:
+        return jsonify({'error': 'Match not found'}), 404
+    return response, 200
+
+
+async def get_user_matches(user_id):
+    user = await load(User, user_id)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    if user.role == 'host':
+        stmt = select(Match).where(Match.host_id == user_id)
+    else:
+        stmt = select(Match).where(Match.student_id == user_id)
+    return await paginated(stmt, Match.id, serialize_match)
+
+
+async def whatsapp_webhook():
+    body = request.get_data()
+    if not valid_signature(current_app.config['WHATSAPP_APP_SECRET'], body,
+                           request.headers.get('X-Hub-Signature-256')):
+        return jsonify({'error': 'Invalid signature'}), 403
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid payload'}), 400
+
+    messages = parse_webhook_messages(data)
+    try:
+        queued = await inbox.submit_async(messages)
+    except Exception as e:
+        #  Not acknowledged, so Meta delivers the messages again later
+        log.error("Could not queue %d webhook messages: %s", len(messages), e)
+        return jsonify({'error': 'Try again later'}), 503
+    return jsonify({'received': len(messages), 'queued': queued}), 200
+
+
+#  Flask endpoint -> the coroutine that serves it under ASGI
+ASYNC_VIEWS = {
+    'main.get_user_profile': get_user_profile,
+    'main.get_student_request': get_student_request,
+    'main.get_student_requests': get_student_requests,
+    'main.get_match': get_match,
+    'main.get_user_matches': get_user_matches,
+    'main.whatsapp_webhook': whatsapp_webhook,
+}
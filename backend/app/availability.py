@@ -0,0 +1,258 @@
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import bindparam, case, delete, func, insert, select, update
+
+from app import db
+from app.cache import LRUCache
+from app.database import write_transaction
+from app.inbox import normalize_phone, parse_reply
+from app.models import User, HostAvailability, HostAvailabilityArchive, StudentRequest, Match
+from app.models import current_week_start, week_start_of
+from app.outbox import queue_outbound_messages
+
+YES_REPLY = "Great! You've confirmed hosting."
+NO_REPLY = "No problem, we will find another student."
+HELP_REPLY = "Reply with 'Yes' to confirm or 'No' to decline."
+CAPACITY_REPLY = "How many guests can you host? Reply with 'Yes' and the number, e.g. 'Yes 2'."
+
+
+class HostPhoneIndex:
+    """
+    Maps phone numbers to (host_id, location) for the hosts replying to
+    the weekly availability request. Entries, including "not a host", are
+    cached for `ttl` seconds, so a changed phone number takes effect
+    within that time.
+    """
+
+    def __init__(self, ttl=300, max_entries=100000):
+        self.ttl = ttl
+        self._entries = LRUCache(max_entries)
+
+    def lookup(self, phones):
+        """
+        Returns {phone: (host_id, location)} for the phones that belong to
+        hosts, loading the ones not cached with a single query.
+        """
+        found = {}
+        missing = []
+        for phone in set(phones) - {None}:
+            entry = self._entries.get(phone)
+            if entry is None:
+                missing.append(phone)
+            elif entry:
+                found[phone] = entry
+        for offset in range(0, len(missing), 500):
+            chunk = missing[offset:offset + 500]
+            #  Stored numbers may lack the plus the Graph API leaves off
+            rows = db.session.execute(
+                select(User.id, User.phone, User.location)
+                .where(User.role == 'host', User.phone.in_(chunk + [phone[1:] for phone in chunk]))
+            ).all()
+            loaded = {normalize_phone(row.phone): (row.id, row.location) for row in rows}
+            for phone in chunk:
+                entry = loaded.get(phone, ())
+                self._entries.set(phone, entry, self.ttl)
+                if entry:
+                    found[phone] = entry
+        return found
+
+
+def save_availability(updates, week_start=None, needs_capacity=None):
+    """
+    Writes {host_id: (available, capacity)} to each host's row for the week
+    starting `week_start` (the current week by default), inserting the rows
+    that don't exist yet, in one UPDATE and one INSERT. A capacity of None
+    keeps the week's stored capacity, or the host's latest one for a new
+    week. An available host with no capacity to keep is skipped, as it
+    could never be matched, and added to the `needs_capacity` set if one is
+    passed. The caller commits.
+
+    Returns the ids of the hosts that were not available that week before.
+    """
+    if not updates:
+        return set()
+    week_start = week_start or current_week_start()
+    existing, previous_capacity = {}, {}
+    host_ids = list(updates)
+    for offset in range(0, len(host_ids), 500):
+        chunk = host_ids[offset:offset + 500]
+        for row in db.session.execute(
+            select(HostAvailability.id, HostAvailability.host_id, HostAvailability.available,
+                   HostAvailability.capacity)
+            .where(HostAvailability.host_id.in_(chunk), HostAvailability.week_start == week_start)
+        ):
+            existing[row.host_id] = row
+        if any(capacity is None for available, capacity in map(updates.get, chunk)):
+            previous_capacity.update(db.session.execute(
+                select(HostAvailability.host_id, HostAvailability.capacity)
+                .where(HostAvailability.host_id.in_(chunk), HostAvailability.week_start < week_start)
+                .order_by(HostAvailability.week_start)
+            ).all())
+
+    changed, inserted, became_available = [], [], set()
+    for host_id, (available, capacity) in updates.items():
+        row = existing.get(host_id)
+        if capacity is None:
+            capacity = row.capacity if row is not None else previous_capacity.get(host_id) or 0
+            if available and not capacity:
+                if needs_capacity is not None:
+                    needs_capacity.add(host_id)
+                continue
+        if row is None:
+            inserted.append({'host_id': host_id, 'available': available, 'week_start': week_start,
+                             'capacity': capacity})
+            if available:
+                became_available.add(host_id)
+            continue
+        if available and not row.available:
+            became_available.add(host_id)
+        changed.append({'row_id': row.id, 'new_available': available, 'new_capacity': capacity})
+
+    if changed:
+        db.session.execute(
+            update(HostAvailability.__table__)
+            .where(HostAvailability.id == bindparam('row_id'))
+            .values(available=bindparam('new_available'), capacity=bindparam('new_capacity')),
+            changed,
+        )
+    if inserted:
+        db.session.execute(insert(HostAvailability), inserted)
+    return became_available
+
+
+def archive_availability(before, chunk_size=5000):
+    """
+    Moves the availability rows of weeks starting before `before` to the
+    archive table, one transaction per `chunk_size` rows, so the table the
+    matcher reads only holds recent weeks. Safe to re-run after a crash:
+    each chunk is copied and deleted atomically.
+
+    Returns the number of rows moved.
+    """
+    columns = ['id', 'host_id', 'available', 'capacity', 'week_start']
+    moved = 0
+    while True:
+        with write_transaction(db.session):
+            ids = db.session.scalars(
+                select(HostAvailability.id).where(HostAvailability.week_start < before).limit(chunk_size)
+            ).all()
+            if not ids:
+                break
+            db.session.execute(insert(HostAvailabilityArchive).from_select(
+                columns, select(*[getattr(HostAvailability, column) for column in columns])
+                .where(HostAvailability.id.in_(ids))
+            ))
+            db.session.execute(delete(HostAvailability).where(HostAvailability.id.in_(ids)))
+        moved += len(ids)
+    return moved
+
+
+def _week_totals(model, first_week, last_week):
+    return db.session.execute(
+        select(
+            model.week_start,
+            func.count(),
+            func.count(case((model.available == True, 1))),
+            func.coalesce(func.sum(case((model.available == True, model.capacity), else_=0)), 0),
+        )
+        .where(model.week_start >= first_week, model.week_start <= last_week)
+        .group_by(model.week_start)
+    ).all()
+
+
+def utilization_by_week(first_week, last_week):
+    """
+    Reports, for each week from `first_week` to `last_week` (Mondays), how
+    many hosts answered, how many were available and with how many beds,
+    and the matches made and guests placed that week, from both the recent
+    and the archived availability. Utilization is guests placed over beds
+    offered. Expired matches are left out.
+    """
+    weeks = {}
+    week = first_week
+    while week <= last_week:
+        weeks[week] = {'week_start': week.isoformat(), 'hosts_responded': 0, 'hosts_available': 0,
+                       'capacity_offered': 0, 'matches': 0, 'guests_placed': 0}
+        week += timedelta(weeks=1)
+
+    for model in (HostAvailability, HostAvailabilityArchive):
+        for week_start, responded, available, capacity in _week_totals(model, first_week, last_week):
+            report = weeks.get(week_start)
+            if report is not None:
+                report['hosts_responded'] += responded
+                report['hosts_available'] += available
+                report['capacity_offered'] += capacity
+
+    #  Grouped by day, which every database can do, then rolled up into weeks
+    day = func.date(Match.created_at)
+    for created, matches, guests in db.session.execute(
+        select(day, func.count(), func.sum(StudentRequest.num_guests))
+        .join(StudentRequest, StudentRequest.id == Match.student_request_id)
+        .where(Match.created_at >= datetime.combine(first_week, time.min),
+               Match.created_at < datetime.combine(last_week + timedelta(weeks=1), time.min),
+               Match.status != 'expired')
+        .group_by(day)
+    ):
+        created = date.fromisoformat(created) if isinstance(created, str) else created
+        report = weeks.get(week_start_of(created))
+        if report is not None:
+            report['matches'] += matches
+            report['guests_placed'] += guests or 0
+
+    for report in weeks.values():
+        offered = report['capacity_offered']
+        report['utilization'] = report['guests_placed'] / offered if offered else None
+    return list(weeks.values())
+
+
+def process_replies(messages, index):
+    """
+    Applies a batch of inbound messages (see app.inbox) in arrival order:
+    a host's last "Yes <n>" or "No" wins, one availability write covers
+    the batch, and each message gets its reply through the outbox, keyed
+    by message id so a re-processed message is not answered twice. A bare
+    "Yes" keeps the capacity the host gave last; a host who never gave one
+    is asked for it instead. Messages from numbers that are not hosts are
+    ignored. Commits.
+
+    Returns the processing stats and the locations where hosts became
+    available, to be matched.
+    """
+    hosts = index.lookup(normalize_phone(message['phone']) for message in messages)
+    updates = {}
+    answered = []
+    ignored = 0
+    for message in messages:
+        phone = normalize_phone(message['phone'])
+        host = hosts.get(phone)
+        if host is None:
+            ignored += 1
+            continue
+        reply = parse_reply(message['text'])
+        if reply is not None:
+            available, capacity = reply
+            if available and capacity is None and host[0] in updates:
+                #  An earlier "Yes <n>" in the batch still says how many
+                capacity = updates[host[0]][1]
+            updates[host[0]] = (available, capacity)
+        key = f"webhook-reply:{message['id']}" if message.get('id') else None
+        answered.append((phone, host[0], reply, key))
+
+    needs_capacity = set()
+    with write_transaction(db.session):
+        became_available = save_availability(updates, needs_capacity=needs_capacity)
+        replies = []
+        for phone, host_id, reply, key in answered:
+            if reply is None:
+                body = HELP_REPLY
+            elif not reply[0]:
+                body = NO_REPLY
+            else:
+                body = CAPACITY_REPLY if host_id in needs_capacity else YES_REPLY
+            replies.append((phone, body, key))
+        queued = queue_outbound_messages(replies)
+
+    locations = {host[1] for host in hosts.values() if host[0] in became_available and host[1]}
+    stats = {'messages': len(messages), 'ignored': ignored, 'hosts_updated': len(updates) - len(needs_capacity),
+             'replies': queued}
+    return stats, locations
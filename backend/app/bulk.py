@@ -0,0 +1,447 @@
+"""
+Streaming bulk import of users, host availability and student requests
+from CSV or JSONL, and streaming export of match history.
+
+Rows are read, validated and written a batch at a time, so memory stays
+constant however large the file. Each batch is one transaction: users
+are deduplicated on phone and upserted with one executemany UPDATE and
+one INSERT, and passwords are hashed across a process pool.
+"""
+import csv
+import io
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from itertools import islice, repeat
+
+from flask import current_app
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.orm import aliased
+from werkzeug.security import generate_password_hash
+
+from app import db, cache
+from app.cache import profile_key, user_key
+from app.database import write_transaction
+from app.models import User, HostAvailability, StudentRequest, Match, week_start_of
+from app.preferences import encode_features
+
+IMPORT_KINDS = ('users', 'availability', 'requests')
+FORMATS = ('csv', 'jsonl')
+IMPORT_ROLES = ('host', 'student')  #  Admins are never created or changed by an import
+REQUEST_STATUSES = ('pending', 'matched', 'confirmed', 'cancelled')
+MAX_REPORTED_ERRORS = 100
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', ''}
+
+MATCH_EXPORT_COLUMNS = [
+    'match_id', 'status', 'created_at', 'expires_at', 'host_confirmed', 'student_confirmed',
+    'host_id', 'host_name', 'host_phone', 'request_id', 'student_id', 'student_name', 'student_phone',
+    'location', 'num_guests',
+]
+
+
+def format_for(filename, default='csv'):
+    """
+    Guesses the format from a file name or content type.
+    """
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')) or 'ndjson' in name or 'jsonl' in name:
+        return 'jsonl'
+    if name.endswith('.csv') or 'csv' in name:
+        return 'csv'
+    return default
+
+
+def read_records(lines, fmt):
+    """
+    Yields (line_number, record) for each row of an iterable of text lines.
+    A JSONL line that doesn't parse to an object yields a None record.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_number, record if isinstance(record, dict) else None
+
+
+def _text(record, field, max_length=None, required=False):
+    value = record.get(field)
+    value = str(value).strip() if value is not None else ''
+    if not value:
+        if required:
+            raise ValueError(f"{field} is required")
+        return None
+    if max_length and len(value) > max_length:
+        raise ValueError(f"{field} is longer than {max_length} characters")
+    return value
+
+
+def _phone(record, field='phone'):
+    phone = re.sub(r'[\s\-().]', '', _text(record, field, required=True))
+    if not re.fullmatch(r'\+?\d{6,14}', phone):
+        raise ValueError(f"{field} {phone!r} is not a phone number")
+    return phone
+
+
+def _integer(record, field, minimum, default=None):
+    value = record.get(field)
+    if value is None or value == '':
+        if default is None:
+            raise ValueError(f"{field} is required")
+        return default
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} {value!r} is not a whole number")
+    if number < minimum:
+        raise ValueError(f"{field} must be at least {minimum}")
+    return number
+
+
+def _boolean(record, field):
+    value = record.get(field)
+    if isinstance(value, bool):
+        return value
+    value = str(value if value is not None else '').strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f"{field} {value!r} is not true or false")
+
+
+def _timestamp(record, field, parse):
+    value = _text(record, field)
+    if value is None:
+        return None
+    try:
+        return parse(value)
+    except ValueError:
+        raise ValueError(f"{field} {value!r} is not an ISO date")
+
+
+def validate_user(record):
+    role = _text(record, 'role', required=True).lower()
+    if role not in IMPORT_ROLES:
+        raise ValueError(f"role must be one of {', '.join(IMPORT_ROLES)}")
+    return {
+        'phone': _phone(record),
+        'name': _text(record, 'name', 100, required=True),
+        'role': role,
+        'location': _text(record, 'location', 255),
+        'about_me': _text(record, 'about_me'),
+        'preferences': _text(record, 'preferences'),
+        'password': _text(record, 'password'),
+    }
+
+
+def validate_availability(record):
+    return {
+        'phone': _phone(record),
+        'available': _boolean(record, 'available'),
+        'capacity': _integer(record, 'capacity', 0, default=0),
+        'week_start': week_start_of(_timestamp(record, 'week_start', date.fromisoformat) or datetime.utcnow().date()),
+    }
+
+
+def validate_request(record):
+    status = (_text(record, 'status') or 'pending').lower()
+    if status not in REQUEST_STATUSES:
+        raise ValueError(f"status must be one of {', '.join(REQUEST_STATUSES)}")
+    return {
+        'phone': _phone(record),
+        'location': _text(record, 'location', 255, required=True),
+        'num_guests': _integer(record, 'num_guests', 1),
+        'created_at': _timestamp(record, 'created_at', datetime.fromisoformat) or datetime.utcnow(),
+        'status': status,
+    }
+
+
+VALIDATORS = {'users': validate_user, 'availability': validate_availability, 'requests': validate_request}
+
+
+def _ids_by_phone(phones, role):
+    ids = {}
+    phones = list(phones)
+    for offset in range(0, len(phones), 500):
+        ids.update(db.session.execute(
+            select(User.phone, User.id)
+            .where(User.phone.in_(phones[offset:offset + 500]), User.role == role)
+        ).all())
+    return ids
+
+
+def _write_users(rows, hasher, stale_keys):
+    #  Rows for the same phone merge, later non-empty values winning, the
+    #  same way a row updates a stored user
+    merged = {}
+    for line, row in rows:
+        if row['phone'] in merged:
+            merged[row['phone']][1].update((field, value) for field, value in row.items() if value is not None)
+        else:
+            merged[row['phone']] = (line, row)
+
+    #  Hash before the first query, so the batch's transaction hasn't begun
+    #  while the pool works
+    with_password = [row for _, row in merged.values() if row['password']]
+    if with_password:
+        hashes = hasher([row['password'] for row in with_password])
+        for row, password_hash in zip(with_password, hashes):
+            row['password_hash'] = password_hash
+
+    existing = {}
+    phones = list(merged)
+    for offset in range(0, len(phones), 500):
+        for user in db.session.execute(
+            select(User.id, User.phone, User.role, User.preferences, User.about_me)
+            .where(User.phone.in_(phones[offset:offset + 500]))
+        ):
+            existing[user.phone] = user
+    errors = [(merged.pop(phone)[0], f"phone {phone} belongs to an admin")
+              for phone, user in existing.items() if user.role not in IMPORT_ROLES]
+    rows = [row for _, row in merged.values()]
+    for row in rows:
+        stored = existing.get(row['phone'])
+        row['features'] = encode_features(
+            row['role'],
+            row['preferences'] if row['preferences'] is not None or stored is None else stored.preferences,
+            row['about_me'] if row['about_me'] is not None or stored is None else stored.about_me,
+        )
+
+    updates = [
+        {'b_id': existing[row['phone']].id, 'b_name': row['name'], 'b_role': row['role'],
+         'b_location': row['location'], 'b_about_me': row['about_me'], 'b_preferences': row['preferences'],
+         'b_features': row['features'], 'b_password_hash': row.get('password_hash')}
+        for row in rows if row['phone'] in existing
+    ]
+    inserts = [
+        {'phone': row['phone'], 'name': row['name'], 'role': row['role'], 'location': row['location'],
+         'about_me': row['about_me'], 'preferences': row['preferences'], 'features': row['features'],
+         'password_hash': row.get('password_hash')}
+        for row in rows if row['phone'] not in existing
+    ]
+    if updates:
+        #  Empty cells keep what is stored
+        db.session.execute(
+            update(User.__table__)
+            .where(User.id == bindparam('b_id'))
+            .values(
+                name=bindparam('b_name'),
+                role=bindparam('b_role'),
+                location=func.coalesce(bindparam('b_location'), User.location),
+                about_me=func.coalesce(bindparam('b_about_me'), User.about_me),
+                preferences=func.coalesce(bindparam('b_preferences'), User.preferences),
+                features=bindparam('b_features'),
+                password_hash=func.coalesce(bindparam('b_password_hash'), User.password_hash),
+            ),
+            updates,
+        )
+        stale_keys.extend(key for row in updates for key in (profile_key(row['b_id']), user_key(row['b_id'])))
+    if inserts:
+        db.session.execute(insert(User), inserts)
+    return len(inserts), len(updates), errors
+
+
+def _write_availability(rows, hasher, stale_keys):
+    host_ids = _ids_by_phone({row['phone'] for _, row in rows}, 'host')
+    errors = [(line, f"no host with phone {row['phone']}") for line, row in rows if row['phone'] not in host_ids]
+    latest = {}
+    for _, row in rows:
+        if row['phone'] in host_ids:
+            latest[(host_ids[row['phone']], row['week_start'])] = row
+
+    existing = {}
+    ids = list({host_id for host_id, _ in latest})
+    for offset in range(0, len(ids), 500):
+        for availability_id, host_id, week_start in db.session.execute(
+            select(HostAvailability.id, HostAvailability.host_id, HostAvailability.week_start)
+            .where(HostAvailability.host_id.in_(ids[offset:offset + 500]))
+        ):
+            existing[(host_id, week_start)] = availability_id
+
+    updates, inserts = [], []
+    for (host_id, week_start), row in latest.items():
+        if (host_id, week_start) in existing:
+            updates.append({'b_id': existing[(host_id, week_start)], 'b_available': row['available'],
+                            'b_capacity': row['capacity']})
+        else:
+            inserts.append({'host_id': host_id, 'week_start': week_start, 'available': row['available'],
+                            'capacity': row['capacity']})
+    if updates:
+        db.session.execute(
+            update(HostAvailability.__table__)
+            .where(HostAvailability.id == bindparam('b_id'))
+            .values(available=bindparam('b_available'), capacity=bindparam('b_capacity')),
+            updates,
+        )
+    if inserts:
+        db.session.execute(insert(HostAvailability), inserts)
+    return len(inserts), len(updates), errors
+
+
+def _write_requests(rows, hasher, stale_keys):
+    student_ids = _ids_by_phone({row['phone'] for _, row in rows}, 'student')
+    errors = [(line, f"no student with phone {row['phone']}") for line, row in rows if row['phone'] not in student_ids]
+    inserts = [
+        {'student_id': student_ids[row['phone']], 'location': row['location'], 'num_guests': row['num_guests'],
+         'created_at': row['created_at'], 'status': row['status']}
+        for _, row in rows if row['phone'] in student_ids
+    ]
+    if inserts:
+        db.session.execute(insert(StudentRequest), inserts)
+    return len(inserts), 0, errors
+
+
+WRITERS = {'users': _write_users, 'availability': _write_availability, 'requests': _write_requests}
+
+
+class PasswordHasher:
+    """
+    Hashes batches of passwords with PASSWORD_HASH_METHOD across a process
+    pool, started on first use and shut down with `close`.
+    """
+
+    def __init__(self, method, workers=None):
+        self.method = method
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+
+    def __call__(self, passwords):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self._pool.map(generate_password_hash, passwords, repeat(self.method), chunksize=chunksize))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def import_records(kind, lines, fmt, batch_size=None):
+    """
+    Imports rows of `kind` from an iterable of text lines in `fmt`,
+    committing a batch at a time. Invalid rows are skipped and reported.
+    Must run in an app context.
+
+    Returns a report with the rows read, inserted, updated and skipped, and
+    the first errors as {'line', 'error'}.
+    """
+    validate, write = VALIDATORS[kind], WRITERS[kind]
+    batch_size = batch_size or current_app.config['BULK_BATCH_SIZE']
+    hasher = PasswordHasher(current_app.config['PASSWORD_HASH_METHOD'], current_app.config['BULK_HASH_WORKERS'])
+    report = {'kind': kind, 'rows': 0, 'inserted': 0, 'updated': 0, 'skipped': 0, 'errors': []}
+
+    def skip(line, error):
+        report['skipped'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': line, 'error': error})
+
+    records = read_records(lines, fmt)
+    try:
+        while True:
+            chunk = list(islice(records, batch_size))
+            if not chunk:
+                break
+            rows = []
+            for line, record in chunk:
+                report['rows'] += 1
+                if record is None:
+                    skip(line, 'not a JSON object')
+                    continue
+                try:
+                    rows.append((line, validate(record)))
+                except ValueError as e:
+                    skip(line, str(e))
+            stale_keys = []
+            with write_transaction(db.session):
+                inserted, updated, errors = write(rows, hasher, stale_keys) if rows else (0, 0, [])
+            if stale_keys:
+                cache.delete(*stale_keys)
+            report['inserted'] += inserted
+            report['updated'] += updated
+            for line, error in errors:
+                skip(line, error)
+    finally:
+        hasher.close()
+        db.session.rollback()
+    return report
+
+
+def rebuild_features(batch_size=None):
+    """
+    Recomputes every user's preference vector, a batch of users per
+    transaction. Run after the vector layout in app.preferences changes.
+
+    Returns the number of users updated.
+    """
+    batch_size = batch_size or current_app.config['BULK_BATCH_SIZE']
+    after_id, updated = 0, 0
+    while True:
+        with write_transaction(db.session):
+            users = db.session.execute(
+                select(User.id, User.role, User.preferences, User.about_me)
+                .where(User.id > after_id).order_by(User.id).limit(batch_size)
+            ).all()
+            if not users:
+                return updated
+            db.session.execute(
+                update(User.__table__).where(User.id == bindparam('b_id')).values(features=bindparam('b_features')),
+                [{'b_id': user.id, 'b_features': encode_features(user.role, user.preferences, user.about_me)}
+                 for user in users],
+            )
+        updated += len(users)
+        after_id = users[-1].id
+
+
+def _serialize_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def export_matches(fmt, after_id=0, batch_size=None):
+    """
+    Yields the match history, oldest first, as chunks of CSV (with a header)
+    or JSONL text. Pages through matches by id, ending the read transaction
+    after each page so a long export holds no snapshot open.
+    """
+    batch_size = batch_size or current_app.config['BULK_BATCH_SIZE']
+    host, student = aliased(User), aliased(User)
+    query = (
+        select(Match.id, Match.status, Match.created_at, Match.expires_at, Match.host_confirmed,
+               Match.student_confirmed, Match.host_id, host.name, host.phone, StudentRequest.id,
+               StudentRequest.student_id, student.name, student.phone, StudentRequest.location,
+               StudentRequest.num_guests)
+        .join(host, host.id == Match.host_id)
+        .join(StudentRequest, StudentRequest.id == Match.student_request_id)
+        .join(student, student.id == StudentRequest.student_id)
+        .order_by(Match.id)
+        .limit(batch_size)
+    )
+    if fmt == 'csv':
+        yield ','.join(MATCH_EXPORT_COLUMNS) + '\r\n'
+    while True:
+        rows = db.session.execute(query.where(Match.id > after_id)).all()
+        db.session.rollback()
+        if not rows:
+            return
+        out = io.StringIO()
+        if fmt == 'csv':
+            writer = csv.writer(out)
+            writer.writerows([_serialize_value(value) for value in row] for row in rows)
+        else:
+            for row in rows:
+                out.write(json.dumps(dict(zip(MATCH_EXPORT_COLUMNS, map(_serialize_value, row)))) + '\n')
+        yield out.getvalue()
+        after_id = rows[-1][0]
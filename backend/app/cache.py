@@ -0,0 +1,212 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    In-process cache with per-entry TTLs that evicts the least recently
+    used entry once `max_entries` is reached.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+class RedisCache:
+    """
+    Cache stored in Redis, shared by every web and Celery worker process.
+    """
+
+    def __init__(self, client, prefix):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode() if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=max(1, int(ttl)))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+
+class Cache:
+    """
+    Read-through cache for serialized responses and user rows.
+
+    Backed by Redis when CACHE_TYPE is 'redis' and the server is reachable,
+    otherwise by an in-process LRU. Values are strings; callers serialize.
+    With the LRU fallback each process has its own copy, so writes in one
+    process are only seen by the others after CACHE_DEFAULT_TTL.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.default_ttl = 60
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def init_app(self, app):
+        self.default_ttl = app.config['CACHE_DEFAULT_TTL']
+        cache_type = app.config['CACHE_TYPE']
+        self.backend = None
+        if cache_type == 'redis':
+            self.backend = self._connect_redis(app.config['CACHE_REDIS_URL'])
+        if self.backend is None and cache_type != 'none':
+            self.backend = LRUCache(app.config['CACHE_MAX_ENTRIES'])
+
+    def _connect_redis(self, url):
+        try:
+            import redis
+            client = redis.Redis.from_url(url, socket_connect_timeout=0.2, socket_timeout=0.5)
+            client.ping()
+        except Exception as e:
+            log.warning("Cache: Redis unavailable (%s), using in-process LRU", e)
+            return None
+        return RedisCache(client, prefix='aii:cache:')
+
+    def get(self, key):
+        if self.backend is None:
+            return None
+        try:
+            value = self.backend.get(key)
+        except Exception:
+            self.errors += 1
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        if self.backend is None:
+            return
+        try:
+            self.backend.set(key, value, ttl or self.default_ttl)
+        except Exception:
+            self.errors += 1
+
+    def delete(self, *keys):
+        if self.backend is None or not keys:
+            return
+        try:
+            self.backend.delete(*keys)
+        except Exception:
+            self.errors += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__ if self.backend else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class AsyncCache:
+    """
+    A Cache's entries for coroutines: read and written through an asyncio
+    Redis client when the Cache is backed by Redis, or straight from its
+    in-process LRU, which never waits on I/O. Hits, misses and errors
+    count towards the Cache's stats.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.client = None
+
+    def init_app(self, app):
+        self.client = None
+        if isinstance(self.cache.backend, RedisCache):
+            import redis.asyncio
+            self.client = redis.asyncio.Redis.from_url(app.config['CACHE_REDIS_URL'], socket_connect_timeout=0.2,
+                                                       socket_timeout=0.5)
+
+    async def get(self, key):
+        cache = self.cache
+        if cache.backend is None:
+            return None
+        try:
+            if self.client is not None:
+                value = await self.client.get(cache.backend.prefix + key)
+                value = value.decode() if value is not None else None
+            else:
+                value = cache.backend.get(key)
+        except Exception:
+            cache.errors += 1
+            value = None
+        if value is None:
+            cache.misses += 1
+        else:
+            cache.hits += 1
+        return value
+
+    async def set(self, key, value, ttl=None):
+        cache = self.cache
+        if cache.backend is None:
+            return
+        ttl = ttl or cache.default_ttl
+        try:
+            if self.client is not None:
+                await self.client.set(cache.backend.prefix + key, value, ex=max(1, int(ttl)))
+            else:
+                cache.backend.set(key, value, ttl)
+        except Exception:
+            cache.errors += 1
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+
+
+def profile_key(user_id):
+    return f"profile:{user_id}"
+
+
+def user_key(user_id):
+    return f"user:{user_id}"
+
+
+def request_key(request_id):
+    return f"request:{request_id}"
+
+
+def match_key(match_id):
+    return f"match:{match_id}"
@@ -7,5 +7,70 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'supersecretkey')
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///site.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    READ_REPLICA_URL = os.getenv('READ_REPLICA_URL')  # Optional; GET requests read from it
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))  # Per process; server databases only
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))  # Seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))  # Seconds; stay under the server's idle timeout
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 10))  # Per ASGI worker, for the routes Flask still serves
+    ASYNC_SQLITE_POOL_SIZE = int(os.getenv('ASYNC_SQLITE_POOL_SIZE', 2))  # aiosqlite runs a thread per connection; more mostly add contention
+    SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'wal')
+    SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'normal')  # Safe with WAL; 'full' for rollback journals
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
     CELERY_BROKER_URL = 'redis://localhost:6379/0'
     CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
+    CELERY_PUBLISH_TIMEOUT = float(os.getenv('CELERY_PUBLISH_TIMEOUT', 0.5))  # Seconds a web request waits on the broker before giving up on a background task
+    RATELIMIT_STORAGE_URI = os.getenv('RATELIMIT_STORAGE_URI', 'redis://localhost:6379/2')  # Shared by every web worker; 'memory://' counts per process
+    RATELIMIT_STORAGE_OPTIONS = {'socket_connect_timeout': 0.2, 'socket_timeout': 0.5}
+    RATELIMIT_STRATEGY = os.getenv('RATELIMIT_STRATEGY', 'sliding-window-counter')  # Or 'fixed-window', 'moving-window'
+    RATELIMIT_DEFAULT = os.getenv('RATELIMIT_DEFAULT', '200 per day;50 per hour')  # Per user when logged in, else per IP
+    RATELIMIT_KEY_PREFIX = 'aii:limits'
+    RATELIMIT_IN_MEMORY_FALLBACK_ENABLED = True  # Count per process while Redis is unreachable
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')  # Werkzeug method string; existing hashes upgrade on login
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))  # Hashing processes per web worker; 0 hashes in the request thread
+    PASSWORD_HASH_QUEUE_PER_WORKER = 4  # Logins allowed to wait per hashing process
+    PASSWORD_HASH_QUEUE_TIMEOUT = 2  # Seconds to wait for a hashing slot before answering 503
+    BULK_BATCH_SIZE = int(os.getenv('BULK_BATCH_SIZE', 2000))  # Rows validated and written per transaction by imports and exports
+    BULK_HASH_WORKERS = int(os.getenv('BULK_HASH_WORKERS', 0))  # Processes hashing imported passwords; 0 is one per CPU
+    CACHE_TYPE = os.getenv('CACHE_TYPE', 'redis')  # 'redis' (falls back to in-process), 'memory' or 'none'
+    CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/1')
+    CACHE_DEFAULT_TTL = int(os.getenv('CACHE_DEFAULT_TTL', 60))  # Seconds
+    CACHE_MAX_ENTRIES = 10000  # In-process LRU only
+    EVENTS_REDIS_URL = os.getenv('EVENTS_REDIS_URL', 'redis://localhost:6379/0')  # Pub/sub for match events
+    SSE_HEARTBEAT_SECONDS = 15  # Keeps idle streams open through proxies
+    SSE_QUEUE_SIZE = 100  # Events buffered per stream before the oldest are dropped
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_ASYNC = os.getenv('LOG_ASYNC', 'true').lower() == 'true'  # Write log records from a background thread
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))  # Records beyond this are dropped rather than block a request
+    LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.1))  # Share of high-volume info events (e.g. the access log) kept
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'  # Prometheus metrics on /metrics
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # If set, /metrics requires "Authorization: Bearer <token>"
+    WORKER_METRICS_PORT = int(os.getenv('WORKER_METRICS_PORT', 0))  # Celery workers serve metrics from here up; 0 disables
+    PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', 'false').lower() == 'true'  # Sample stacks of slow requests; threaded workers only
+    PROFILER_INTERVAL_MS = float(os.getenv('PROFILER_INTERVAL_MS', 5))
+    PROFILER_SLOW_REQUEST_MS = float(os.getenv('PROFILER_SLOW_REQUEST_MS', 500))  # Requests slower than this get a .folded file
+    PROFILER_OUTPUT_DIR = os.getenv('PROFILER_OUTPUT_DIR', 'profiles')
+    MATCHING_STRATEGY = os.getenv('MATCHING_STRATEGY', 'greedy')  # 'greedy' or 'optimal'
+    MATCHING_COMMIT_CHUNK_SIZE = int(os.getenv('MATCHING_COMMIT_CHUNK_SIZE', 500))
+    AVAILABILITY_HOT_WEEKS = int(os.getenv('AVAILABILITY_HOT_WEEKS', 4))  # Past weeks kept beside the current one; older ones are archived
+    AVAILABILITY_ARCHIVE_CHUNK_SIZE = 5000  # Rows archived per transaction
+    MATCH_CONFIRMATION_HOURS = 24  # Unconfirmed matches expire after this long
+    MATCHING_RADIUS_KM = float(os.getenv('MATCHING_RADIUS_KM', 15))  # Fall back to hosts this close; 0 disables
+    WHATSAPP_APP_SECRET = os.getenv('WHATSAPP_APP_SECRET')  # If set, webhook bodies must carry a valid X-Hub-Signature-256
+    WHATSAPP_VERIFY_TOKEN = os.getenv('WHATSAPP_VERIFY_TOKEN')  # Echoed back to Meta's webhook subscription check
+    INBOUND_REDIS_URL = os.getenv('INBOUND_REDIS_URL', 'redis://localhost:6379/0')  # Queue and dedupe set for webhook messages
+    INBOUND_BATCH_SIZE = 500  # Webhook messages applied per transaction
+    INBOUND_DEDUPE_SECONDS = 7 * 24 * 3600  # Meta retries undelivered webhooks for up to a week
+    INBOUND_DEDUPE_MAX_ENTRIES = 100000  # In-process fallback only
+    INBOUND_FLUSH_MS = 50  # In-process fallback: how often buffered messages go to the worker
+    INBOUND_LEASE_SECONDS = 300  # A batch not committed by then is taken again by the next drain
+    HOST_PHONE_CACHE_SECONDS = 300  # How long the worker caches phone -> host lookups
+    WHATSAPP_RATE_PER_SECOND = float(os.getenv('WHATSAPP_RATE_PER_SECOND', 80))  # Graph API limit per phone number ID
+    OUTBOX_BATCH_SIZE = 500
+    OUTBOX_MAX_ATTEMPTS = 8
+    OUTBOX_DRAIN_SECONDS = 50  # How long one drain_outbox task sends before handing over
+    OUTBOX_LEASE_SECONDS = 300  # Claims older than this are assumed lost and re-sent (raised to fit a batch at the rate)
+    OUTBOX_REDIS_URL = os.getenv('OUTBOX_REDIS_URL', 'redis://localhost:6379/0')  # Lock keeping drains to one at a time
+    OUTBOX_ASYNC_HTTP = os.getenv('OUTBOX_ASYNC_HTTP', 'false').lower() == 'true'  # Send batches from an event loop with httpx rather than the thread pool
+    FANOUT_CHUNK_SIZE = 1000  # Hosts per weekly availability chunk task
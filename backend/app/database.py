@@ -0,0 +1,162 @@
+from contextlib import contextmanager
+
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_BIND = 'replica'
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+
+def normalize_database_url(url):
+    #  Heroku-style URLs use the scheme SQLAlchemy 1.4 dropped
+    if url and url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def engine_options(config, url):
+    """
+    Returns the create_engine options for `url`: a pool sized from the
+    DB_POOL_* settings for server databases, a busy timeout for SQLite.
+    """
+    backend = make_url(url).get_backend_name()
+    if backend == 'sqlite':
+        return {'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000}}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def configure_engines(config):
+    """
+    Fills in the engine options and, if READ_REPLICA_URL is set, the replica
+    bind, from the DB_* and SQLITE_* settings.
+    """
+    url = normalize_database_url(config['SQLALCHEMY_DATABASE_URI'])
+    config['SQLALCHEMY_DATABASE_URI'] = url
+    config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(config, url))
+
+    replica_url = normalize_database_url(config.get('READ_REPLICA_URL'))
+    if replica_url:
+        binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+        binds[REPLICA_BIND] = {'url': replica_url, **engine_options(config, replica_url)}
+        config['SQLALCHEMY_BINDS'] = binds
+
+
+def async_database_url(url):
+    """
+    Returns `url` with the async driver for its database: aiosqlite for
+    SQLite, asyncpg for PostgreSQL.
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for {backend!r} databases")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def use_read_replica():
+    """
+    Sends this request's reads to the replica, when one is configured.
+    """
+    g.use_read_replica = True
+
+
+def defer_write_lock():
+    """
+    Starts this request's SQLite transactions deferred, so they take the
+    write lock at their first write rather than at BEGIN. For write routes
+    that end their reads before slow work such as password hashing.
+    """
+    g.sqlite_begin = 'DEFERRED'
+
+
+@contextmanager
+def write_transaction(session):
+    """
+    Runs the block in a transaction of its own, committed at the end and
+    rolled back if the block raises. On SQLite the transaction takes the
+    write lock at BEGIN, so a block that reads and then writes waits for
+    other writers rather than failing at its first write. Keep network
+    calls and slow work out of the block.
+    """
+    session.commit()
+    previous = g.get('sqlite_begin')
+    g.sqlite_begin = 'IMMEDIATE'
+    try:
+        yield
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        g.sqlite_begin = previous
+
+
+class RoutingSession(Session):
+    """
+    Session that sends reads to the read replica during requests that
+    opted in with use_read_replica(). Flushes and UPDATE/INSERT/DELETE
+    statements always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if (
+            bind is None
+            and not self._flushing
+            and not isinstance(clause, UpdateBase)
+            and has_app_context()
+            and g.get('use_read_replica')
+            and engine is self._db.engines.get(None)
+        ):
+            return self._db.engines.get(REPLICA_BIND, engine)
+        return engine
+
+
+class AsyncDatabase:
+    """
+    Async engines over the same database and read replica as the
+    Flask-SQLAlchemy ones, with the same pool settings, for the coroutine
+    routes in app.async_routes. Those routes only read, so sessions use
+    the replica when one is configured.
+    """
+
+    def __init__(self):
+        self.engines = {}
+        self._sessions = None
+
+    def init_app(self, app):
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        urls = {None: app.config['SQLALCHEMY_DATABASE_URI']}
+        replica_url = normalize_database_url(app.config.get('READ_REPLICA_URL'))
+        if replica_url:
+            urls[REPLICA_BIND] = replica_url
+        self.engines = {}
+        for bind, url in urls.items():
+            options = engine_options(app.config, url)
+            if make_url(url).get_backend_name() == 'sqlite':
+                #  The sessions only read, and SQLite opens no transaction for a
+                #  SELECT, so skip the rollback on check-in: each one is another
+                #  hop to the connection's thread
+                options.update(pool_size=app.config['ASYNC_SQLITE_POOL_SIZE'], max_overflow=0,
+                               pool_reset_on_return=None)
+            self.engines[bind] = create_async_engine(async_database_url(url), **options)
+        engine = self.engines.get(REPLICA_BIND, self.engines[None])
+        self._sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+    def session(self):
+        """
+        Returns a new AsyncSession; use it as an async context manager.
+        """
+        return self._sessions()
+
+    async def dispose(self):
+        for engine in self.engines.values():
+            await engine.dispose()
@@ -0,0 +1,144 @@
+import json
+import logging
+import queue
+import threading
+
+log = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'aii:events:user:'
+
+
+class Subscription:
+    """
+    One open event stream. Events are buffered in a bounded queue; a client
+    that stops reading loses its oldest events rather than holding memory.
+    """
+
+    def __init__(self, user_id, max_events):
+        self.user_id = user_id
+        self.events = queue.Queue(maxsize=max_events)
+
+    def put(self, message):
+        try:
+            self.events.put_nowait(message)
+        except queue.Full:
+            try:
+                self.events.get_nowait()
+            except queue.Empty:
+                pass
+            self.events.put_nowait(message)
+
+    def get(self, timeout):
+        """
+        Returns the next serialized event, or None after `timeout` seconds.
+        """
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """
+    Delivers per-user events (match created, confirmed, expired) to the
+    event streams open in this process.
+
+    Events are published on Redis pub/sub so that any web or Celery worker
+    can reach a client connected to any web process. Each process holds a
+    single pattern subscription and fans messages out to its local streams,
+    so idle clients cost a queue each rather than a Redis connection. If
+    Redis is unreachable, events only reach streams in the publishing
+    process.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.max_events = 100
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def init_app(self, app):
+        self.max_events = app.config['SSE_QUEUE_SIZE']
+        self.client = self._connect_redis(app.config['EVENTS_REDIS_URL'])
+
+    def _connect_redis(self, url):
+        try:
+            import redis
+            client = redis.Redis.from_url(url, socket_connect_timeout=0.2)
+            client.ping()
+        except Exception as e:
+            log.warning("Events: Redis unavailable (%s), delivering in-process only", e)
+            return None
+        return client
+
+    def publish(self, user_id, event, data):
+        self.publish_many([(user_id, event, data)])
+
+    def publish_many(self, events):
+        """
+        Publishes (user_id, event, data) tuples in one round trip. Errors are
+        logged, not raised: a missed push only means the client sees the
+        change on its next fetch.
+        """
+        if not events:
+            return
+        if self.client is None:
+            for user_id, event, data in events:
+                self._deliver(str(user_id), json.dumps({'event': event, 'data': data}, default=str))
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for user_id, event, data in events:
+                pipe.publish(f"{CHANNEL_PREFIX}{user_id}", json.dumps({'event': event, 'data': data}, default=str))
+            pipe.execute()
+        except Exception as e:
+            log.error("Failed to publish %d events: %s", len(events), e)
+
+    def subscribe(self, user_id):
+        subscription = Subscription(str(user_id), self.max_events)
+        with self._lock:
+            self._subscriptions.setdefault(subscription.user_id, set()).add(subscription)
+            if self.client is not None and self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='event-listener', daemon=True)
+                self._listener.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def connections(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscriptions.values())
+
+    def _deliver(self, user_id, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.put(message)
+
+    def _listen(self):
+        #  Reconnects on error so a Redis restart does not silently stop delivery
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                for message in pubsub.listen():
+                    user_id = message['channel'].decode()[len(CHANNEL_PREFIX):]
+                    self._deliver(user_id, message['data'].decode())
+            except Exception as e:
+                log.error("Event listener error: %s", e)
+                threading.Event().wait(1)
+
+
+def format_event(message):
+    """
+    Formats a published message as a Server-Sent Events frame.
+    """
+    payload = json.loads(message)
+    return f"event: {payload['event']}\ndata: {json.dumps(payload['data'])}\n\n"
@@ -0,0 +1,86 @@
+from datetime import datetime
+
+from sqlalchemy import select, update
+
+from app import db, cache, events
+from app.cache import match_key, request_key
+from app.models import User, StudentRequest, Match
+from app.outbox import queue_outbound_messages
+from app.whatsapp import generate_match_expired_host, generate_match_expired_student
+
+
+def mark_expired_matches(now):
+    """
+    Flips every pending match past its deadline to 'expired' with a single
+    UPDATE and returns (match_id, student_request_id, host_id) for each.
+    Uses RETURNING where the database supports it.
+    """
+    stmt = (
+        update(Match)
+        .where(Match.status == 'pending', Match.expires_at < now)
+        .values(status='expired')
+        .execution_options(synchronize_session=False)
+    )
+    if db.engine.dialect.update_returning:
+        return db.session.execute(
+            stmt.returning(Match.id, Match.student_request_id, Match.host_id)
+        ).all()
+
+    expired = db.session.execute(
+        select(Match.id, Match.student_request_id, Match.host_id)
+        .where(Match.status == 'pending', Match.expires_at < now)
+        .with_for_update()
+    ).all()
+    if expired:
+        db.session.execute(stmt.where(Match.id.in_([m.id for m in expired])))
+    return expired
+
+
+def expire_matches(now=None):
+    """
+    Expires matches that were not confirmed in time, puts their student
+    requests back in the matching queue and queues a notification to each
+    host and student, all in one transaction.
+
+    Only newly expired matches are touched, so the cost of a run does not
+    grow with match history. Returns the number of matches expired and the
+    locations of the re-queued requests, so they can be re-matched.
+    """
+    now = now or datetime.utcnow()
+    expired = mark_expired_matches(now)
+    if not expired:
+        db.session.commit()
+        return 0, set()
+
+    request_ids = [m.student_request_id for m in expired]
+    db.session.execute(
+        update(StudentRequest)
+        .where(StudentRequest.id.in_(request_ids), StudentRequest.status == 'matched')
+        .values(status='pending')
+        .execution_options(synchronize_session=False)
+    )
+
+    Host = db.aliased(User)
+    Student = db.aliased(User)
+    rows = db.session.execute(
+        select(Match.id, Match.student_request_id, Match.host_id, StudentRequest.student_id,
+               Host.phone.label('host_phone'), Student.phone.label('student_phone'), StudentRequest.location)
+        .join(Host, Host.id == Match.host_id)
+        .join(StudentRequest, StudentRequest.id == Match.student_request_id)
+        .join(Student, Student.id == StudentRequest.student_id)
+        .where(Match.id.in_([m.id for m in expired]))
+    ).all()
+
+    messages = []
+    for row in rows:
+        messages.append((row.host_phone, generate_match_expired_host(), f"match-expired:{row.id}:host"))
+        messages.append((row.student_phone, generate_match_expired_student(row.location), f"match-expired:{row.id}:student"))
+    queue_outbound_messages(messages)
+
+    db.session.commit()
+    cache.delete(*[match_key(m.id) for m in expired], *[request_key(m.student_request_id) for m in expired])
+    events.publish_many([
+        (user_id, 'match_expired', {'id': row.id, 'student_request_id': row.student_request_id, 'status': 'expired'})
+        for row in rows for user_id in (row.host_id, row.student_id)
+    ])
+    return len(expired), {row.location for row in rows}
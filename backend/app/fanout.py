@@ -0,0 +1,72 @@
+import time
+
+from sqlalchemy import select
+
+from app import db
+from app.database import write_transaction
+from app.models import User, TaskCheckpoint
+from app.outbox import queue_outbound_messages
+from app.whatsapp import generate_availability_request_message
+
+
+def get_checkpoint(name):
+    """
+    Returns the last position recorded for a task, or 0 if it never ran.
+    """
+    checkpoint = db.session.get(TaskCheckpoint, name)
+    return checkpoint.position if checkpoint else 0
+
+
+def set_checkpoint(name, position):
+    """
+    Records a task's progress and commits it.
+    """
+    with write_transaction(db.session):
+        checkpoint = db.session.get(TaskCheckpoint, name)
+        if checkpoint is None:
+            checkpoint = TaskCheckpoint(name=name)
+            db.session.add(checkpoint)
+        checkpoint.position = position
+
+
+def host_id_pages(page_size, after_id=0):
+    """
+    Yields (first_id, last_id) for consecutive pages of at most
+    `page_size` host ids, using keyset pagination so only one page of
+    ids is held in memory at a time.
+    """
+    while True:
+        ids = db.session.scalars(
+            select(User.id)
+            .where(User.role == 'host', User.id > after_id)
+            .order_by(User.id)
+            .limit(page_size)
+        ).all()
+        if not ids:
+            return
+        yield ids[0], ids[-1]
+        after_id = ids[-1]
+
+
+def queue_availability_requests(week, first_id, last_id):
+    """
+    Queues the weekly availability request for the hosts with ids in
+    [first_id, last_id] and commits. Returns the chunk's timing report.
+    """
+    start = time.perf_counter()
+    message = generate_availability_request_message()
+    with write_transaction(db.session):
+        hosts = db.session.execute(
+            select(User.id, User.phone)
+            .where(User.role == 'host', User.id >= first_id, User.id <= last_id)
+        ).all()
+        queued = queue_outbound_messages([
+            (host.phone, message, f"availability:{week}:{host.id}") for host in hosts
+        ])
+    return {
+        'first_id': first_id,
+        'last_id': last_id,
+        'hosts': len(hosts),
+        'queued': queued,
+        'seconds': time.perf_counter() - start,
+    }
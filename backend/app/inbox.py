@@ -0,0 +1,302 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import deque
+
+from app.cache import LRUCache
+
+log = logging.getLogger(__name__)
+
+QUEUE_KEY = 'aii:inbox:messages'
+DEDUPE_PREFIX = 'aii:inbox:seen:'
+SCHEDULED_KEY = 'aii:inbox:scheduled'
+CLAIMS_KEY = 'aii:inbox:claims'
+CLAIM_PREFIX = 'aii:inbox:claim:'
+PROCESS_TASK = 'celery_worker.process_inbound_messages'
+
+#  Marks the message id as seen and queues the message in one round trip.
+#  Returns 0 for a duplicate, 1 when queued, and 2 when queued and no
+#  worker has been asked to drain the queue yet.
+_SUBMIT_SCRIPT = """
+if not redis.call('SET', KEYS[1], 1, 'NX', 'EX', ARGV[2]) then
+    return 0
+end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+if redis.call('SET', KEYS[3], 1, 'NX', 'EX', ARGV[3]) then
+    return 2
+end
+return 1
+"""
+
+#  Puts the messages of claims whose lease ran out back at the head of the
+#  queue, in order, then moves up to ARGV[3] messages from the queue into
+#  the new claim ARGV[5], leased until ARGV[2]. Returns the claimed messages.
+_POP_SCRIPT = """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, token in ipairs(stale) do
+    local claim = ARGV[4] .. token
+    local items = redis.call('LRANGE', claim, 0, -1)
+    for i = #items, 1, -1 do
+        redis.call('LPUSH', KEYS[1], items[i])
+    end
+    redis.call('DEL', claim)
+    redis.call('ZREM', KEYS[2], token)
+end
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[3]) - 1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    redis.call('RPUSH', ARGV[4] .. ARGV[5], unpack(items))
+    redis.call('ZADD', KEYS[2], ARGV[2], ARGV[5])
+end
+return items
+"""
+
+YES_PATTERN = re.compile(r'^\s*(?:yes|y|כן)\b\W*(\d+)?', re.IGNORECASE)
+NO_PATTERN = re.compile(r'^\s*(?:no|n|לא)\b', re.IGNORECASE)
+MAX_CAPACITY = 50
+
+
+def normalize_phone(phone):
+    """
+    Returns the phone in +<digits> form; the Graph API sends it without
+    the plus.
+    """
+    digits = re.sub(r'\D', '', phone or '')
+    return f"+{digits}" if digits else None
+
+
+def parse_reply(text):
+    """
+    Parses a reply to the weekly availability request. Returns
+    (True, capacity) for "Yes" or "Yes <n>" (capacity None when no number
+    is given or it is out of range), (False, None) for "No", and None for
+    anything else.
+    """
+    text = text or ''
+    match = YES_PATTERN.match(text)
+    if match:
+        capacity = int(match.group(1)) if match.group(1) else None
+        if capacity is not None and not 0 < capacity <= MAX_CAPACITY:
+            capacity = None
+        return True, capacity
+    if NO_PATTERN.match(text):
+        return False, None
+    return None
+
+
+def parse_webhook_messages(data):
+    """
+    Returns the inbound messages in a webhook payload as dicts with 'id',
+    'phone' and 'text'. Accepts the Graph API payload (entry -> changes ->
+    value -> messages) as well as a flat {'phone', 'message', 'id'} body.
+    Delivery status callbacks carry no messages and yield an empty list.
+    """
+    if 'entry' not in data:
+        if not data.get('phone'):
+            return []
+        return [{'id': data.get('id'), 'phone': data['phone'], 'text': data.get('message') or ''}]
+
+    messages = []
+    for entry in data.get('entry') or []:
+        for change in entry.get('changes') or []:
+            value = change.get('value') or {}
+            for message in value.get('messages') or []:
+                text = message.get('text', {}).get('body') if message.get('type') == 'text' else None
+                if message.get('from'):
+                    messages.append({'id': message.get('id'), 'phone': message['from'], 'text': text or ''})
+    return messages
+
+
+def valid_signature(secret, body, header):
+    """
+    Checks the X-Hub-Signature-256 header Meta signs webhook bodies with.
+    Always true when no app secret is configured.
+    """
+    if not secret:
+        return True
+    if not header or not header.startswith('sha256='):
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, header[len('sha256='):])
+
+
+class Inbox:
+    """
+    Queue of inbound WhatsApp messages between the webhook and the worker
+    that applies them, deduplicated by message id so retried deliveries are
+    processed once.
+
+    With Redis, messages wait in a list that process_inbound_messages drains
+    in batches, and the first message after a drain schedules the next one.
+    A drained batch is held in a leased claim until it is committed, so a
+    worker that dies mid-batch leaves it for the next drain to take again.
+    Without it, each web process dedupes with a bounded LRU and hands
+    batches to the worker as task arguments every `flush_seconds`; messages
+    buffered in a process that dies before the flush are lost.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.batch_size = 500
+        self.dedupe_seconds = 7 * 24 * 3600
+        self.flush_seconds = 0.05
+        self.lease_seconds = 300
+        self._seen = None
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._submit = None
+        self._pop = None
+        self.redis_url = None
+        self._async_client = None
+        self._submit_async = None
+
+    def init_app(self, app):
+        self.batch_size = app.config['INBOUND_BATCH_SIZE']
+        self.dedupe_seconds = app.config['INBOUND_DEDUPE_SECONDS']
+        self.flush_seconds = app.config['INBOUND_FLUSH_MS'] / 1000
+        self.lease_seconds = app.config['INBOUND_LEASE_SECONDS']
+        self._seen = LRUCache(app.config['INBOUND_DEDUPE_MAX_ENTRIES'])
+        self.redis_url = app.config['INBOUND_REDIS_URL']
+        self.client = self._connect_redis(self.redis_url)
+        if self.client is not None:
+            self._submit = self.client.register_script(_SUBMIT_SCRIPT)
+            self._pop = self.client.register_script(_POP_SCRIPT)
+
+    def _connect_redis(self, url):
+        try:
+            import redis
+            client = redis.Redis.from_url(url, socket_connect_timeout=0.2, socket_timeout=1)
+            client.ping()
+        except Exception as e:
+            log.warning("Inbox: Redis unavailable (%s), batching in-process", e)
+            return None
+        return client
+
+    def submit(self, messages):
+        """
+        Queues messages not seen before and returns how many were queued.
+        Raises if the queue is unreachable, so the webhook can answer with
+        an error and let Meta retry.
+        """
+        if not messages:
+            return 0
+        if self.client is None:
+            return self._submit_local(messages)
+
+        pipe = self.client.pipeline(transaction=False)
+        for message in messages:
+            self._submit(keys=self._keys(message), args=[json.dumps(message), self.dedupe_seconds, 60], client=pipe)
+        results = pipe.execute()
+        if 2 in results:
+            self._schedule()
+        return sum(1 for result in results if result)
+
+    async def submit_async(self, messages):
+        """
+        submit() for coroutines: the same queue and dedupe keys, through an
+        asyncio Redis client so the caller's event loop is never blocked.
+        """
+        if not messages:
+            return 0
+        if self.client is None:
+            return self._submit_local(messages)
+
+        if self._async_client is None:
+            import redis.asyncio
+            self._async_client = redis.asyncio.Redis.from_url(self.redis_url, socket_connect_timeout=0.2,
+                                                              socket_timeout=1)
+            self._submit_async = self._async_client.register_script(_SUBMIT_SCRIPT)
+        async with self._async_client.pipeline(transaction=False) as pipe:
+            for message in messages:
+                await self._submit_async(keys=self._keys(message), args=[json.dumps(message), self.dedupe_seconds, 60],
+                                         client=pipe)
+            results = await pipe.execute()
+        if 2 in results:
+            await asyncio.to_thread(self._schedule)
+        return sum(1 for result in results if result)
+
+    async def close_async(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def _keys(self, message):
+        #  Messages without an id can't be deduped; give them a unique key
+        return [DEDUPE_PREFIX + (message.get('id') or uuid.uuid4().hex), QUEUE_KEY, SCHEDULED_KEY]
+
+    def _submit_local(self, messages):
+        queued = 0
+        with self._lock:
+            for message in messages:
+                if message.get('id'):
+                    if self._seen.get(message['id']) is not None:
+                        continue
+                    self._seen.set(message['id'], True, self.dedupe_seconds)
+                self._buffer.append(message)
+                queued += 1
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_local, name='inbox-flusher', daemon=True)
+                self._flusher.start()
+        return queued
+
+    def _flush_local(self):
+        from app import celery
+        while True:
+            time.sleep(self.flush_seconds)
+            while self._buffer:
+                with self._lock:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                try:
+                    celery.send_task(PROCESS_TASK, args=[batch], retry=False, ignore_result=True)
+                except Exception as e:
+                    log.error("Inbox: could not hand %d messages to the worker: %s", len(batch), e)
+
+    def _schedule(self):
+        from app import celery
+        try:
+            celery.send_task(PROCESS_TASK, retry=False, ignore_result=True)
+        except Exception as e:
+            #  The flag expires, so the next message after it schedules a drain
+            log.error("Inbox: could not schedule processing: %s", e)
+
+    def pop_batch(self):
+        """
+        Takes up to batch_size messages off the Redis queue and returns
+        (claim, messages). The messages are kept under the claim until ack()
+        is called for it; claims not acked within lease_seconds go back to
+        the head of the queue on a later pop. Returns (None, []) when the
+        queue is empty.
+        """
+        claim = uuid.uuid4().hex
+        now = time.time()
+        items = self._pop(keys=[QUEUE_KEY, CLAIMS_KEY],
+                          args=[now, now + self.lease_seconds, self.batch_size, CLAIM_PREFIX, claim])
+        if not items:
+            return None, []
+        return claim, [json.loads(item) for item in items]
+
+    def ack(self, claim):
+        """
+        Drops a claim's messages once they have been applied and committed.
+        """
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(CLAIM_PREFIX + claim)
+        pipe.zrem(CLAIMS_KEY, claim)
+        pipe.execute()
+
+    def finish_drain(self):
+        """
+        Lets the next message schedule a drain. Returns True if messages
+        arrived in the meantime and the caller should drain again.
+        """
+        #  Clear the flag before looking, so a message pushed in between
+        #  either shows up here or schedules a drain itself
+        self.client.delete(SCHEDULED_KEY)
+        return self.client.llen(QUEUE_KEY) > 0
@@ -0,0 +1,221 @@
+import csv
+import math
+import re
+import unicodedata
+
+from sqlalchemy import select
+
+from app import db
+from app.database import write_transaction
+from app.models import Locality
+
+#  Equirectangular projection around Israel's mean latitude; accurate to
+#  well under 1% across the country, and lets distances be plain Euclidean.
+KM_PER_DEGREE_LAT = 110.57
+KM_PER_DEGREE_LON = 111.32 * math.cos(math.radians(31.5))
+
+#  (name, Hebrew name, latitude, longitude, aliases). The full CBS list can
+#  be loaded with `flask load-localities <csv>`.
+SEED_LOCALITIES = [
+    ("Jerusalem", "ירושלים", 31.7683, 35.2137, ["Yerushalayim"]),
+    ("Tel Aviv-Yafo", "תל אביב-יפו", 32.0853, 34.7818, ["Tel Aviv", "TLV", "Jaffa", "Yafo"]),
+    ("Haifa", "חיפה", 32.7940, 34.9896, []),
+    ("Rishon LeZion", "ראשון לציון", 31.9730, 34.7925, ["Rishon"]),
+    ("Petah Tikva", "פתח תקווה", 32.0840, 34.8878, ["Petach Tikva", "Petah Tiqwa"]),
+    ("Ashdod", "אשדוד", 31.8014, 34.6435, []),
+    ("Netanya", "נתניה", 32.3215, 34.8532, []),
+    ("Beersheba", "באר שבע", 31.2520, 34.7915, ["Beer Sheva", "Be'er Sheva", "Beersheva"]),
+    ("Bnei Brak", "בני ברק", 32.0807, 34.8338, []),
+    ("Holon", "חולון", 32.0158, 34.7874, []),
+    ("Ramat Gan", "רמת גן", 32.0684, 34.8248, []),
+    ("Rehovot", "רחובות", 31.8928, 34.8113, []),
+    ("Ashkelon", "אשקלון", 31.6688, 34.5743, []),
+    ("Bat Yam", "בת ים", 32.0171, 34.7454, []),
+    ("Beit Shemesh", "בית שמש", 31.7470, 34.9881, []),
+    ("Kfar Saba", "כפר סבא", 32.1750, 34.9070, []),
+    ("Herzliya", "הרצליה", 32.1663, 34.8433, []),
+    ("Hadera", "חדרה", 32.4340, 34.9196, []),
+    ("Modiin-Maccabim-Re'ut", "מודיעין-מכבים-רעות", 31.8980, 35.0104, ["Modiin", "Modi'in"]),
+    ("Nazareth", "נצרת", 32.6996, 35.3035, []),
+    ("Lod", "לוד", 31.9510, 34.8881, []),
+    ("Ramla", "רמלה", 31.9293, 34.8667, []),
+    ("Ra'anana", "רעננה", 32.1848, 34.8713, []),
+    ("Modiin Illit", "מודיעין עילית", 31.9330, 35.0440, ["Kiryat Sefer"]),
+    ("Rahat", "רהט", 31.3925, 34.7544, []),
+    ("Hod HaSharon", "הוד השרון", 32.1500, 34.8880, []),
+    ("Givatayim", "גבעתיים", 32.0722, 34.8125, []),
+    ("Kiryat Gat", "קריית גת", 31.6100, 34.7642, []),
+    ("Nahariya", "נהריה", 33.0059, 35.0941, []),
+    ("Beitar Illit", "ביתר עילית", 31.6960, 35.1150, []),
+    ("Umm al-Fahm", "אום אל-פחם", 32.5190, 35.1530, []),
+    ("Kiryat Ata", "קריית אתא", 32.8090, 35.1120, []),
+    ("Yavne", "יבנה", 31.8780, 34.7390, []),
+    ("Eilat", "אילת", 29.5577, 34.9519, []),
+    ("Akko", "עכו", 32.9281, 35.0820, ["Acre", "Acco"]),
+    ("Ness Ziona", "נס ציונה", 31.9290, 34.7980, []),
+    ("Elad", "אלעד", 32.0520, 34.9510, []),
+    ("Rosh HaAyin", "ראש העין", 32.0956, 34.9566, []),
+    ("Ramat HaSharon", "רמת השרון", 32.1460, 34.8390, []),
+    ("Karmiel", "כרמיאל", 32.9190, 35.2950, []),
+    ("Afula", "עפולה", 32.6080, 35.2890, []),
+    ("Tiberias", "טבריה", 32.7922, 35.5312, ["Tveria"]),
+    ("Safed", "צפת", 32.9646, 35.4960, ["Tzfat", "Zefat", "Tsfat"]),
+    ("Dimona", "דימונה", 31.0690, 35.0330, []),
+    ("Kiryat Shmona", "קריית שמונה", 33.2073, 35.5721, []),
+    ("Ma'ale Adumim", "מעלה אדומים", 31.7770, 35.2980, []),
+    ("Efrat", "אפרת", 31.6530, 35.1500, ["Efrata"]),
+    ("Alon Shvut", "אלון שבות", 31.6560, 35.1280, []),
+    ("Zikhron Ya'akov", "זכרון יעקב", 32.5720, 34.9510, ["Zichron Yaakov"]),
+    ("Caesarea", "קיסריה", 32.5000, 34.9000, []),
+    ("Sderot", "שדרות", 31.5250, 34.5960, []),
+    ("Arad", "ערד", 31.2590, 35.2130, []),
+    ("Mitzpe Ramon", "מצפה רמון", 30.6100, 34.8010, []),
+    ("Yokneam Illit", "יקנעם עילית", 32.6590, 35.1050, ["Yokneam"]),
+    ("Kfar Chabad", "כפר חב\"ד", 31.9890, 34.8550, []),
+]
+
+
+def normalize_location(text):
+    """
+    Reduces free-text location to a comparison key, so that e.g.
+    "Tel Aviv", "tel-aviv" and "TelAviv" all compare equal.
+    """
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return re.sub(r"[\W_]+", "", text)
+
+
+def project(latitude, longitude):
+    """
+    Returns planar (x, y) coordinates in kilometres.
+    """
+    return longitude * KM_PER_DEGREE_LON, latitude * KM_PER_DEGREE_LAT
+
+
+class LocalityIndex:
+    """
+    Resolves free-text locations to localities. Built once per matching run.
+    """
+
+    def __init__(self, localities):
+        self.coordinates = {}
+        self._by_key = {}
+        self._cache = {}
+        self._spatial = None
+        for locality_id, names, latitude, longitude in localities:
+            self.coordinates[locality_id] = project(latitude, longitude)
+            for name in names:
+                normalized = normalize_location(name)
+                if normalized:
+                    self._by_key.setdefault(normalized, locality_id)
+
+    @classmethod
+    def load(cls):
+        """
+        Loads the locality table, falling back to the bundled seed list if
+        it has not been populated yet.
+        """
+        rows = db.session.execute(
+            select(Locality.id, Locality.name, Locality.name_he, Locality.aliases,
+                   Locality.latitude, Locality.longitude)
+        ).all()
+        if rows:
+            return cls(
+                (row.id, [row.name, row.name_he] + (row.aliases or '').split('|'), row.latitude, row.longitude)
+                for row in rows
+            )
+        return cls(
+            (i, [name, name_he] + aliases, latitude, longitude)
+            for i, (name, name_he, latitude, longitude, aliases) in enumerate(SEED_LOCALITIES, start=1)
+        )
+
+    def key(self, location):
+        """
+        Returns the key to group a location under: its locality id when the
+        text names a known locality, otherwise the normalized text itself.
+        """
+        if location not in self._cache:
+            normalized = normalize_location(location)
+            self._cache[location] = self._by_key.get(normalized, normalized)
+        return self._cache[location]
+
+    def nearby(self, key, radius_km):
+        """
+        Returns [(locality_id, distance_km)] for the localities within the
+        radius of the one `key` resolves to, nearest first. Unresolved keys
+        have no coordinates and so have no neighbours.
+        """
+        if self._spatial is None:
+            self._spatial = SpatialIndex(self, list(self.coordinates))
+        return self._spatial.nearby(key, radius_km)
+
+
+class SpatialIndex:
+    """
+    A KD-tree over a set of localities, answering "which of these localities
+    lie within r km of that one, nearest first".
+    """
+
+    def __init__(self, locality_index, locality_ids):
+        #  Imported lazily so runs with the radius fallback disabled don't pay for SciPy
+        from scipy.spatial import cKDTree
+
+        self.locality_index = locality_index
+        self.ids = [i for i in locality_ids if i in locality_index.coordinates]
+        points = [locality_index.coordinates[i] for i in self.ids]
+        self.tree = cKDTree(points) if points else None
+
+    def nearby(self, locality_id, radius_km):
+        """
+        Returns [(locality_id, distance_km)] within the radius, nearest first,
+        excluding the locality itself.
+        """
+        origin = self.locality_index.coordinates.get(locality_id)
+        if self.tree is None or origin is None:
+            return []
+        found = []
+        for position in self.tree.query_ball_point(origin, radius_km):
+            candidate = self.ids[position]
+            if candidate != locality_id:
+                x, y = self.locality_index.coordinates[candidate]
+                found.append((candidate, math.hypot(x - origin[0], y - origin[1])))
+        found.sort(key=lambda item: item[1])
+        return found
+
+
+def load_localities(rows):
+    """
+    Inserts or updates localities from (name, name_he, latitude, longitude,
+    aliases) tuples and commits. Returns the number of rows written.
+    """
+    count = 0
+    with write_transaction(db.session):
+        existing = {
+            locality.normalized_name: locality
+            for locality in Locality.query.all()
+        }
+        for name, name_he, latitude, longitude, aliases in rows:
+            normalized = normalize_location(name)
+            locality = existing.get(normalized)
+            if locality is None:
+                locality = Locality(name=name, normalized_name=normalized)
+                db.session.add(locality)
+                existing[normalized] = locality
+            locality.name_he = name_he
+            locality.latitude = latitude
+            locality.longitude = longitude
+            locality.aliases = '|'.join(aliases)
+            count += 1
+    return count
+
+
+def read_localities_csv(path):
+    """
+    Reads localities from a CSV with name, name_he, latitude, longitude and
+    an optional '|'-separated aliases column.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            aliases = [a for a in (row.get('aliases') or '').split('|') if a]
+            yield row['name'], row.get('name_he'), float(row['latitude']), float(row['longitude']), aliases
@@ -0,0 +1,224 @@
+"""
+Structured logging for the app's `app.*` loggers: records are written as
+one JSON object per line by a background thread, so a request only pays
+for putting the record on a queue.
+
+Every record carries the id of the request (or of the request that
+queued the Celery task) it was logged under. Fields passed with
+`extra={...}` become JSON keys, and secrets in keys or messages are
+redacted. INFO records logged with `extra={'sample': True}` are
+high-volume events and only LOG_SAMPLE_RATE of them are kept.
+"""
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from app.metrics import LOG_RECORDS_DROPPED
+
+REDACTED = '[REDACTED]'
+SECRET_KEY_PATTERN = re.compile(r'pass|secret|token|authorization|api_?key|hash|cookie', re.IGNORECASE)
+SECRET_VALUE_PATTERNS = [
+    (re.compile(r'(Bearer\s+)[^\s"\']+', re.IGNORECASE), r'\1' + REDACTED),
+    (re.compile(r'((?:password|passwd|secret|token|access_token|api_key)["\']?\s*[=:]\s*["\']?)[^\s,&"\'}]+',
+                re.IGNORECASE), r'\1' + REDACTED),
+]
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+#  Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+#  The id of the request being served, or of the one that queued the running task
+_request_id = ContextVar('request_id', default=None)
+
+access_log = logging.getLogger('app.access')
+
+_listener = None
+_celery_connected = False
+
+
+def redact(value, key=None):
+    """
+    Returns `value` with secrets masked: whole values under secret-looking
+    keys, and tokens or passwords embedded in strings.
+    """
+    if key is not None and SECRET_KEY_PATTERN.search(str(key)):
+        return REDACTED
+    if isinstance(value, dict):
+        return {k: redact(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        for pattern, replacement in SECRET_VALUE_PATTERNS:
+            value = pattern.sub(replacement, value)
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact(record.getMessage()),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key != 'sample':
+                entry[key] = redact(value, key)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = redact(record.exc_text)
+        return json.dumps(entry, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Stamps records with the current request id, and drops all but
+    `sample_rate` of the INFO records marked as samplable.
+    """
+
+    def __init__(self, sample_rate):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        if getattr(record, 'sample', False) and record.levelno <= logging.INFO:
+            if random.random() >= self.sample_rate:
+                return False
+            record.sample_rate = self.sample_rate
+        if not hasattr(record, 'request_id'):
+            record.request_id = _request_id.get()
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Queues records without ever blocking the caller: once the queue is
+    full, records are dropped and counted in log_records_dropped_total.
+    """
+
+    def prepare(self, record):
+        #  Render the message here, where its arguments are still valid, but
+        #  leave the JSON (and the traceback formatting) to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def configure_logging(config):
+    """
+    Sends the `app` loggers to stderr as JSON lines, through a queue and a
+    background writer thread unless LOG_ASYNC is off. Safe to call more
+    than once; the last configuration wins.
+    """
+    global _listener
+    logger = logging.getLogger('app')
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter())
+    if config['LOG_ASYNC']:
+        log_queue = queue.Queue(maxsize=config['LOG_QUEUE_SIZE'])
+        handler = DroppingQueueHandler(log_queue)
+        _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+        _listener.start()
+    else:
+        handler = stream
+    handler.addFilter(ContextFilter(config['LOG_SAMPLE_RATE']))
+
+    logger.addHandler(handler)
+    logger.setLevel(config['LOG_LEVEL'].upper())
+    logger.propagate = False  #  Celery workers take over the root logger
+    return logger
+
+
+@atexit.register
+def _flush_logs():
+    if _listener is not None:
+        _listener.stop()
+
+
+def init_request_ids(app):
+    """
+    Gives every request an id, taken from a well-formed X-Request-ID header
+    or generated, and echoes it in the response. Successful requests go to
+    the access log as sampled events; failed ones are always logged.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def assign_request_id():
+        request_id = request.headers.get('X-Request-ID', '')
+        if not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        g.request_id = request_id
+        g.request_id_started = time.perf_counter()
+        _request_id.set(request_id)
+
+    @app.after_request
+    def log_request(response):
+        request_id = g.get('request_id')
+        if request_id is None:
+            return response
+        response.headers['X-Request-ID'] = request_id
+        access_log.info("%s %s %s", request.method, request.path, response.status_code, extra={
+            'method': request.method,
+            'route': request.url_rule.rule if request.url_rule is not None else None,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - g.request_id_started) * 1000, 2),
+            'sample': response.status_code < 400,
+        })
+        _request_id.set(None)
+        return response
+
+
+def init_celery_request_ids():
+    """
+    Carries the current request id in the headers of every task published
+    from this process, and restores it while a worker runs the task, so its
+    records (and the tasks it queues in turn) share the request's id.
+    """
+    global _celery_connected
+    if _celery_connected:
+        return
+    from celery.signals import before_task_publish, task_prerun, task_postrun
+    _celery_connected = True
+
+    @before_task_publish.connect(weak=False)
+    def add_request_id_header(headers=None, **kwargs):
+        request_id = _request_id.get()
+        if request_id and headers is not None:
+            headers.setdefault('request_id', request_id)
+
+    @task_prerun.connect(weak=False)
+    def restore_request_id(task=None, task_id=None, **kwargs):
+        request_id = getattr(task.request, 'request_id', None) if task is not None else None
+        _request_id.set(request_id or task_id)
+
+    @task_postrun.connect(weak=False)
+    def clear_request_id(**kwargs):
+        _request_id.set(None)
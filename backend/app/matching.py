@@ -1,57 +1,642 @@
-from app import db
-from app.models import User, StudentRequest, Match, HostAvailability
-from app.whatsapp import send_whatsapp_message
+import logging
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
 
-def match_students_with_hosts():
+from flask import current_app
+
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.exc import StaleDataError
+
+from app import db, celery, cache, events
+from app.cache import request_key
+from app.models import User, StudentRequest, Match, HostAvailability, current_week_start
+from app.outbox import queue_outbound_messages
+from app.locations import LocalityIndex
+from app.preferences import FEATURE_BYTES, FEATURE_COUNT, encode_features
+
+log = logging.getLogger(__name__)
+
+#  Hosts with no stored vector are scored as having stated nothing; students
+#  with none score 0 with every host
+DEFAULT_HOST_FEATURES = encode_features('host', None)
+DEFAULT_STUDENT_FEATURES = bytes(FEATURE_BYTES)
+SCORE_CHUNK_CELLS = 1 << 20  # Request-host scores computed per matrix product
+
+
+def load_pending_requests(locations=None):
     """
-    Matches students with available hosts based on location and capacity.
+    Loads every pending student request, or only those whose location text
+    is in `locations`, together with the student's name, phone and
+    preference vector in a single query.
     """
-    matches = []
+    stmt = (
+        select(
+            StudentRequest.id,
+            StudentRequest.student_id,
+            StudentRequest.location,
+            StudentRequest.num_guests,
+            User.name,
+            User.phone,
+            User.features,
+        )
+        .join(User, User.id == StudentRequest.student_id)
+        .where(StudentRequest.status == 'pending')
+        .order_by(StudentRequest.created_at, StudentRequest.id)
+    )
+    if locations is not None:
+        stmt = stmt.where(StudentRequest.location.in_(locations))
+    return db.session.execute(stmt).all()
 
-    # Get all pending student requests
-    student_requests = StudentRequest.query.filter_by(status='pending').all()
 
-    for request in student_requests:
-        # Find available hosts in the requested location
-        available_hosts = User.query.filter_by(
-            role='host',
-            location=request.location
-        ).join(HostAvailability).filter(
+def load_excluded_hosts(request_ids):
+    """
+    Returns {request_id: {host_id, ...}} for the requests that were matched
+    before and expired without the host confirming. Those hosts are not
+    offered the request again, or a deterministic run would hand it
+    straight back. Looked up by request id, so the cost follows the
+    pending requests rather than the match history.
+    """
+    excluded = defaultdict(set)
+    for offset in range(0, len(request_ids), 500):
+        #  Filtered here rather than in SQL, where the status would tempt
+        #  SQLite onto the index over every expired match
+        for request_id, host_id, status, host_confirmed in db.session.execute(
+            select(Match.student_request_id, Match.host_id, Match.status, Match.host_confirmed)
+            .where(Match.student_request_id.in_(request_ids[offset:offset + 500]))
+        ):
+            if status == 'expired' and not host_confirmed:
+                excluded[request_id].add(host_id)
+    return dict(excluded)
+
+
+def load_available_hosts(locations=None, week_start=None):
+    """
+    Loads every host with room left in the week starting `week_start` (the
+    current week by default), or only those whose location text is in
+    `locations`, with their preference vector, in a single query. A host's
+    capacity is what they advertised less the guests of their pending and
+    confirmed matches made that week, so repeated runs don't overbook them.
+    """
+    week_start = week_start or current_week_start()
+    week_begins = datetime.combine(week_start, datetime.min.time())
+    placed = (
+        select(func.coalesce(func.sum(StudentRequest.num_guests), 0))
+        .select_from(Match)
+        .join(StudentRequest, StudentRequest.id == Match.student_request_id)
+        .where(
+            Match.host_id == User.id,
+            Match.status != 'expired',
+            Match.created_at >= week_begins,
+            Match.created_at < week_begins + timedelta(weeks=1),
+        )
+        .correlate(User)
+        .scalar_subquery()
+    )
+    stmt = (
+        select(
+            User.id,
+            User.name,
+            User.phone,
+            User.location,
+            User.features,
+            (HostAvailability.capacity - placed).label('capacity'),
+        )
+        .join(HostAvailability, HostAvailability.host_id == User.id)
+        .where(
+            User.role == 'host',
+            HostAvailability.week_start == week_start,
             HostAvailability.available == True,
-            HostAvailability.capacity >= request.num_guests
+            HostAvailability.capacity > 0,
+        )
+    )
+    if locations is not None:
+        stmt = stmt.where(User.location.in_(locations))
+    return [host for host in db.session.execute(stmt) if host.capacity > 0]
+
+
+def candidate_host_locations(request_keys, localities, radius_km=0):
+    """
+    Returns the host location texts that resolve to one of `request_keys`,
+    or to a locality within `radius_km` of one, so that only those hosts
+    need to be loaded. Costs one query over distinct host locations.
+    """
+    wanted = set(request_keys)
+    if radius_km:
+        for key in request_keys:
+            wanted.update(locality_id for locality_id, _ in localities.nearby(key, radius_km))
+
+    host_locations = db.session.scalars(
+        select(User.location).where(User.role == 'host').distinct()
+    ).all()
+    return [location for location in host_locations if localities.key(location) in wanted]
+
+
+class HostIndex:
+    """
+    In-memory index of available hosts keyed by resolved location, with
+    each location's hosts sorted by capacity so that the hosts able to take
+    a request are found with a single bisect.
+    """
+
+    def __init__(self, hosts, localities):
+        self.localities = localities
+        by_location = defaultdict(list)
+        for host in hosts:
+            by_location[localities.key(host.location)].append(host)
+
+        self._capacities = {}
+        self._best = {}
+        for location, location_hosts in by_location.items():
+            location_hosts.sort(key=lambda h: (h.capacity, h.id))
+            self._capacities[location] = [h.capacity for h in location_hosts]
+
+            #  best[i] is the lowest-id host among location_hosts[i:], which
+            #  keeps the old "first matching host" choice deterministic
+            best = [None] * len(location_hosts)
+            current = None
+            for i in range(len(location_hosts) - 1, -1, -1):
+                host = location_hosts[i]
+                if current is None or host.id < current.id:
+                    current = host
+                best[i] = current
+            self._best[location] = best
+
+    def find(self, key, num_guests):
+        """
+        Returns the host to use for a request, or None if no host in the
+        location can take that many guests.
+        """
+        capacities = self._capacities.get(key)
+        if not capacities:
+            return None
+        i = bisect_left(capacities, num_guests)
+        if i == len(capacities):
+            return None
+        return self._best[key][i]
+
+    def nearest_hosts(self, key, num_guests, radius_km, k=1):
+        """
+        Returns up to `k` (host, distance_km) pairs from the nearest other
+        localities within `radius_km` that have a host able to take
+        `num_guests`, nearest first.
+        """
+        found = []
+        for locality_id, distance in self.localities.nearby(key, radius_km):
+            host = self.find(locality_id, num_guests)
+            if host is not None:
+                found.append((host, distance))
+                if len(found) == k:
+                    break
+        return found
+
+
+def feature_matrix(rows, default):
+    """
+    Stacks the rows' packed preference vectors into a float32 matrix, using
+    `default` for rows without one or with one from an older layout.
+    """
+    import numpy as np
+    packed = b''.join(row.features if row.features and len(row.features) == FEATURE_BYTES else default
+                      for row in rows)
+    return np.frombuffer(packed, dtype=np.float32).reshape(len(rows), FEATURE_COUNT)
+
+
+def _score_chunks(requests, hosts):
+    """
+    Yields (offset, scores) for consecutive chunks of `requests`, scores
+    being the chunk's preference scores against every host as one matrix
+    product, sized to stay within SCORE_CHUNK_CELLS.
+    """
+    host_features = feature_matrix(hosts, DEFAULT_HOST_FEATURES).T
+    chunk = max(1, SCORE_CHUNK_CELLS // len(hosts))
+    for offset in range(0, len(requests), chunk):
+        part = requests[offset:offset + chunk]
+        yield offset, feature_matrix(part, DEFAULT_STUDENT_FEATURES) @ host_features
+
+
+def best_hosts(requests, hosts):
+    """
+    Returns, for each request, the host with room for its guests that best
+    suits the student's preferences, or None if no host has room. Among
+    equally good hosts the first in `hosts` wins. Capacity is not consumed.
+
+    Requests with the same preferences and group size get the same answer,
+    so each such combination is scored once.
+    """
+    import numpy as np
+    distinct = {}
+    for request in requests:
+        distinct.setdefault((request.features, request.num_guests), request)
+    representatives = list(distinct.values())
+
+    capacities = np.array([host.capacity for host in hosts])
+    best = []
+    for offset, scores in _score_chunks(representatives, hosts):
+        guests = np.array([request.num_guests for request in representatives[offset:offset + len(scores)]])
+        np.putmask(scores, capacities[None, :] < guests[:, None], -np.inf)
+        columns = scores.argmax(axis=1)
+        fits = np.isfinite(scores[np.arange(len(scores)), columns])
+        best.extend(hosts[column] if fit else None for column, fit in zip(columns.tolist(), fits.tolist()))
+    best = dict(zip(distinct, best))
+    return [best[request.features, request.num_guests] for request in requests]
+
+
+def pick_hosts(requests, hosts, excluded=None):
+    """
+    Gives each request, in order, a different host from `hosts`, the one
+    left that best suits the student's preferences (the first among equals)
+    and is not in its `excluded` set. Needs at least as many hosts as
+    requests. Returns indices into `hosts`, or None for a request whose
+    only hosts left are excluded.
+    """
+    import numpy as np
+    excluded = excluded or {}
+    columns = {host.id: column for column, host in enumerate(hosts)}
+    taken = np.zeros(len(hosts), dtype=bool)
+    picks = []
+    for offset, scores in _score_chunks(requests, hosts):
+        for request, row in zip(requests[offset:offset + len(scores)], scores):
+            row[taken] = -np.inf
+            for host_id in excluded.get(request.id, ()):
+                if host_id in columns:
+                    row[columns[host_id]] = -np.inf
+            column = int(row.argmax())
+            if row[column] == -np.inf:
+                picks.append(None)
+                continue
+            taken[column] = True
+            picks.append(column)
+    return picks
+
+
+def assign_greedy(student_requests, hosts, localities, radius_km=0, excluded=None):
+    """
+    Gives each request the host in its location that advertises enough
+    capacity and best suits the student's preferences (the lowest id among
+    equals), falling back to the nearest locality within `radius_km` that
+    has a host with room. Hosts in a request's `excluded` set (see
+    load_excluded_hosts) are skipped. Host capacity is not consumed.
+    """
+    excluded = excluded or {}
+    hosts_by_location = defaultdict(list)
+    for host in sorted(hosts, key=lambda h: h.id):
+        hosts_by_location[localities.key(host.location)].append(host)
+    requests_by_location = defaultdict(list)
+    for request in student_requests:
+        requests_by_location[localities.key(request.location)].append(request)
+
+    chosen = {}
+    for key, location_requests in requests_by_location.items():
+        location_hosts = hosts_by_location.get(key)
+        if not location_hosts:
+            continue
+        shared = [request for request in location_requests if request.id not in excluded]
+        chosen.update(zip((request.id for request in shared), best_hosts(shared, location_hosts)))
+        #  Few requests have excluded hosts; score each of them on its own
+        for request in location_requests:
+            if request.id in excluded:
+                allowed = [host for host in location_hosts if host.id not in excluded[request.id]]
+                if allowed:
+                    chosen[request.id] = best_hosts([request], allowed)[0]
+
+    index = None
+    assignments = []
+    for request in student_requests:
+        host = chosen.get(request.id)
+        if host is None and radius_km:
+            index = index or HostIndex(hosts, localities)
+            skip = excluded.get(request.id, ())
+            #  One host per locality, so one more than the excluded hosts is enough
+            nearest = index.nearest_hosts(localities.key(request.location), request.num_guests, radius_km,
+                                          k=len(skip) + 1)
+            host = next((host for host, _ in nearest if host.id not in skip), None)
+        if host is not None:
+            assignments.append((request, host))
+    return assignments
+
+
+def solve_transport(sizes, size_counts, capacities, capacity_counts):
+    """
+    Solves one round of the capacity-aware assignment as a transportation
+    problem between request size classes and host capacity classes.
+
+    Each host takes at most one group per round. The objective places as
+    many guests as possible and, among equally good placements, prefers the
+    tightest fit. The constraint matrix is totally unimodular, so the LP
+    optimum is integral.
+
+    Returns a dict mapping (size, capacity) to the number of groups to
+    place with that pairing.
+    """
+    #  Imported lazily so the web app and the greedy path don't pay for SciPy
+    import numpy as np
+    from scipy.optimize import linprog
+    from scipy.sparse import coo_matrix
+
+    S = np.asarray(sizes)[:, None]
+    C = np.asarray(capacities)[None, :]
+    size_idx, cap_idx = np.nonzero(S <= C)
+    if size_idx.size == 0:
+        return {}
+
+    s = S[size_idx, 0]
+    c = C[0, cap_idx]
+    weight = int(np.dot(capacities, capacity_counts)) + 1
+    cost = -(s * weight) + (c - s)
+
+    n = size_idx.size
+    columns = np.arange(n)
+    A = coo_matrix(
+        (np.ones(2 * n), (np.concatenate([size_idx, len(sizes) + cap_idx]), np.concatenate([columns, columns]))),
+        shape=(len(sizes) + len(capacities), n),
+    )
+    b = np.concatenate([size_counts, capacity_counts])
+    result = linprog(cost, A_ub=A.tocsr(), b_ub=b, bounds=(0, None), method='highs-ds')
+    if not result.success:
+        return {}
+
+    flows = np.rint(result.x).astype(int)
+    return {
+        (int(s[k]), int(c[k])): int(flows[k])
+        for k in np.nonzero(flows)[0]
+    }
+
+
+def assign_location_optimal(location_requests, location_hosts, excluded=None):
+    """
+    Assigns requests within one location in rounds, consuming each host's
+    capacity as groups are placed, until no further group fits. Within
+    each round, groups go to the hosts that best suit their preferences,
+    other than the hosts in their `excluded` set.
+    """
+    residual = {host.id: host.capacity for host in location_hosts}
+    hosts_by_id = {host.id: host for host in location_hosts}
+
+    requests_by_size = defaultdict(deque)
+    for request in location_requests:
+        requests_by_size[request.num_guests].append(request)
+
+    assignments = []
+    while True:
+        hosts_by_capacity = defaultdict(deque)
+        for host_id in sorted(residual):
+            if residual[host_id] > 0:
+                hosts_by_capacity[residual[host_id]].append(host_id)
+
+        sizes = sorted(size for size, queue in requests_by_size.items() if queue)
+        capacities = sorted(hosts_by_capacity)
+        if not sizes or not capacities:
+            break
+
+        flows = solve_transport(
+            sizes, [len(requests_by_size[size]) for size in sizes],
+            capacities, [len(hosts_by_capacity[cap]) for cap in capacities],
+        )
+
+        placed = 0
+        for (size, capacity), count in sorted(flows.items()):
+            requests = requests_by_size[size]
+            host_ids = list(hosts_by_capacity[capacity])
+            batch = [requests.popleft() for _ in range(min(count, len(requests), len(host_ids)))]
+            if not batch:
+                continue
+            #  Which host of this capacity takes which group is down to preferences
+            picks = pick_hosts(batch, [hosts_by_id[host_id] for host_id in host_ids], excluded)
+            for request, pick in zip(batch, picks):
+                if pick is None:
+                    requests.append(request)  #  Only excluded hosts left here; try again next round
+                    continue
+                residual[host_ids[pick]] -= size
+                assignments.append((request, hosts_by_id[host_ids[pick]]))
+                placed += 1
+            picked = set(picks)
+            hosts_by_capacity[capacity] = deque(host_id for i, host_id in enumerate(host_ids) if i not in picked)
+
+        if not placed:
+            break
+
+    return assignments
+
+
+def assign_optimal(student_requests, hosts, localities, radius_km=0, excluded=None):
+    """
+    Capacity-aware assignment that solves each location's pending requests
+    against its hosts' capacity as one optimization problem. Requests are
+    only matched within their own locality; `radius_km` is not used. Hosts
+    in a request's `excluded` set are skipped.
+    """
+    requests_by_location = defaultdict(list)
+    for request in student_requests:
+        requests_by_location[localities.key(request.location)].append(request)
+
+    hosts_by_location = defaultdict(list)
+    for host in hosts:
+        hosts_by_location[localities.key(host.location)].append(host)
+
+    assignments = []
+    for location, location_requests in requests_by_location.items():
+        location_hosts = hosts_by_location.get(location)
+        if location_hosts:
+            assignments.extend(assign_location_optimal(location_requests, location_hosts, excluded))
+    return assignments
+
+
+STRATEGIES = {
+    'greedy': assign_greedy,
+    'optimal': assign_optimal,
+}
+
+
+def match_notifications(request, host):
+    """
+    Returns the (phone, body, idempotency_key) messages telling the host
+    and the student about a new match.
+    """
+    return [
+        (host.phone, f"You have a new student match! {request.num_guests} guests from {request.location}.", None),
+        (request.phone, f"You have been matched with a host in {request.location}!", None),
+    ]
+
+
+def write_assignments(assignments):
+    """
+    Inserts the matches, marks their requests as matched and queues the
+    match notifications in the outbox, all in bulk. Because the messages
+    are written in the same transaction, a match is never saved without
+    its notifications or vice versa.
+
+    Only requests that are still pending are matched; if another run got
+    to one first, StaleDataError is raised so the caller can roll back.
+
+    Returns the number of rows written.
+    """
+    expires_at = datetime.utcnow() + timedelta(hours=current_app.config['MATCH_CONFIRMATION_HOURS'])
+    db.session.execute(
+        insert(Match),
+        [
+            {'student_request_id': request.id, 'host_id': host.id, 'student_id': request.student_id,
+             'expires_at': expires_at}
+            for request, host in assignments
+        ],
+    )
+    result = db.session.execute(
+        update(StudentRequest.__table__)
+        .where(StudentRequest.id == bindparam('request_id'), StudentRequest.status == 'pending')
+        .values(status='matched'),
+        [{'request_id': request.id} for request, _ in assignments],
+    )
+    if db.engine.dialect.supports_sane_multi_rowcount and result.rowcount != len(assignments):
+        raise StaleDataError("Some requests were matched by another run")
+    queued = queue_outbound_messages([
+        message for request, host in assignments for message in match_notifications(request, host)
+    ])
+    return 2 * len(assignments) + queued
+
+
+def publish_match_events(assignments):
+    """
+    Tells the student and host of each newly committed match over their
+    event streams, in one Redis round trip.
+    """
+    messages = []
+    for request, host in assignments:
+        data = {'student_request_id': request.id, 'host_id': host.id, 'status': 'pending'}
+        messages.append((request.student_id, 'match_created', data))
+        messages.append((host.id, 'match_created', data))
+    events.publish_many(messages)
+
+
+def save_matches(assignments, chunk_size=500, stats=None):
+    """
+    Writes matches and request status updates in chunks of `chunk_size`,
+    committing once per chunk.
+
+    Each chunk is first written in bulk inside a savepoint. If that fails,
+    the chunk is replayed with one savepoint per request so that a bad row
+    only rolls back itself.
+
+    Returns the assignments that were saved. If a `stats` dict is passed,
+    it is filled in with the commits issued, rows written and failed requests.
+    """
+    saved = []
+    commits = rows_written = failed = 0
+
+    for offset in range(0, len(assignments), chunk_size):
+        chunk = assignments[offset:offset + chunk_size]
+        chunk_saved = []
+        try:
+            with db.session.begin_nested():
+                rows_written += write_assignments(chunk)
+            chunk_saved = chunk
+        except SQLAlchemyError:
+            for assignment in chunk:
+                try:
+                    with db.session.begin_nested():
+                        rows_written += write_assignments([assignment])
+                    chunk_saved.append(assignment)
+                except SQLAlchemyError as e:
+                    failed += 1
+                    log.error("Failed to save match for request %s: %s", assignment[0].id, e)
+        db.session.commit()
+        commits += 1
+        saved.extend(chunk_saved)
+        cache.delete(*[request_key(request.id) for request, _ in chunk])
+        publish_match_events(chunk_saved)
+
+    if stats is not None:
+        stats.update({
+            'commits': commits,
+            'rows_written': rows_written,
+            'failed_requests': failed,
+        })
+
+    return saved
+
+
+def match_students_with_hosts(strategy='greedy', stats=None, chunk_size=500, location=None, radius_km=0,
+                              week_start=None):
+    """
+    Matches students with available hosts based on location and capacity.
+
+    Pending requests and available hosts are each loaded with one query,
+    matched in memory using the named strategy ('greedy' or 'optimal'),
+    and written back in bulk, one transaction per `chunk_size` matches.
+    Passing a `location` limits the run to that location's requests, for
+    incremental matching. Locations are compared after normalization to
+    known localities; with a `radius_km`, the greedy strategy falls back to
+    hosts in the nearest locality within that distance. Hosts are taken
+    from their availability for the week starting `week_start`, the current
+    week by default. A request is not offered again to a host who let an
+    earlier match for it expire.
+
+    If a `stats` dict is passed it is filled in with the strategy used,
+    the solve time, how many requests and guests were placed, and the
+    commits issued and rows written.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown matching strategy: {strategy}")
+
+    localities = LocalityIndex.load()
+    if location is None:
+        student_requests = load_pending_requests()
+    else:
+        #  Pick up pending requests that spell the location differently too
+        key = localities.key(location)
+        pending_locations = db.session.scalars(
+            select(StudentRequest.location).where(StudentRequest.status == 'pending').distinct()
         ).all()
+        student_requests = load_pending_requests(
+            [text for text in pending_locations if localities.key(text) == key]
+        )
+    excluded = load_excluded_hosts([request.id for request in student_requests])
+
+    #  Only load hosts where someone is actually waiting
+    request_keys = {localities.key(request.location) for request in student_requests}
+    hosts = []
+    if request_keys:
+        hosts = load_available_hosts(candidate_host_locations(request_keys, localities, radius_km), week_start)
+
+    #  End the read before solving, so no transaction is open during the solve.
+    #  Each chunk's transaction starts with its INSERT, and write_assignments
+    #  only matches requests that are still pending
+    db.session.commit()
+
+    start = time.perf_counter()
+    assignments = STRATEGIES[strategy](student_requests, hosts, localities, radius_km, excluded)
+    solve_seconds = time.perf_counter() - start
+
+    assignments = save_matches(assignments, chunk_size=chunk_size, stats=stats)
 
-        if available_hosts:
-            #  In a real application, you might have more sophisticated matching logic
-            #  For example, considering host preferences, student about_me, etc.
-            host = available_hosts[0]  #  For simplicity, take the first available host
-
-            #  Create a new match
-            match = Match(
-                student_request_id=request.id,
-                host_id=host.id
-            )
-            db.session.add(match)
-            db.session.commit()
-
-            #  Update the student request status
-            request.status = 'matched'
-            db.session.commit()
-
-            #  Send WhatsApp messages to host and student
-            send_whatsapp_message(
-                host.phone,
-                f"You have a new student match! {request.num_guests} guests from {request.location}."
-            )
-            send_whatsapp_message(
-                User.query.get(request.student_id).phone,
-                f"You have been matched with a host in {request.location}!"
-            )
-
-            matches.append({
-                'student': User.query.get(request.student_id).name,
-                'host': host.name,
-                'host_phone': host.phone
-            })
-
-    return matches
\ No newline at end of file
+    if stats is not None:
+        stats.update({
+            'strategy': strategy,
+            'solve_seconds': solve_seconds,
+            'requests_matched': len(assignments),
+            'guests_placed': sum(request.num_guests for request, _ in assignments),
+        })
+
+    matches = []
+    for request, host in assignments:
+        matches.append({
+            'student': request.name,
+            'host': host.name,
+            'host_phone': host.phone
+        })
+
+    return matches
+
+
+def request_incremental_match(location):
+    """
+    Asks a Celery worker to match the pending requests in one location.
+    Failing to reach the broker is not fatal: the periodic run_matching
+    reconciliation pass picks the requests up later. Nothing waits for the
+    result, so the result backend is left out of the publish.
+    """
+    try:
+        celery.send_task('celery_worker.match_location', args=[location], retry=False, ignore_result=True)
+    except Exception as e:
+        log.warning("Could not schedule matching for %s: %s", location, e)
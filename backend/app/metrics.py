@@ -0,0 +1,318 @@
+"""
+Request, SQL, WhatsApp and Celery task metrics, kept in process memory and
+rendered in the Prometheus text format on /metrics.
+
+Each process keeps its own series. Under several gunicorn workers a scrape
+sees whichever worker answered it, so scrape each worker separately (or run
+one worker per container). Celery workers serve their task metrics on
+WORKER_METRICS_PORT, one port per pool process.
+"""
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+TASK_BUCKETS = (.01, .05, .1, .5, 1, 5, 10, 30, 60, 120, 300, 600)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 20000)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    """
+    A monotonically increasing count, per combination of label values.
+    """
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name + '_total', list(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    """
+    Counts observations into cumulative buckets, per combination of label
+    values, along with their sum and count.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}  # label values -> [count per bucket..., sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            series = [(key, list(values)) for key, values in self._series.items()]
+        for key, values in series:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                yield self.name + '_bucket', labels + [('le', _format_value(bound))], cumulative
+            yield self.name + '_sum', labels, values[-1]
+            yield self.name + '_count', labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'Time to build the response, by route.',
+    ('method', 'route', 'status')))
+HTTP_REQUEST_SQL_QUERIES = REGISTRY.register(Histogram(
+    'http_request_sql_queries', 'SQL statements executed per request, by route.',
+    ('method', 'route'), QUERY_COUNT_BUCKETS))
+HTTP_REQUEST_SQL_SECONDS = REGISTRY.register(Histogram(
+    'http_request_sql_seconds', 'Time spent in SQL per request, by route.',
+    ('method', 'route')))
+WHATSAPP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'whatsapp_request_duration_seconds', 'Latency of calls to the WhatsApp API, by HTTP status.',
+    ('status',)))
+CELERY_TASK_SECONDS = REGISTRY.register(Histogram(
+    'celery_task_duration_seconds', 'Run time of Celery tasks, by final state.',
+    ('task', 'state'), TASK_BUCKETS))
+CELERY_TASK_SQL_QUERIES = REGISTRY.register(Histogram(
+    'celery_task_sql_queries', 'SQL statements executed per Celery task.',
+    ('task',), QUERY_COUNT_BUCKETS))
+LOG_RECORDS_DROPPED = REGISTRY.register(Counter(
+    'log_records_dropped', 'Log records dropped because the log queue was full.'))
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+#  The request or task whose statements are being counted, if any
+_query_stats = ContextVar('query_stats', default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    stats = _query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += time.perf_counter() - started
+
+
+def _handle_error(exception_context):
+    #  Statements that fail never reach after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started'):
+        connection.info['query_started'].pop()
+
+
+class Metrics:
+    """
+    Wires the metrics above into the app: SQL statement counting on every
+    engine, request timing and /metrics for the web profile, and task
+    timing for Celery workers.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.profiler = None
+        self._celery_instrumented = False
+
+    def init_app(self, app):
+        self.enabled = app.config['METRICS_ENABLED']
+
+    def track_queries(self, engine):
+        from sqlalchemy import event
+        if not self.enabled or event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+            return
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(engine, 'handle_error', _handle_error)
+
+    def instrument_requests(self, app):
+        """
+        Times every request and counts its SQL statements, and serves
+        /metrics. Must run before other before_request hooks are added, so
+        requests they reject are timed too.
+        """
+        if not self.enabled:
+            return None
+        from flask import Response, g, request
+
+        if app.config['PROFILER_ENABLED']:
+            from app.profiler import SamplingProfiler
+            self.profiler = SamplingProfiler(
+                interval=app.config['PROFILER_INTERVAL_MS'] / 1000,
+                threshold=app.config['PROFILER_SLOW_REQUEST_MS'] / 1000,
+                output_dir=app.config['PROFILER_OUTPUT_DIR'],
+            )
+
+        @app.before_request
+        def start_request_metrics():
+            g.request_started = time.perf_counter()
+            _query_stats.set(QueryStats())
+            if self.profiler is not None:
+                self.profiler.start_request()
+
+        @app.after_request
+        def record_request_metrics(response):
+            started = g.pop('request_started', None)
+            stats = _query_stats.get()
+            _query_stats.set(None)
+            if started is None:
+                return response
+            seconds = time.perf_counter() - started
+            #  The rule, not the path, so ids don't explode the label set
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            HTTP_REQUEST_SECONDS.observe(seconds, method=request.method, route=route, status=response.status_code)
+            if stats is not None:
+                HTTP_REQUEST_SQL_QUERIES.observe(stats.count, method=request.method, route=route)
+                HTTP_REQUEST_SQL_SECONDS.observe(stats.seconds, method=request.method, route=route)
+            if self.profiler is not None:
+                self.profiler.finish_request(f"{request.method} {route}", seconds)
+            return response
+
+        token = app.config.get('METRICS_TOKEN')
+
+        def metrics_view():
+            if token and request.headers.get('Authorization') != f"Bearer {token}":
+                return Response('Unauthorized\n', status=401, mimetype='text/plain')
+            return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+        app.add_url_rule('/metrics', 'metrics', metrics_view)
+        return metrics_view
+
+    def instrument_celery(self, port=0):
+        """
+        Times every task run in this process and counts its SQL statements.
+        With a port, serves the metrics over HTTP from each pool process:
+        prefork children on port + 1 + their index, and the main process
+        (which runs the tasks for the solo and threads pools) on port.
+        """
+        if not self.enabled or self._celery_instrumented:
+            return
+        from celery.signals import task_prerun, task_postrun, worker_init, worker_process_init
+        self._celery_instrumented = True
+        started = {}  # task id -> start time
+
+        @task_prerun.connect(weak=False)
+        def start_task_metrics(task_id=None, **kwargs):
+            started[task_id] = time.perf_counter()
+            _query_stats.set(QueryStats())
+
+        @task_postrun.connect(weak=False)
+        def record_task_metrics(task_id=None, task=None, state=None, **kwargs):
+            start = started.pop(task_id, None)
+            stats = _query_stats.get()
+            _query_stats.set(None)
+            if start is None or task is None:
+                return
+            CELERY_TASK_SECONDS.observe(time.perf_counter() - start, task=task.name, state=state or 'UNKNOWN')
+            if stats is not None:
+                CELERY_TASK_SQL_QUERIES.observe(stats.count, task=task.name)
+
+        if port:
+            @worker_init.connect(weak=False)
+            def serve_main_process_metrics(**kwargs):
+                start_http_server(port)
+
+            @worker_process_init.connect(weak=False)
+            def serve_pool_process_metrics(**kwargs):
+                from billiard.process import current_process
+                start_http_server(port + 1 + (current_process().index or 0))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  #  No access log for scrapes
+
+
+def start_http_server(port, host='0.0.0.0'):
+    """
+    Serves the metrics of this process on a background thread, for
+    processes without a web app of their own. Returns the server.
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        log.error("Metrics: could not listen on port %s (%s)", port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
@@ -1,36 +1,101 @@
 from app import db
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.passwords import hash_password, verify_password, needs_rehash
+from app.preferences import encode_features
 
 class User(db.Model, UserMixin):
+    __table_args__ = (
+        db.Index('ix_user_role_location', 'role', 'location'),
+        db.Index('ix_user_role_id', 'role', 'id'),  #  Host id pages for the weekly fan-out
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     phone = db.Column(db.String(15), unique=True, nullable=False)
     role = db.Column(db.String(10), nullable=False)  # 'student' or 'host'
-    password_hash = db.Column(db.String(128)) # Add password hash
+    password_hash = db.Column(db.String(255)) # Add password hash
     about_me = db.Column(db.Text)
     preferences = db.Column(db.Text)
     location = db.Column(db.String(255))
+    features = db.Column(db.LargeBinary)  # Packed preference vector, see app.preferences
 
     def __repr__(self):
         return f'<User {self.name}>'
+
+    def refresh_features(self):
+        """
+        Rebuilds the preference vector; call whenever the role, preferences
+        or "about me" change.
+        """
+        self.features = encode_features(self.role, self.preferences, self.about_me)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """
+        Verifies the password and, if the hash parameters have changed since
+        it was set, re-hashes it with the current ones. The caller commits.
+        """
+        if not verify_password(self.password_hash, password):
+            return False
+        if needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
+
+
+def week_start_of(day):
+    """
+    Returns the Monday of the ISO week `day` falls in, the key availability
+    is stored under.
+    """
+    return day - timedelta(days=day.weekday())
 
+def current_week_start():
+    return week_start_of(datetime.utcnow().date())
 
 class HostAvailability(db.Model):
+    """
+    A host's availability for one week, keyed by the week's Monday. Holds
+    the recent and upcoming weeks only; older weeks are moved to
+    HostAvailabilityArchive, so the matcher's reads stay small however
+    much history builds up.
+    """
+    __table_args__ = (
+        db.Index('uq_host_availability_host_id_week_start', 'host_id', 'week_start', unique=True),
+        #  The matcher reads one week's available hosts; archiving reads old weeks
+        db.Index('ix_host_availability_week_start_available', 'week_start', 'available', 'host_id', 'capacity'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     host_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     available = db.Column(db.Boolean, default=False)
     capacity = db.Column(db.Integer, default=0)
-    week_start = db.Column(db.Date, default=datetime.utcnow)
+    week_start = db.Column(db.Date, default=current_week_start)
+
+class HostAvailabilityArchive(db.Model):
+    """
+    Weeks of HostAvailability older than AVAILABILITY_HOT_WEEKS, kept for
+    reporting. Rows keep their original id.
+    """
+    __tablename__ = 'host_availability_archive'
+    __table_args__ = (
+        db.Index('uq_host_availability_archive_week_start_host_id', 'week_start', 'host_id', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    host_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    available = db.Column(db.Boolean, default=False)
+    capacity = db.Column(db.Integer, default=0)
+    week_start = db.Column(db.Date, nullable=False)
 
 class StudentRequest(db.Model):
+    __table_args__ = (
+        db.Index('ix_student_request_status_location_created_at', 'status', 'location', 'created_at'),
+        db.Index('ix_student_request_student_id', 'student_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     location = db.Column(db.String(255), nullable=False)
@@ -42,12 +107,66 @@ class StudentRequest(db.Model):
         return f'<StudentRequest {self.id}>'
 
 class Match(db.Model):
+    __table_args__ = (
+        db.Index('ix_match_student_request_id', 'student_request_id'),
+        db.Index('ix_match_host_id', 'host_id'),
+        db.Index('ix_match_student_id_id', 'student_id', 'id'),  #  A student's match pages, in id order
+        db.Index('ix_match_status_expires_at', 'status', 'expires_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     student_request_id = db.Column(db.Integer, db.ForeignKey('student_request.id'), nullable=False)
     host_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # The request's student, copied
     host_confirmed = db.Column(db.Boolean, default=False)
     student_confirmed = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(20), default='pending', nullable=False)  # 'pending', 'confirmed', 'expired'
+    expires_at = db.Column(db.DateTime)  # Unconfirmed matches expire after this
+
+    def __repr__(self):
+        return f'<Match {self.id}>'
+
+class OutboundMessage(db.Model):
+    __table_args__ = (
+        db.Index('ix_outbound_message_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    phone = db.Column(db.String(15), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    idempotency_key = db.Column(db.String(255), unique=True)  # Queuing the same key twice sends once
+    status = db.Column(db.String(20), default='pending', nullable=False)  # 'pending', 'sending', 'sent', 'dead'
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    claim_token = db.Column(db.String(36))
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    provider_message_id = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<OutboundMessage {self.id}>'
+
+
+class TaskCheckpoint(db.Model):
+    name = db.Column(db.String(255), primary_key=True)  # e.g. 'weekly-availability:2025-W14'
+    position = db.Column(db.Integer, default=0, nullable=False)  # Last id the task has finished with
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<TaskCheckpoint {self.name}={self.position}>'
+
+
+class Locality(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+    name_he = db.Column(db.String(255))
+    normalized_name = db.Column(db.String(255), unique=True, nullable=False)  # See app.locations.normalize_location
+    aliases = db.Column(db.Text)  # '|'-separated alternative spellings
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
 
     def __repr__(self):
-        return f'<Match {self.id}>'
\ No newline at end of file
+        return f'<Locality {self.name}>'
@@ -0,0 +1,423 @@
+import asyncio
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import requests
+from sqlalchemy import func, insert, select, update
+
+from app import db
+from app.models import OutboundMessage
+from app.whatsapp import create_async_client, get_executor, post_whatsapp_message, post_whatsapp_message_async
+
+log = logging.getLogger(__name__)
+
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 3600
+#  Added to a batch's send time at the configured rate, for slow responses
+LEASE_MARGIN_SECONDS = 60
+DRAIN_LOCK_KEY = 'aii:outbox:draining'
+RESCHEDULE_KEY = 'aii:outbox:rescheduled'
+
+#  Frees the lock only if this drain still holds it
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+#  Extends the lock only if this drain still holds it
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+#  Records a reschedule for time ARGV[1] unless one is already due by then
+_RESCHEDULE_SCRIPT = """
+local due = redis.call('GET', KEYS[1])
+if due and tonumber(due) <= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+
+class TokenBucket:
+    """
+    Limits how fast messages are handed to the sender: `rate` tokens are
+    added per second, up to `capacity`, and each message takes one.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _take(self):
+        #  Takes a token if there is one, else returns how long until there is
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """
+        Takes a token, sleeping until one is available.
+        """
+        with self.lock:
+            while True:
+                wait = self._take()
+                if not wait:
+                    return
+                time.sleep(wait)
+
+    async def acquire_async(self):
+        """
+        acquire() for coroutines: waits without blocking the event loop.
+        """
+        while True:
+            with self.lock:
+                wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class DrainGuard:
+    """
+    Keeps drain_outbox to one run at a time across every worker, so the
+    token bucket's rate is the real send rate for the phone number ID, and
+    to one pending reschedule. The lock lives in Redis with a TTL the
+    drain renews before each batch, so a drain that dies frees it on its
+    own. Without Redis it only guards the drains in this process.
+    """
+
+    def __init__(self, client=None):
+        self.client = client
+        self._local = {}
+        self._lock = threading.Lock()
+        if client is not None:
+            self._release = client.register_script(_RELEASE_SCRIPT)
+            self._renew = client.register_script(_RENEW_SCRIPT)
+            self._reschedule = client.register_script(_RESCHEDULE_SCRIPT)
+
+    @classmethod
+    def connect(cls, url):
+        try:
+            import redis
+            client = redis.Redis.from_url(url, socket_connect_timeout=0.2, socket_timeout=1)
+            client.ping()
+        except Exception as e:
+            log.warning("Outbox: Redis unavailable (%s), drains only exclude each other in-process", e)
+            return cls()
+        return cls(client)
+
+    def _set_local(self, key, value, ttl, replace):
+        #  SET NX EX for the in-process fallback; `replace(current)` says
+        #  whether a live entry may be overwritten
+        with self._lock:
+            now = time.monotonic()
+            current = self._local.get(key)
+            if current is not None and current[1] > now and not replace(current[0]):
+                return False
+            self._local[key] = (value, now + ttl)
+            return True
+
+    def acquire(self, ttl):
+        """
+        Takes the drain lock for `ttl` seconds. Returns a token to renew
+        and release it with, or None if another drain holds it.
+        """
+        token = uuid.uuid4().hex
+        ttl = max(1, math.ceil(ttl))
+        if self.client is None:
+            return token if self._set_local(DRAIN_LOCK_KEY, token, ttl, lambda held: False) else None
+        return token if self.client.set(DRAIN_LOCK_KEY, token, nx=True, ex=ttl) else None
+
+    def renew(self, token, ttl):
+        """
+        Extends the lock to `ttl` seconds from now. Returns False if it
+        expired and was taken by another drain.
+        """
+        ttl = max(1, math.ceil(ttl))
+        if self.client is None:
+            return self._set_local(DRAIN_LOCK_KEY, token, ttl, lambda held: held == token)
+        return bool(self._renew(keys=[DRAIN_LOCK_KEY], args=[token, ttl]))
+
+    def release(self, token):
+        if self.client is None:
+            with self._lock:
+                if self._local.get(DRAIN_LOCK_KEY, (None,))[0] == token:
+                    del self._local[DRAIN_LOCK_KEY]
+            return
+        self._release(keys=[DRAIN_LOCK_KEY], args=[token])
+
+    def reschedule(self, countdown):
+        """
+        Returns True if the caller should schedule a drain in `countdown`
+        seconds, False if one is already scheduled by then.
+        """
+        due = time.time() + countdown
+        ttl = max(1, math.ceil(countdown))
+        if self.client is None:
+            return self._set_local(RESCHEDULE_KEY, due, ttl, lambda scheduled: scheduled > due)
+        return bool(self._reschedule(keys=[RESCHEDULE_KEY], args=[due, ttl]))
+
+
+def claim_lease_seconds(lease_seconds, batch_size, rate_per_second):
+    """
+    Returns how long a drain may hold a claimed batch: `lease_seconds`, but
+    never less than the batch takes to send at `rate_per_second` plus a
+    margin, so a slow batch isn't handed to another drain mid-send.
+    """
+    return max(lease_seconds, batch_size / rate_per_second + LEASE_MARGIN_SECONDS)
+
+
+def queue_outbound_messages(messages):
+    """
+    Adds (phone, body, idempotency_key) tuples to the outbox in the current
+    transaction; the caller commits. A message whose key is already in the
+    outbox (or repeated within the batch) is skipped, so re-running a
+    producer never double-sends. Keys may be None.
+
+    Returns the number of messages queued.
+    """
+    keys = [key for _, _, key in messages if key]
+    existing = set()
+    for offset in range(0, len(keys), 500):
+        existing.update(db.session.scalars(
+            select(OutboundMessage.idempotency_key)
+            .where(OutboundMessage.idempotency_key.in_(keys[offset:offset + 500]))
+        ))
+
+    now = datetime.utcnow()
+    rows = []
+    for phone, body, key in messages:
+        if key:
+            if key in existing:
+                continue
+            existing.add(key)
+        rows.append({
+            'phone': phone,
+            'body': body,
+            'idempotency_key': key,
+            'status': 'pending',
+            'attempts': 0,
+            'next_attempt_at': now,
+        })
+
+    if rows:
+        db.session.execute(insert(OutboundMessage), rows)
+    return len(rows)
+
+
+def queue_outbound_message(phone, body, idempotency_key=None):
+    """
+    Adds a single message to the outbox; see queue_outbound_messages.
+    """
+    return queue_outbound_messages([(phone, body, idempotency_key)])
+
+
+def retry_delay(attempts, retry_after=None):
+    """
+    Exponential backoff with jitter, never shorter than the server's
+    Retry-After hint.
+    """
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    delay = delay * random.uniform(0.8, 1.2)
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def release_stale_claims(lease_seconds):
+    """
+    Returns messages claimed by a drain that died mid-batch to the queue.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=lease_seconds)
+    db.session.execute(
+        update(OutboundMessage)
+        .where(OutboundMessage.status == 'sending', OutboundMessage.claimed_at < cutoff)
+        .values(status='pending', claim_token=None)
+    )
+    db.session.commit()
+
+
+def claim_batch(batch_size):
+    """
+    Atomically marks up to `batch_size` due messages as being sent by this
+    drain and returns them. Concurrent drains never claim the same row.
+    """
+    now = datetime.utcnow()
+    due_ids = select(OutboundMessage.id).where(
+        OutboundMessage.status == 'pending',
+        OutboundMessage.next_attempt_at <= now,
+    ).order_by(OutboundMessage.next_attempt_at, OutboundMessage.id).limit(batch_size)
+
+    token = str(uuid.uuid4())
+    db.session.execute(
+        update(OutboundMessage)
+        .where(OutboundMessage.id.in_(due_ids.scalar_subquery()), OutboundMessage.status == 'pending')
+        .values(status='sending', claim_token=token, claimed_at=now),
+        execution_options={'synchronize_session': False},
+    )
+    db.session.commit()
+
+    claimed = db.session.execute(
+        select(OutboundMessage.id, OutboundMessage.phone, OutboundMessage.body, OutboundMessage.attempts)
+        .where(OutboundMessage.claim_token == token, OutboundMessage.status == 'sending')
+        .order_by(OutboundMessage.id)
+    ).all()
+    db.session.commit()  #  Don't hold a transaction open while the batch is sent
+    return claimed
+
+
+def classify_failure(error):
+    """
+    Returns (retryable, retry_after) for a failed send. Throttling, server
+    errors and network errors are retried; other client errors are not.
+    """
+    response = getattr(error, 'response', None)
+    if response is None:
+        return True, None
+    if response.status_code == 429 or response.status_code >= 500:
+        retry_after = response.headers.get('Retry-After')
+        return True, float(retry_after) if retry_after and retry_after.isdigit() else None
+    return False, None
+
+
+def send_batch(claimed, bucket):
+    """
+    Sends claimed messages on the WhatsApp thread pool, as fast as `bucket`
+    allows. Returns (response, error) for each message, in order.
+    """
+    executor = get_executor()
+    in_flight = []
+    for message in claimed:
+        bucket.acquire()
+        in_flight.append(executor.submit(post_whatsapp_message, message.phone, message.body))
+
+    results = []
+    for future in in_flight:
+        try:
+            results.append((future.result(), None))
+        except requests.exceptions.RequestException as e:
+            results.append((None, e))
+    return results
+
+
+async def send_batch_async(claimed, bucket):
+    """
+    send_batch from one event loop over an async HTTP client, rather than a
+    thread per request in flight.
+    """
+    import httpx
+
+    async def send(client, message):
+        try:
+            return await post_whatsapp_message_async(client, message.phone, message.body), None
+        except (httpx.HTTPError, ValueError) as e:  #  ValueError: a body that isn't JSON
+            return None, e
+
+    async with create_async_client() as client:
+        sends = []
+        for message in claimed:
+            await bucket.acquire_async()
+            sends.append(asyncio.create_task(send(client, message)))
+        return await asyncio.gather(*sends)
+
+
+def drain_outbox(rate_per_second, batch_size=500, max_attempts=8, max_seconds=50, lease_seconds=300,
+                 async_http=False, keep_lock=None):
+    """
+    Sends due outbox messages at no more than `rate_per_second`, for up to
+    `max_seconds`. Failed messages are retried with exponential backoff
+    until `max_attempts`, after which they are dead-lettered
+    (status 'dead', with the last error kept for inspection). With
+    `async_http`, each batch is sent by send_batch_async.
+
+    The rate only holds if one drain runs at a time; callers hold a
+    DrainGuard lock and pass `keep_lock`, which is called before each batch
+    and stops the drain if it returns False. Claims older than the lease
+    from claim_lease_seconds are taken to belong to a dead drain.
+
+    Returns counts of messages sent, scheduled for retry and dead-lettered.
+    """
+    stats = {'sent': 0, 'retried': 0, 'dead': 0}
+    bucket = TokenBucket(rate_per_second)
+    deadline = time.monotonic() + max_seconds
+
+    release_stale_claims(claim_lease_seconds(lease_seconds, batch_size, rate_per_second))
+
+    while time.monotonic() < deadline:
+        if keep_lock is not None and not keep_lock():
+            log.warning("Outbox: lost the drain lock, stopping")
+            break
+        claimed = claim_batch(batch_size)
+        if not claimed:
+            break
+
+        if async_http:
+            results = asyncio.run(send_batch_async(claimed, bucket))
+        else:
+            results = send_batch(claimed, bucket)
+
+        updates = []
+        now = datetime.utcnow()
+        for message, (response, error) in zip(claimed, results):
+            attempts = message.attempts + 1
+            if error is not None:
+                retryable, retry_after = classify_failure(error)
+                if retryable and attempts < max_attempts:
+                    status = 'pending'
+                    next_attempt_at = now + timedelta(seconds=retry_delay(attempts, retry_after))
+                    stats['retried'] += 1
+                else:
+                    status = 'dead'
+                    next_attempt_at = now
+                    stats['dead'] += 1
+                updates.append({
+                    'id': message.id, 'status': status, 'attempts': attempts,
+                    'next_attempt_at': next_attempt_at, 'last_error': str(error), 'claim_token': None,
+                })
+                continue
+
+            provider_ids = (response or {}).get('messages') or [{}]
+            updates.append({
+                'id': message.id, 'status': 'sent', 'attempts': attempts, 'sent_at': now,
+                'provider_message_id': provider_ids[0].get('id'), 'claim_token': None,
+            })
+            stats['sent'] += 1
+
+        #  Rows differ in which columns they set, so group them for executemany
+        for keys in {tuple(sorted(u)) for u in updates}:
+            db.session.execute(update(OutboundMessage), [u for u in updates if tuple(sorted(u)) == keys])
+        db.session.commit()
+
+    return stats
+
+
+def seconds_until_next_due():
+    """
+    Returns how long until the next pending message is due, or None if
+    the outbox has nothing pending.
+    """
+    next_at = db.session.scalar(
+        select(func.min(OutboundMessage.next_attempt_at)).where(OutboundMessage.status == 'pending')
+    )
+    if next_at is None:
+        return None
+    return max(0, (next_at - datetime.utcnow()).total_seconds())
@@ -0,0 +1,72 @@
+import hashlib
+from urllib.parse import urlencode
+
+from flask import current_app, request
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class BadPageRequest(ValueError):
+    pass
+
+
+def page_args():
+    """
+    Reads `limit` and `cursor` from the query string. The cursor is the id
+    of the last item on the previous page.
+    """
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        cursor = request.args.get('cursor')
+        cursor = int(cursor) if cursor else None
+    except ValueError:
+        raise BadPageRequest('limit and cursor must be integers')
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise BadPageRequest(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    return limit, cursor
+
+
+def keyset_page(query, id_column):
+    """
+    Returns (rows, next_cursor) for the page of `query` after the request's
+    cursor, ordered by `id_column`. Seeks straight to the cursor through the
+    index instead of counting past skipped rows, so deep pages cost the same
+    as the first one.
+    """
+    limit, cursor = page_args()
+    if cursor is not None:
+        query = query.filter(id_column > cursor)
+    rows = query.order_by(id_column).limit(limit + 1).all()
+    return split_page(rows, limit)
+
+
+def split_page(rows, limit):
+    """
+    Splits the `limit` + 1 rows fetched for a page into the page and the
+    cursor for the next one, None on the last page.
+    """
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def conditional_page(items, next_cursor):
+    """
+    Builds the JSON response for a page: the body is the list of items, the
+    next page is linked from the Link and X-Next-Cursor headers, and an ETag
+    of the body lets polling clients get a bodiless 304 Not Modified when
+    the page has not changed. There is no Last-Modified: rows change status
+    without any timestamp moving, so only the body can tell.
+    """
+    body = current_app.json.dumps(items) + "\n"
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(hashlib.sha1(body.encode()).hexdigest(), weak=True)
+    response.cache_control.no_cache = True  #  Always revalidate, never reuse blindly
+
+    if next_cursor is not None:
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+
+    return response.make_conditional(request)
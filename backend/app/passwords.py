@@ -0,0 +1,76 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+_pool = None
+_slots = None
+_pool_lock = threading.Lock()
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when every hashing worker is busy and the queue is full.
+    """
+
+
+def get_pool():
+    """
+    Returns this process's hashing pool, or None when hashing runs inline.
+    Created on first use, so each forked web worker gets its own.
+    """
+    global _pool, _slots
+    workers = current_app.config['PASSWORD_HASH_WORKERS']
+    if not workers:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers)
+            _slots = threading.BoundedSemaphore(workers * current_app.config['PASSWORD_HASH_QUEUE_PER_WORKER'])
+    return _pool
+
+
+def _run(fn, *args):
+    """
+    Runs a hashing call in the pool, waiting up to PASSWORD_HASH_QUEUE_TIMEOUT
+    for a slot. The request thread only waits, so the GIL stays free for
+    other requests while the hash is computed.
+    """
+    pool = get_pool()
+    if pool is None:
+        return fn(*args)
+    if not _slots.acquire(timeout=current_app.config['PASSWORD_HASH_QUEUE_TIMEOUT']):
+        raise PasswordHasherBusy()
+    try:
+        return pool.submit(fn, *args).result()
+    finally:
+        _slots.release()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def verify_password(password_hash, password):
+    if not password_hash:
+        return False
+    return _run(check_password_hash, password_hash, password)
+
+
+@lru_cache(maxsize=None)
+def _method_prefix(method):
+    #  Werkzeug fills in defaults (e.g. the pbkdf2 iteration count), so take
+    #  the prefix from a real hash rather than the configured string
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+def needs_rehash(password_hash):
+    """
+    Returns True if the hash was made with a different algorithm or cost
+    than PASSWORD_HASH_METHOD.
+    """
+    if not password_hash:
+        return False
+    return password_hash.split('$', 1)[0] != _method_prefix(current_app.config['PASSWORD_HASH_METHOD'])
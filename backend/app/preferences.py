@@ -0,0 +1,179 @@
+"""
+Turns a user's preferences and "about me" text into a small feature vector
+the matcher scores host/student pairs with.
+
+Preferences are either a JSON object or free text. Free text is read for
+keywords in English and Hebrew. Hosts and students are encoded differently
+(what a home offers, what a guest needs), so that a pair's compatibility
+is the dot product of the student's vector with the host's:
+
+- kashrut: a penalty for each level the host falls short of what the
+  student keeps;
+- shabbat: a penalty if the student wants an observant home and the host
+  isn't one;
+- languages: a bonus for the share of the student's languages the host
+  speaks;
+- smoking and pets: a penalty if the host smokes or has pets and the
+  student needs a smoke-free or pet-free home;
+- family: a bonus for larger households if the student asks for a family.
+
+A student with no stated preferences scores 0 with every host. Vectors
+are packed float32 bytes, stored on the user and rebuilt whenever the
+profile changes, so matching never parses text.
+"""
+import json
+import re
+from array import array
+
+KASHRUT_LEVELS = {'none': 0, 'kosher-style': 1, 'kosher': 2, 'mehadrin': 3}
+LANGUAGES = ('he', 'en', 'ru', 'fr', 'es', 'ar', 'am')
+
+KASHRUT_WEIGHT = 4.0
+SHABBAT_WEIGHT = 2.0
+LANGUAGE_WEIGHT = 1.0
+SMOKING_WEIGHT = 3.0
+PETS_WEIGHT = 3.0
+FAMILY_WEIGHT = 0.5
+MAX_FAMILY_SIZE = 8
+
+#  Layout: a constant term, one column per kashrut level above none, then
+#  shabbat, the languages, smoking, pets and household size
+BIAS = 0
+KASHRUT = 1
+SHABBAT = KASHRUT + len(KASHRUT_LEVELS) - 1
+LANGUAGE = SHABBAT + 1
+SMOKING = LANGUAGE + len(LANGUAGES)
+PETS = SMOKING + 1
+FAMILY = PETS + 1
+FEATURE_COUNT = FAMILY + 1
+FEATURE_BYTES = FEATURE_COUNT * 4
+
+LANGUAGE_NAMES = {
+    'he': r'hebrew|עברית', 'en': r'english|אנגלית', 'ru': r'russian|רוסית', 'fr': r'french|צרפתית',
+    'es': r'spanish|ספרדית', 'ar': r'arabic|ערבית', 'am': r'amharic|אמהרית',
+}
+KASHRUT_PATTERNS = [
+    (3, re.compile(r'mehadrin|glatt|מהדרין|חלק', re.IGNORECASE)),
+    (0, re.compile(r"\b(?:not|non|don't keep)[\s-]*kosher|לא כשר", re.IGNORECASE)),
+    (1, re.compile(r'kosher[\s-]*style', re.IGNORECASE)),
+    (2, re.compile(r'kosher|כשר', re.IGNORECASE)),
+]
+SHABBAT_PATTERN = re.compile(r'shabbat|shabbos|shomer|observant|religious|שומר שבת|דתי', re.IGNORECASE)
+NON_SMOKING_PATTERN = re.compile(r"non[\s-]*smok|smoke[\s-]*free|no smoking|don't smoke|ללא עישון|לא מעשן",
+                                 re.IGNORECASE)
+SMOKING_PATTERN = re.compile(r'smok|מעשן', re.IGNORECASE)
+PET_ALLERGY_PATTERN = re.compile(r'allerg|no pets|pet[\s-]*free|אלרג', re.IGNORECASE)
+PETS_PATTERN = re.compile(r'\b(?:dogs?|cats?|pets?)\b|כלב|חתול', re.IGNORECASE)
+FAMILY_PATTERN = re.compile(r'\b(?:kids|children|family)\b|ילדים|משפחה', re.IGNORECASE)
+FAMILY_SIZE_PATTERN = re.compile(r'family of (\d+)|(\d+) (?:kids|children)', re.IGNORECASE)
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+def _languages(value):
+    if isinstance(value, str):
+        value = re.split(r'[\s,;/]+', value)
+    found = set()
+    for item in value or []:
+        item = str(item).strip().lower()
+        for code, names in LANGUAGE_NAMES.items():
+            if item == code or re.fullmatch(names, item):
+                found.add(code)
+    return found
+
+
+def parse_preferences(preferences, about_me=None):
+    """
+    Returns the recognized preferences as a dict with any of 'kashrut'
+    (0-3), 'shabbat', 'languages' (a set of codes), 'smoking', 'smoke_free',
+    'pets', 'pet_allergy', 'family' and 'family_size'. A JSON object is
+    read by key; anything else, and the "about me" text, by keyword.
+    """
+    parsed = {}
+    try:
+        data = json.loads(preferences) if preferences else None
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        if 'kashrut' in data:
+            level = data['kashrut']
+            parsed['kashrut'] = KASHRUT_LEVELS.get(str(level).lower(), level if isinstance(level, int) else 0)
+            parsed['kashrut'] = min(max(parsed['kashrut'], 0), len(KASHRUT_LEVELS) - 1)
+        if 'languages' in data:
+            parsed['languages'] = _languages(data['languages'])
+        for key in ('shabbat', 'smoking', 'smoke_free', 'pets', 'pet_allergy', 'family'):
+            if key in data:
+                parsed[key] = _flag(data[key])
+        if isinstance(data.get('family_size'), int):
+            parsed['family_size'] = data['family_size']
+        preferences = None
+
+    text = ' '.join(part for part in (preferences, about_me) if part)
+    if not text:
+        return parsed
+    for level, pattern in KASHRUT_PATTERNS:
+        if 'kashrut' not in parsed and pattern.search(text):
+            parsed['kashrut'] = level
+    if 'shabbat' not in parsed and SHABBAT_PATTERN.search(text):
+        parsed['shabbat'] = True
+    languages = {code for code, names in LANGUAGE_NAMES.items() if re.search(names, text, re.IGNORECASE)}
+    if languages:
+        parsed['languages'] = parsed.get('languages', set()) | languages
+    if NON_SMOKING_PATTERN.search(text):
+        parsed.setdefault('smoke_free', True)
+    elif SMOKING_PATTERN.search(text):
+        parsed.setdefault('smoking', True)
+    if PET_ALLERGY_PATTERN.search(text):
+        parsed.setdefault('pet_allergy', True)
+    elif PETS_PATTERN.search(text):
+        parsed.setdefault('pets', True)
+    if FAMILY_PATTERN.search(text):
+        parsed.setdefault('family', True)
+    size = FAMILY_SIZE_PATTERN.search(text)
+    if size and 'family_size' not in parsed:
+        #  "3 kids" is a household of at least five
+        parsed['family_size'] = int(size.group(1)) if size.group(1) else int(size.group(2)) + 2
+    return parsed
+
+
+def encode_features(role, preferences, about_me=None):
+    """
+    Returns the packed feature vector for a host or student with these
+    preferences, or None for other roles.
+    """
+    parsed = parse_preferences(preferences, about_me)
+    vector = [0.0] * FEATURE_COUNT
+    if role == 'host':
+        vector[BIAS] = 1.0
+        for level in range(1, parsed.get('kashrut', 0) + 1):
+            vector[KASHRUT + level - 1] = 1.0
+        vector[SHABBAT] = float(parsed.get('shabbat', False))
+        for code in parsed.get('languages', ()):
+            vector[LANGUAGE + LANGUAGES.index(code)] = 1.0
+        vector[SMOKING] = float(parsed.get('smoking', False))
+        vector[PETS] = float(parsed.get('pets', False))
+        family_size = parsed.get('family_size', 4 if parsed.get('family') else 1)
+        vector[FAMILY] = min(max(family_size, 1), MAX_FAMILY_SIZE) / MAX_FAMILY_SIZE
+    elif role == 'student':
+        #  The bias cancels the kashrut and shabbat columns when the host
+        #  meets them, leaving a penalty for each one it doesn't
+        kashrut = parsed.get('kashrut', 0)
+        for level in range(1, kashrut + 1):
+            vector[KASHRUT + level - 1] = KASHRUT_WEIGHT
+        vector[BIAS] = -KASHRUT_WEIGHT * kashrut
+        if parsed.get('shabbat'):
+            vector[SHABBAT] = SHABBAT_WEIGHT
+            vector[BIAS] -= SHABBAT_WEIGHT
+        languages = parsed.get('languages', ())
+        for code in languages:
+            vector[LANGUAGE + LANGUAGES.index(code)] = LANGUAGE_WEIGHT / len(languages)
+        vector[SMOKING] = -SMOKING_WEIGHT if parsed.get('smoke_free') else 0.0
+        vector[PETS] = -PETS_WEIGHT if parsed.get('pet_allergy') else 0.0
+        vector[FAMILY] = FAMILY_WEIGHT if parsed.get('family') else 0.0
+    else:
+        return None
+    return array('f', vector).tobytes()
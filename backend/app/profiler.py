@@ -0,0 +1,72 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+log = logging.getLogger(__name__)
+
+
+def _fold(frame):
+    #  Outermost call first, in the collapsed format of flamegraph.pl and speedscope
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of every thread serving a request each `interval`
+    seconds. Requests slower than `threshold` seconds have their samples
+    written to `output_dir` as collapsed stacks, one .folded file per
+    request, ready for flamegraph.pl or speedscope.
+
+    Samples come from sys._current_frames, so this needs threaded workers:
+    under gevent every request shares one thread.
+    """
+
+    def __init__(self, interval=0.005, threshold=0.5, output_dir='profiles'):
+        self.interval = interval
+        self.threshold = threshold
+        self.output_dir = output_dir
+        self._active = {}  # thread id -> samples of the request it is serving
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start_request(self):
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+                self._thread.start()
+
+    def finish_request(self, name, seconds):
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if samples and seconds >= self.threshold:
+            self.write(name, seconds, samples)
+
+    def write(self, name, seconds, samples):
+        os.makedirs(self.output_dir, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', name).strip('-')
+        path = os.path.join(self.output_dir, f"{time.strftime('%Y%m%dT%H%M%S')}-{int(seconds * 1000)}ms-{slug}.folded")
+        with open(path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        log.info("Profiler: %s took %.0fms, stacks written to %s", name, seconds * 1000, path)
+        return path
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[_fold(frame)] += 1
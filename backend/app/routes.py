@@ -1,24 +1,123 @@
-from flask import Blueprint, request, jsonify
-from app import db, login_manager, limiter
-from app.models import User, HostAvailability, StudentRequest, Match
-from app.whatsapp import send_whatsapp_message
-from datetime import datetime
+import io
+import json
+import logging
+from functools import wraps
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from app import db, login_manager, limiter, cache, events, inbox
+from app.availability import save_availability, utilization_by_week
+from app.bulk import FORMATS, IMPORT_KINDS, export_matches, format_for, import_records
+from app.events import format_event
+from app.inbox import parse_webhook_messages, valid_signature
+from app.cache import profile_key, user_key, request_key, match_key
+from app.database import defer_write_lock
+from app.models import User, StudentRequest, Match, current_week_start, week_start_of
+from app.pagination import BadPageRequest, keyset_page, conditional_page
+from app.passwords import PasswordHasherBusy
+from app.matching import request_incremental_match
+from datetime import date, datetime, timedelta
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import make_transient_to_detached
 from flask_login import login_user, logout_user, login_required, current_user # Import login functions
-from werkzeug.security import generate_password_hash, check_password_hash
+
+log = logging.getLogger(__name__)
 
 main = Blueprint('main', __name__)
 
+#  Columns kept in the cached copy of a user; the password hash is left out
+#  and loaded from the database only if it is actually needed
+USER_CACHE_COLUMNS = ('id', 'name', 'phone', 'role', 'about_me', 'preferences', 'location')
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    cached = cache.get(user_key(user_id))
+    if cached is not None:
+        #  merge(load=False) attaches the cached row without querying the database
+        user = User(**json.loads(cached))
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    user = User.query.get(int(user_id))
+    if user:
+        cache.set(user_key(user_id), json.dumps({column: getattr(user, column) for column in USER_CACHE_COLUMNS}))
+    return user
+
+def cached_json(key, build):
+    """
+    Returns a JSON response for `key` from the cache, or calls `build` and
+    caches the serialized result. Returns None if `build` returns None.
+    """
+    body = cache.get(key)
+    if body is None:
+        data = build()
+        if data is None:
+            return None
+        body = current_app.json.dumps(data) + "\n"
+        cache.set(key, body)
+    return current_app.response_class(body, mimetype='application/json')
+
+def admin_required(view):
+    @wraps(view)
+    @login_required
+    def wrapped(*args, **kwargs):
+        if current_user.role != 'admin':
+            return jsonify({'error': 'Forbidden'}), 403
+        return view(*args, **kwargs)
+    return wrapped
+
+def paginated(query, id_column, serialize):
+    """
+    Returns one keyset page of `query` as a conditional JSON response, or a
+    400 if the limit or cursor is malformed.
+    """
+    try:
+        rows, next_cursor = keyset_page(query, id_column)
+    except BadPageRequest as e:
+        return jsonify({'error': str(e)}), 400
+    return conditional_page([serialize(row) for row in rows], next_cursor)
+
+def serialize_user(user):
+    return {
+        'id': user.id,
+        'name': user.name,
+        'phone': user.phone,
+        'role': user.role,
+        'about_me': user.about_me,
+        'preferences': user.preferences,
+        'location': user.location
+    }
+
+def serialize_request(request_obj):
+    return {
+        'id': request_obj.id,
+        'student_id': request_obj.student_id,
+        'location': request_obj.location,
+        'num_guests': request_obj.num_guests,
+        'created_at': request_obj.created_at,
+        'status': request_obj.status
+    }
 
+def serialize_match(match):
+    return {
+        'id': match.id,
+        'student_request_id': match.student_request_id,
+        'host_id': match.host_id,
+        'host_confirmed': match.host_confirmed,
+        'student_confirmed': match.student_confirmed,
+        'created_at': match.created_at,
+        'status': match.status,
+        'expires_at': match.expires_at
+    }
 
 
 @main.route('/')
 def home():
     return jsonify({'message': 'Welcome to Anywhere in Israel'}), 200
 
+def hasher_busy():
+    response = jsonify({'error': 'Server busy, please try again'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @main.route('/api/register', methods=['POST'])
 @limiter.limit("5/minute") # Limit to 5 requests per minute
 def register():
@@ -28,7 +127,6 @@ def register():
     role = data.get('role')  # 'student' or 'host'
     password = data.get('password') # Get the password
     confirmPassword = data.get('confirmPassword') # Get the password conf
-    print(f"{phone} {name} {role} {password} {confirmPassword}")
 
     if password != confirmPassword:
         return jsonify({'error': 'Passwords do not match'}), 400
@@ -37,26 +135,32 @@ def register():
     if not all([phone, name, role, password, confirmPassword]):
         return jsonify({'error': 'Missing fields'}), 400
 
+    defer_write_lock()
     user = User.query.filter_by(phone=phone).first()
     if user:
         return jsonify({'error': 'User already exists'}), 400
+    db.session.commit()  #  End the read before the password is hashed
 
     try:
         new_user = User(name=name, phone=phone, role=role)
+        new_user.refresh_features()
         new_user.set_password(password)
         db.session.add(new_user)
         db.session.commit()
     except IntegrityError as e:
         db.session.rollback()
-        print(f"IntegrityError: {e}")
+        log.warning("IntegrityError: %s", e)
         return jsonify({'error': 'A user with this phone number already exists'}), 400
+    except PasswordHasherBusy:
+        db.session.rollback()
+        return hasher_busy()
     except SQLAlchemyError as e:
         db.session.rollback()
-        print(f"SQLAlchemyError: {e}")
+        log.error("SQLAlchemyError: %s", e)
         return jsonify({'error': 'Database error'}), 500
     except Exception as e:
         db.session.rollback()
-        print(f"An unexpected error occurred: {e}")
+        log.exception("An unexpected error occurred: %s", e)
         return jsonify({'error': 'An unexpected error occurred'}), 500
 
     return jsonify({'message': 'User registered successfully'}, 201)
@@ -69,12 +173,23 @@ def login():
     role = data.get('role')
     password = data.get('password')
 
+    defer_write_lock()
     user = User.query.filter_by(phone=phone).first()
     if not user:
         return jsonify({'error': 'User not found'}), 404
+    #  Detach the user and end the read, so no transaction is open while the
+    #  password is checked; an upgraded hash is written in one of its own
+    db.session.expunge(user)
+    db.session.commit()
 
-    if not user.check_password(password): # Check the password
-        return jsonify({'error': 'Invalid credentials'}), 401
+    try:
+        if not user.check_password(password): # Check the password
+            return jsonify({'error': 'Invalid credentials'}), 401
+    except PasswordHasherBusy:
+        return hasher_busy()
+    db.session.add(user)
+    if db.session.dirty:
+        db.session.commit()  #  The hash was upgraded to the current parameters
 
     login_user(user) #  Log the user in
     return jsonify({'message': 'Login successful', 'user': {'name': user.name, 'role': role, 'id': user.id}}), 200
@@ -87,20 +202,14 @@ def logout():
 
 @main.route('/api/profile/<int:user_id>', methods=['GET'])
 def get_user_profile(user_id):
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
+    def build():
+        user = User.query.get(user_id)
+        return serialize_user(user) if user else None
 
-    profile = {
-        'id': user.id,
-        'name': user.name,
-        'phone': user.phone,
-        'role': user.role,
-        'about_me': user.about_me,
-        'preferences': user.preferences,
-        'location': user.location
-    }
-    return jsonify(profile), 200
+    response = cached_json(profile_key(user_id), build)
+    if response is None:
+        return jsonify({'error': 'User not found'}), 404
+    return response, 200
 
 @main.route('/api/profile/<int:user_id>', methods=['PUT'])
 def update_user_profile(user_id):
@@ -111,10 +220,14 @@ def update_user_profile(user_id):
     data = request.get_json()
     user.name = data.get('name', user.name)
     user.about_me = data.get('about_me', user.about_me)
-    user.preferences = data.get('preferences', user.preferences)
+    preferences = data.get('preferences', user.preferences)
+    #  Structured preferences may be sent as an object
+    user.preferences = json.dumps(preferences) if isinstance(preferences, dict) else preferences
     user.location = data.get('location', user.location)
+    user.refresh_features()
 
     db.session.commit()
+    cache.delete(profile_key(user_id), user_key(user_id))
     return jsonify({'message': 'Profile updated successfully'}), 200
 
 @main.route('/api/request', methods=['POST'])
@@ -131,57 +244,64 @@ def create_student_request():
     db.session.add(new_request)
     db.session.commit()
 
-    #  Potentially trigger matching here or in a Celery task
-    # match_students_with_hosts() 
+    #  Match this location in the background rather than waiting for the next full run
+    request_incremental_match(location)
 
     return jsonify({'message': 'Request created successfully'}), 201
 
 @main.route('/api/request/<int:request_id>', methods=['GET'])
 def get_student_request(request_id):
-    request_obj = StudentRequest.query.get(request_id)
-    if not request_obj:
-        return jsonify({'error': 'Request not found'}), 404
+    def build():
+        request_obj = StudentRequest.query.get(request_id)
+        return serialize_request(request_obj) if request_obj else None
 
-    request_data = {
-        'id': request_obj.id,
-        'student_id': request_obj.student_id,
-        'location': request_obj.location,
-        'num_guests': request_obj.num_guests,
-        'created_at': request_obj.created_at,
-        'status': request_obj.status
-    }
-    return jsonify(request_data), 200
+    response = cached_json(request_key(request_id), build)
+    if response is None:
+        return jsonify({'error': 'Request not found'}), 404
+    return response, 200
 
 @main.route('/api/request/student/<int:student_id>', methods=['GET'])
 def get_student_requests(student_id):
-    requests = StudentRequest.query.filter_by(student_id=student_id).all()
-    requests_data = []
-    for request_obj in requests:
-        requests_data.append({
-            'id': request_obj.id,
-            'student_id': request_obj.student_id,
-            'location': request_obj.location,
-            'num_guests': request_obj.num_guests,
-            'created_at': request_obj.created_at,
-            'status': request_obj.status
-        })
-    return jsonify(requests_data), 200
+    #  Paged by id; the next page is linked from the Link / X-Next-Cursor headers
+    query = StudentRequest.query.filter_by(student_id=student_id)
+    return paginated(query, StudentRequest.id, serialize_request)
 
 @main.route('/api/match/<int:match_id>', methods=['GET'])
 def get_match(match_id):
-    match = Match.query.get(match_id)
-    if not match:
+    def build():
+        match = Match.query.get(match_id)
+        return serialize_match(match) if match else None
+
+    response = cached_json(match_key(match_id), build)
+    if response is None:
         return jsonify({'error': 'Match not found'}), 404
-    
-    match_data = {
-        'id': match.id,
-        'student_request_id': match.student_request_id,
-        'host_id': match.host_id,
-        'host_confirmed': match.host_confirmed,
-        'student_confirmed': match.student_confirmed,
-        'created_at': match.created_at
-    }
-    return jsonify(match_data), 200
+    return response, 200
+
+@main.route('/api/match/user/<int:user_id>', methods=['GET'])
+def get_user_matches(user_id):
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    if user.role == 'host':
+        query = Match.query.filter(Match.host_id == user_id)
+    else:
+        query = Match.query.filter(Match.student_id == user_id)
+    return paginated(query, Match.id, serialize_match)
+
+def confirm_if_complete(match):
+    #  Once both sides confirm, the match (and its request) are final and no longer expire
+    if match.host_confirmed and match.student_confirmed:
+        match.status = 'confirmed'
+        request_obj = StudentRequest.query.get(match.student_request_id)
+        if request_obj:
+            request_obj.status = 'confirmed'
+
+def publish_match_update(match):
+    #  Pushes the new state to both sides' event streams so they need not poll
+    request_obj = StudentRequest.query.get(match.student_request_id)
+    recipients = [match.host_id] + ([request_obj.student_id] if request_obj else [])
+    events.publish_many([(user_id, 'match_updated', serialize_match(match)) for user_id in recipients])
 
 @main.route('/api/match/<int:match_id>/confirm/host', methods=['PUT'])
 def confirm_match_host(match_id):
@@ -189,8 +309,14 @@ def confirm_match_host(match_id):
     if not match:
         return jsonify({'error': 'Match not found'}), 404
 
+    if match.status == 'expired':
+        return jsonify({'error': 'Match has expired'}), 409
+
     match.host_confirmed = True
+    confirm_if_complete(match)
     db.session.commit()
+    cache.delete(match_key(match_id), request_key(match.student_request_id))
+    publish_match_update(match)
     return jsonify({'message': 'Host confirmed the match'}), 200
 
 @main.route('/api/match/<int:match_id>/confirm/student', methods=['PUT'])
@@ -199,13 +325,128 @@ def confirm_match_student(match_id):
     if not match:
         return jsonify({'error': 'Match not found'}), 404
 
+    if match.status == 'expired':
+        return jsonify({'error': 'Match has expired'}), 409
+
     match.student_confirmed = True
+    confirm_if_complete(match)
     db.session.commit()
+    cache.delete(match_key(match_id), request_key(match.student_request_id))
+    publish_match_update(match)
     return jsonify({'message': 'Student confirmed the match'}), 200
 
+@main.route('/api/admin/hosts', methods=['GET'])
+@admin_required
+def list_hosts():
+    query = User.query.filter(User.role == 'host')
+    location = request.args.get('location')
+    if location:
+        query = query.filter(User.location == location)
+    return paginated(query, User.id, serialize_user)
+
+@main.route('/api/admin/requests', methods=['GET'])
+@admin_required
+def list_requests():
+    query = StudentRequest.query
+    status = request.args.get('status')
+    if status:
+        query = query.filter(StudentRequest.status == status)
+    return paginated(query, StudentRequest.id, serialize_request)
+
+@main.route('/api/admin/matches', methods=['GET'])
+@admin_required
+def list_matches():
+    query = Match.query
+    status = request.args.get('status')
+    if status:
+        query = query.filter(Match.status == status)
+    return paginated(query, Match.id, serialize_match)
+
+@main.route('/api/admin/utilization', methods=['GET'])
+@admin_required
+def get_utilization():
+    """
+    Weekly host utilization for the last ?weeks= weeks (12 by default),
+    up to and including the current one.
+    """
+    weeks = request.args.get('weeks', 12, type=int)
+    if not 1 <= weeks <= 520:
+        return jsonify({'error': 'weeks must be between 1 and 520'}), 400
+    last_week = current_week_start()
+    return jsonify(utilization_by_week(last_week - timedelta(weeks=weeks - 1), last_week)), 200
+
+@main.route('/api/admin/import/<kind>', methods=['POST'])
+@admin_required
+def import_data(kind):
+    """
+    Imports a CSV or JSONL request body of users, availability or requests,
+    streamed a batch at a time. The format comes from ?format= or the
+    Content-Type.
+    """
+    if kind not in IMPORT_KINDS:
+        return jsonify({'error': f"Unknown import {kind!r}"}), 404
+    fmt = request.args.get('format') or format_for(request.content_type)
+    if fmt not in FORMATS:
+        return jsonify({'error': f"Unknown format {fmt!r}"}), 400
+    lines = io.TextIOWrapper(io.BufferedReader(request.stream), encoding='utf-8', newline='')
+    try:
+        report = import_records(kind, lines, fmt)
+    except UnicodeDecodeError:
+        return jsonify({'error': 'The body is not UTF-8'}), 400
+    return jsonify(report), 200
+
+@main.route('/api/admin/export/matches', methods=['GET'])
+@admin_required
+def export_match_history():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        return jsonify({'error': f"Unknown format {fmt!r}"}), 400
+    after_id = request.args.get('after_id', 0, type=int)
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(export_matches(fmt, after_id)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=matches.{fmt}'})
+
+@main.route('/api/events', methods=['GET'])
+@login_required
+@limiter.exempt
+def stream_events():
+    """
+    Streams the logged-in user's match events as Server-Sent Events.
+
+    The generator holds no app context or database connection while it
+    waits, so an idle stream costs one queue. Run the web workers with
+    gevent (`gunicorn -k gevent --worker-connections 5000 run:app`) so
+    each stream is a greenlet rather than a thread.
+    """
+    subscription = events.subscribe(current_user.id)
+    heartbeat = current_app.config['SSE_HEARTBEAT_SECONDS']
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                message = subscription.get(timeout=heartbeat)
+                yield format_event(message) if message is not None else ": keepalive\n\n"
+        finally:
+            events.unsubscribe(subscription)
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  #  Stop nginx from buffering the stream
+    })
+
+@main.route('/api/cache/stats', methods=['GET'])
+@admin_required
+def get_cache_stats():
+    return jsonify(cache.stats()), 200
+
 @main.route('/api/host/availability', methods=['POST'])
 @login_required
 def update_availability():
+    """
+    Sets the host's availability for the current week, or for the upcoming
+    week that `week_start` (an ISO date) falls in.
+    """
     data = request.get_json()
     host_id = current_user.id
     available = data.get('available')
@@ -214,70 +455,55 @@ def update_availability():
     if not all([isinstance(available, bool), isinstance(capacity, int)]):
         return jsonify({'error': 'Invalid data'}), 400
 
-    availability = HostAvailability.query.filter_by(host_id=host_id).first()
-    if not availability:
-        availability = HostAvailability(host_id=host_id, available=available, capacity=capacity)
-        db.session.add(availability)
-    else:
-        availability.available = available
-        availability.capacity = capacity
-
+    this_week = current_week_start()
+    week_start = this_week
+    if data.get('week_start'):
+        try:
+            week_start = week_start_of(date.fromisoformat(data['week_start']))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid week_start'}), 400
+        if week_start < this_week:
+            return jsonify({'error': 'Past weeks cannot be changed'}), 400
+
+    location = current_user.location  #  Read before the commit expires it, so scheduling opens no transaction
+    became_available = save_availability({host_id: (available, capacity)}, week_start)
     db.session.commit()
-    return jsonify({'message': 'Availability updated'}), 200
+    if became_available and week_start == this_week and location:
+        request_incremental_match(location)
+    return jsonify({'message': 'Availability updated', 'week_start': week_start.isoformat()}), 200
+
 
+@main.route('/api/webhook/whatsapp', methods=['GET'])
+@limiter.exempt
+def verify_whatsapp_webhook():
+    #  Meta's subscription check: echo the challenge if the token matches
+    token = current_app.config['WHATSAPP_VERIFY_TOKEN']
+    if token and request.args.get('hub.mode') == 'subscribe' and request.args.get('hub.verify_token') == token:
+        return request.args.get('hub.challenge', ''), 200
+    return jsonify({'error': 'Verification failed'}), 403
 
 @main.route('/api/webhook/whatsapp', methods=['POST'])
+@limiter.exempt  #  Meta's servers are authenticated by signature, and a 429 would only make them retry
 def whatsapp_webhook():
-    data = request.get_json()
-    message = data.get('message')
-    sender = data.get('phone')
-
-    #  Logic to extract host_id from sender/message is crucial here
-    #  This is highly dependent on how your WhatsApp integration works
-    #  For example, you might have a mapping of phone numbers to host_ids
-    #  Or you might use a keyword in the message.
-    #  For now, I'll leave this as a placeholder:
-    
-    host_id = extract_host_id(sender, message)  
-    if not host_id:
-        return jsonify({'error': 'Host ID not found'}), 400
-
-    if "yes" in message.lower():
-        #  Update HostAvailability
-        availability = HostAvailability.query.filter_by(host_id=host_id).first()
-        if availability:
-            availability.available = True
-            #  Extract capacity from the message if provided
-            capacity = extract_capacity(message)
-            if capacity:
-                availability.capacity = capacity
-            db.session.commit()
-        
-        #  Potentially update Match status if a match is pending for this host
-        #  (Logic depends on your match workflow)
-        response = "Great! You've confirmed hosting."
-    elif "no" in message.lower():
-        #  Update HostAvailability if needed
-        availability = HostAvailability.query.filter_by(host_id=host_id).first()
-        if availability:
-            availability.available = False
-            db.session.commit()
-        #  Potentially update Match status if a match is pending
-        response = "No problem, we will find another student."
-    else:
-        response = "Reply with 'Yes' to confirm or 'No' to decline."
-
-    send_whatsapp_message(sender, response)
-    return jsonify({'message': 'Response received'}), 200
-
-#  Helper functions (these need to be implemented based on your WhatsApp setup)
-def extract_host_id(sender, message):
-    #  Implement logic to extract host_id from WhatsApp message
-    #  This is a placeholder
-    return None
-
-def extract_capacity(message):
-    #  Implement logic to extract capacity from WhatsApp message
-    #  This is a placeholder
-    return None
+    """
+    Acknowledges inbound WhatsApp messages as soon as they are queued;
+    process_inbound_messages applies them. Meta retries deliveries that
+    are not acknowledged quickly, and the inbox drops those it has seen.
+    """
+    body = request.get_data()
+    if not valid_signature(current_app.config['WHATSAPP_APP_SECRET'], body,
+                           request.headers.get('X-Hub-Signature-256')):
+        return jsonify({'error': 'Invalid signature'}), 403
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid payload'}), 400
+
+    messages = parse_webhook_messages(data)
+    try:
+        queued = inbox.submit(messages)
+    except Exception as e:
+        #  Not acknowledged, so Meta delivers the messages again later
+        log.error("Could not queue %d webhook messages: %s", len(messages), e)
+        return jsonify({'error': 'Try again later'}), 503
+    return jsonify({'received': len(messages), 'queued': queued}), 200
 
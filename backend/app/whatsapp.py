@@ -1,28 +1,110 @@
 #  app/whatsapp.py
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from app.metrics import WHATSAPP_REQUEST_SECONDS
 
-WHATSAPP_API_URL = "https://graph.facebook.com/v17.0/YOUR_PHONE_NUMBER_ID/messages"  #  Replace with your API URL
+WHATSAPP_API_URL = os.getenv("WHATSAPP_API_URL", "https://graph.facebook.com/v17.0/YOUR_PHONE_NUMBER_ID/messages")  #  Replace with your API URL
 ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")  #  Ensure you have this in your .env
+REQUEST_TIMEOUT = float(os.getenv("WHATSAPP_TIMEOUT", 10))  #  Seconds
+MAX_CONCURRENCY = int(os.getenv("WHATSAPP_MAX_CONCURRENCY", 16))
 
-def send_whatsapp_message(phone, message):
-    headers = {
-        "Authorization": f"Bearer {ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    payload = {
+_session = None
+_executor = None
+
+
+def get_session():
+    """
+    Returns the process-wide HTTP session, whose connection pool keeps
+    connections to the Graph API alive between messages.
+    """
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENCY)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({
+            "Authorization": f"Bearer {ACCESS_TOKEN}",
+            "Content-Type": "application/json"
+        })
+        _session = session
+    return _session
+
+
+def get_executor():
+    """
+    Returns the process-wide thread pool used to send messages in the
+    background. Its size bounds the number of concurrent requests.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="whatsapp")
+    return _executor
+
+
+def create_async_client():
+    """
+    Returns a new httpx.AsyncClient for the Graph API, with the session's
+    headers and connection limit. An async client belongs to the event
+    loop that uses it, so there is no process-wide one; close it when done.
+    """
+    import httpx
+    return httpx.AsyncClient(
+        headers={
+            "Authorization": f"Bearer {ACCESS_TOKEN}",
+            "Content-Type": "application/json"
+        },
+        limits=httpx.Limits(max_connections=MAX_CONCURRENCY, max_keepalive_connections=MAX_CONCURRENCY),
+        #  Like the thread pool's queue, waiting for a free connection never times out
+        timeout=httpx.Timeout(REQUEST_TIMEOUT, pool=None),
+    )
+
+
+def _text_message(phone, message):
+    return {
         "messaging_product": "whatsapp",
         "to": phone,
         "type": "text",
         "text": {"body": message}
     }
+
+
+def post_whatsapp_message(phone, message):
+    """
+    Sends a message and returns the API response. Raises
+    requests.exceptions.RequestException if it could not be sent.
+    """
+    start = time.perf_counter()
     try:
-        response = requests.post(WHATSAPP_API_URL, headers=headers, json=payload)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending WhatsApp message: {e}")
-        return None
+        response = get_session().post(WHATSAPP_API_URL, json=_text_message(phone, message), timeout=REQUEST_TIMEOUT)
+    except requests.exceptions.RequestException:
+        WHATSAPP_REQUEST_SECONDS.observe(time.perf_counter() - start, status='error')
+        raise
+    WHATSAPP_REQUEST_SECONDS.observe(time.perf_counter() - start, status=response.status_code)
+    response.raise_for_status()  # Raise an exception for bad status codes
+    return response.json()
+
+async def post_whatsapp_message_async(client, phone, message):
+    """
+    Sends a message through `client`, from create_async_client(), and
+    returns the API response. Raises httpx.HTTPError if it could not be
+    sent.
+    """
+    import httpx
+    start = time.perf_counter()
+    try:
+        response = await client.post(WHATSAPP_API_URL, json=_text_message(phone, message))
+    except httpx.HTTPError:
+        WHATSAPP_REQUEST_SECONDS.observe(time.perf_counter() - start, status='error')
+        raise
+    WHATSAPP_REQUEST_SECONDS.observe(time.perf_counter() - start, status=response.status_code)
+    response.raise_for_status()
+    return response.json()
 
 def generate_availability_request_message():
     """
@@ -46,4 +128,16 @@ def generate_confirmation_reminder():
     """
     Generates a reminder message for hosts and students to confirm.
     """
-    return "Please confirm your match within 24 hours."
\ No newline at end of file
+    return "Please confirm your match within 24 hours."
+
+def generate_match_expired_host():
+    """
+    Generates the message telling a host that an unconfirmed match has expired.
+    """
+    return "Your student match has expired because it was not confirmed within 24 hours."
+
+def generate_match_expired_student(location):
+    """
+    Generates the message telling a student that an unconfirmed match has expired.
+    """
+    return f"Your match in {location} has expired because it was not confirmed in time. We'll look for another host for you."
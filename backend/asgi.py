@@ -0,0 +1,4 @@
+#  ASGI entry point: uvicorn asgi:app --workers 4 (see app.asgi)
+from app.asgi import create_asgi_app
+
+app = create_asgi_app()
@@ -0,0 +1,21 @@
+"""
+Offline benchmark suite. Run each module from backend/ with `python -m`:
+
+- datagen: synthetic users, availability, requests and matches at any scale
+- load_http: HTTP load driver for the register/login/profile/request/confirm flows
+- bench_tasks: the Celery tasks on an in-process worker and in-memory broker
+- bench_webhook: webhook acknowledgement and batched reply processing under load
+- bench_matching: the matching run as the number of requests grows, with or without preferences
+- bench_availability: matcher host loading and utilization reports as weekly history grows
+- bench_logging: logging overhead per request under the load_http load
+- bench_import: bulk import of 100k users, availability and requests, and match export
+- bench_asgi: one ASGI worker against one threaded WSGI worker as concurrent clients grow
+- bench_cache, bench_db_load, bench_events, bench_limiter, bench_locations,
+  bench_login, bench_startup, bench_whatsapp: focused micro-benchmarks
+- checks: fails if a behaviour regresses (e.g. repeated matching overbooks a host)
+- query_plans: fails if a hot query stops using an index
+- stub_whatsapp: local stand-in for the WhatsApp Graph API
+
+Benchmarks that take --output write JSON results; compare two runs with
+`python -m benchmarks.compare baseline.json candidate.json`.
+"""
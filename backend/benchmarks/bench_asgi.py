@@ -0,0 +1,269 @@
+"""
+Concurrency per worker, side by side: the same app served by one WSGI
+worker (gunicorn with --threads threads, the current setup) and by one
+ASGI worker (uvicorn asgi:app), under increasing numbers of concurrent
+clients reading profiles, requests and matches and posting to the
+WhatsApp webhook.
+
+Both servers run as subprocesses over the same temporary SQLite database
+seeded with benchmarks.datagen, or over --database-url (seeded with
+datagen at the same --scale and --matched 1), with rate limits counted in
+memory and set high enough not to trip. Before the load, the same URLs
+are fetched from both and must answer with the same status, body and
+paging headers.
+
+For each number of clients, reports each server's throughput, latency
+percentiles and failed requests. Exits non-zero if the responses differ
+or the ASGI worker fails a larger share of requests than the WSGI one
+(with hundreds of clients on a small machine, the client itself can drop
+a few keep-alive connections to either server).
+
+Usage (from backend/):
+    python -m benchmarks.bench_asgi [--scale 1000] [--duration 10] [--threads 8]
+        [--cache-type none] [--database-url URL] [--output results.json] [clients...]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+from benchmarks.results import summarize, write_results
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIENTS = [8, 64, 256]
+
+#  Relative weights of the requests each client repeats
+STEPS = {
+    'get profile': 3,
+    'get request': 1,
+    'list requests': 2,
+    'get match': 2,
+    'list matches': 2,
+    'webhook': 2,
+}
+
+#  Headers that must agree between the servers; Link carries the port
+COMPARED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'X-Next-Cursor', 'Cache-Control')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_commands(threads):
+    """
+    Returns the command line for each server, given a port.
+    """
+    return {
+        'wsgi': lambda port: [sys.executable, '-m', 'gunicorn', '--workers', '1', '--threads', str(threads),
+                              '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:create_app()'],
+        'asgi': lambda port: [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1',
+                              '--port', str(port), '--log-level', 'warning', '--no-access-log'],
+    }
+
+
+def start_server(command, env, log_path):
+    """
+    Starts a server subprocess and waits until it answers. Returns the
+    process and its base URL.
+    """
+    port = free_port()
+    log_file = open(log_path, 'w')
+    process = subprocess.Popen(command(port), cwd=BACKEND_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{command(port)[2]} exited with {process.returncode}; see {log_path}")
+        try:
+            if httpx.get(base_url + '/', timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{command(port)[2]} did not start; see {log_path}")
+
+
+def webhook_payload(phone):
+    return {'entry': [{'changes': [{'value': {'messages': [
+        {'id': f'wamid.{uuid.uuid4().hex}', 'from': phone.lstrip('+'), 'type': 'text', 'text': {'body': 'Yes 2'}},
+    ]}}]}]}
+
+
+def request_for(step, rng, scale):
+    """
+    Returns (method, path, json body) for one client step.
+    """
+    host_id = rng.randint(1, scale)
+    student_id = scale + rng.randint(1, scale)
+    if step == 'get profile':
+        return 'GET', f'/api/profile/{rng.choice((host_id, student_id))}', None
+    if step == 'get request':
+        return 'GET', f'/api/request/{rng.randint(1, scale)}', None
+    if step == 'list requests':
+        return 'GET', f'/api/request/student/{student_id}?limit=20', None
+    if step == 'get match':
+        return 'GET', f'/api/match/{rng.randint(1, scale)}', None
+    if step == 'list matches':
+        return 'GET', f'/api/match/user/{rng.choice((host_id, student_id))}?limit=20', None
+    from benchmarks.datagen import host_phone
+    return 'POST', '/api/webhook/whatsapp', webhook_payload(host_phone(host_id))
+
+
+def compare_servers(base_urls, scale):
+    """
+    Fetches the same URLs from every server. Returns a description of each
+    difference found.
+    """
+    from benchmarks.datagen import host_phone
+    student_id = scale + 1
+    checks = [
+        ('GET', '/api/profile/1', None, {}),
+        ('GET', f'/api/profile/{student_id}', None, {}),
+        ('GET', '/api/profile/0', None, {}),
+        ('GET', '/api/request/1', None, {}),
+        ('GET', '/api/request/0', None, {}),
+        ('GET', f'/api/request/student/{student_id}', None, {}),
+        ('GET', f'/api/request/student/{student_id}?limit=0', None, {}),
+        ('GET', '/api/match/1', None, {}),
+        ('GET', '/api/match/0', None, {}),
+        ('GET', '/api/match/user/1?limit=1', None, {}),
+        ('GET', f'/api/match/user/{student_id}', None, {}),
+        ('GET', '/api/match/user/0', None, {}),
+        ('POST', '/api/webhook/whatsapp', {'phone': host_phone(1), 'message': 'No'}, {}),
+        ('POST', '/api/webhook/whatsapp', None, {'Content-Type': 'application/json'}),
+    ]
+    differences = []
+    for method, path, body, headers in checks:
+        answers = {}
+        for name, base_url in base_urls.items():
+            response = httpx.request(method, base_url + path, json=body, headers=headers, timeout=10)
+            etag = response.headers.get('ETag')
+            revalidated = None
+            if etag:
+                revalidated = httpx.get(base_url + path, headers={'If-None-Match': etag}, timeout=10).status_code
+            answers[name] = (response.status_code, response.content, revalidated,
+                             {header: response.headers.get(header) for header in COMPARED_HEADERS})
+        if len(set(json.dumps(answer, default=repr, sort_keys=True) for answer in answers.values())) > 1:
+            differences.append(f"{method} {path}: {answers}")
+    return differences
+
+
+async def run_load(base_url, clients, duration, scale, seed):
+    """
+    Runs `clients` concurrent clients for `duration` seconds. Returns the
+    latencies of the requests that succeeded and the number that failed.
+    """
+    latencies = []
+    failed = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def run_client(number):
+            nonlocal failed
+            rng = random.Random(seed * 100_000 + number)
+            while time.monotonic() < deadline:
+                step = rng.choices(list(STEPS), weights=list(STEPS.values()))[0]
+                method, path, body = request_for(step, rng, scale)
+                start = time.perf_counter()
+                try:
+                    response = await client.request(method, path, json=body)
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    failed += 1
+
+        await asyncio.gather(*(run_client(number) for number in range(clients)))
+    return latencies, failed
+
+
+def seed_database(database_url, scale):
+    os.environ['DATABASE_URL'] = database_url
+    from app import create_app, db
+    import app.models  #  The cli profile doesn't load the models itself
+    from benchmarks.datagen import populate
+    flask_app = create_app('cli')
+    with flask_app.app_context():
+        db.create_all()
+        populate(scale, scale, matched_share=1.0)
+
+
+def main(args):
+    workdir = tempfile.mkdtemp()
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    if not args.database_url:
+        seed_database(database_url, args.scale)
+
+    env = dict(os.environ, DATABASE_URL=database_url, APP_PROFILE='web', CACHE_TYPE=args.cache_type,
+               RATELIMIT_STORAGE_URI='memory://', RATELIMIT_DEFAULT='1000000 per second',
+               LOG_SAMPLE_RATE='0', METRICS_ENABLED='true')
+    servers = {}
+    try:
+        for name, command in server_commands(args.threads).items():
+            servers[name] = start_server(command, env, os.path.join(workdir, f'{name}.log'))
+        base_urls = {name: base_url for name, (_, base_url) in servers.items()}
+
+        differences = compare_servers(base_urls, args.scale)
+        for difference in differences:
+            print(f"DIFFERENT: {difference}")
+
+        results = []
+        print(f"one worker each: wsgi = gunicorn --threads {args.threads}, asgi = uvicorn; "
+              f"{args.duration:.0f}s per run, cache {args.cache_type}")
+        print(f"{'clients':>8} {'server':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'failed':>7}")
+        for clients in args.clients or CLIENTS:
+            for name, base_url in base_urls.items():
+                start = time.monotonic()
+                latencies, failed = asyncio.run(run_load(base_url, clients, args.duration, args.scale, clients))
+                elapsed = time.monotonic() - start
+                row = {'name': f'{name} x{clients}', 'server': name, 'clients': clients,
+                       'requests_per_s': len(latencies) / elapsed, 'failed': failed, **summarize(latencies)}
+                results.append(row)
+                print(f"{clients:>8} {name:>7} {row['requests_per_s']:>8.1f} {row.get('p50_ms', 0):>8.2f} "
+                      f"{row.get('p99_ms', 0):>8.2f} {failed:>7}")
+    finally:
+        for process, _ in servers.values():
+            process.terminate()
+            process.wait(timeout=30)
+
+    if args.output:
+        write_results(args.output, 'asgi_vs_wsgi', vars(args), results)
+    failed_share = {}
+    for name in base_urls:
+        rows = [row for row in results if row['server'] == name]
+        failed = sum(row['failed'] for row in rows)
+        failed_share[name] = failed / max(1, failed + sum(row['count'] for row in rows))
+    if differences or failed_share['asgi'] > failed_share['wsgi']:
+        print(f"FAILED: {len(differences)} differing responses, {failed_share['asgi']:.2%} of ASGI requests "
+              f"failed against {failed_share['wsgi']:.2%} of WSGI ones; server logs in {workdir}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=1000, help='seeded hosts and students')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per server and number of clients')
+    parser.add_argument('--threads', type=int, default=8, help='threads in the WSGI worker')
+    parser.add_argument('--cache-type', default='none', choices=['none', 'memory', 'redis'],
+                        help="CACHE_TYPE for both servers; 'none' makes every read wait on the database")
+    parser.add_argument('--database-url', help='an already seeded database to serve instead of a temporary SQLite one')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('clients', nargs='*', type=int)
+    sys.exit(main(parser.parse_args()))
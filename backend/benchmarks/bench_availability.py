@@ -0,0 +1,101 @@
+"""
+Matcher host loading as weekly availability history piles up, before and
+after archiving.
+
+For each amount of history, fills a temporary SQLite database with hosts
+that each have a row for the current week and every past week, then
+times load_available_hosts (what every matching run reads) and a
+52-week utilization report. It then archives everything older than
+AVAILABILITY_HOT_WEEKS and times both again.
+
+Exits non-zero if the current-week host load with the most history is
+more than --max-slowdown times slower than with none.
+
+Usage (from backend/):
+    python -m benchmarks.bench_availability [--hosts 10000] [--repeat 20]
+        [--max-slowdown 3] [--output results.json] [history weeks...]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+from app import create_app, db
+from app.availability import archive_availability, utilization_by_week
+from app.matching import load_available_hosts
+from app.models import current_week_start
+from benchmarks.datagen import populate
+from benchmarks.results import write_results
+
+HISTORY_WEEKS = [0, 52, 156]
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def measure(repeat):
+    week = current_week_start()
+    return {
+        'load_hosts_ms': best_of(repeat, load_available_hosts),
+        'utilization_52w_ms': best_of(max(1, repeat // 10),
+                                      lambda: utilization_by_week(week - timedelta(weeks=51), week)),
+    }
+
+
+def main(args):
+    app = create_app('worker')
+    results = []
+    with app.app_context():
+        db.create_all()
+        print(f"{args.hosts} hosts; best of {args.repeat} runs, in milliseconds")
+        print(f"{'history':>8} {'rows':>10} {'load hosts':>11} {'52w report':>11} {'archived':>9} "
+              f"{'load hosts':>11} {'52w report':>11}")
+        for weeks in args.history_weeks or HISTORY_WEEKS:
+            counts = populate(args.hosts, 0, history_weeks=weeks)
+            db.session.execute(db.text('ANALYZE'))
+            db.session.commit()
+            hot = measure(args.repeat)
+
+            before = current_week_start() - timedelta(weeks=app.config['AVAILABILITY_HOT_WEEKS'])
+            start = time.perf_counter()
+            archived = archive_availability(before, app.config['AVAILABILITY_ARCHIVE_CHUNK_SIZE'])
+            archive_seconds = time.perf_counter() - start
+            db.session.execute(db.text('ANALYZE'))
+            db.session.commit()
+            cold = measure(args.repeat)
+
+            results.append({'name': f"{weeks} weeks", 'history_weeks': weeks,
+                            'rows': counts['host_availability'], 'archived': archived,
+                            'archive_seconds': archive_seconds, **hot,
+                            **{f"archived_{key}": value for key, value in cold.items()}})
+            print(f"{weeks:>8} {counts['host_availability']:>10} {hot['load_hosts_ms']:>11.1f} "
+                  f"{hot['utilization_52w_ms']:>11.1f} {archived:>9} {cold['load_hosts_ms']:>11.1f} "
+                  f"{cold['utilization_52w_ms']:>11.1f}")
+
+    if args.output:
+        write_results(args.output, 'availability_history', vars(args), results)
+    slowdown = results[-1]['load_hosts_ms'] / results[0]['load_hosts_ms']
+    if slowdown > args.max_slowdown:
+        print(f"FAILED: loading hosts is {slowdown:.1f}x slower with {results[-1]['history_weeks']} weeks of history")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hosts', type=int, default=10_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--max-slowdown', type=float, default=3)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('history_weeks', nargs='*', type=int)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,85 @@
+"""
+Measures p50/p99 latency of the polled read endpoints (profile, request,
+match) with the read-through cache enabled and disabled, using the Flask
+test client against SQLite.
+
+Usage (from backend/):
+    python -m benchmarks.bench_cache [--requests 5000] [--cache memory|redis]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+_db_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'bench.db')}"
+
+from sqlalchemy import insert
+
+from app import create_app, db, cache, limiter
+from app.models import User, StudentRequest, Match
+
+ROWS = 1000
+
+
+def populate():
+    db.session.execute(insert(User), [
+        {'id': i, 'name': f'user{i}', 'phone': f'p{i}', 'role': 'student' if i % 2 else 'host',
+         'about_me': 'x' * 200, 'location': 'Jerusalem'}
+        for i in range(1, ROWS + 1)
+    ])
+    db.session.execute(insert(StudentRequest), [
+        {'id': i, 'student_id': i, 'location': 'Jerusalem', 'num_guests': 2} for i in range(1, ROWS + 1)
+    ])
+    db.session.execute(insert(Match), [
+        {'id': i, 'student_request_id': i, 'host_id': i + 1 - i % 2, 'student_id': i} for i in range(1, ROWS + 1)
+    ])
+    db.session.commit()
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def run(client, count):
+    """
+    Polls the read endpoints over a small hot set, the way the matches page does.
+    """
+    latencies = []
+    for i in range(count):
+        item = 1 + (i * 7) % 100
+        path = ('/api/profile/{}', '/api/request/{}', '/api/match/{}')[i % 3].format(item)
+        start = time.perf_counter()
+        response = client.get(path)
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+    return latencies
+
+
+def main(count, cache_type):
+    app = create_app()
+    limiter.enabled = False  #  Measure the endpoints, not the rate limiter
+    with app.app_context():
+        db.create_all()
+        populate()
+
+    client = app.test_client()
+    print(f"{'cache':>8} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8} {'hit rate':>9}")
+    for label, config in (('none', 'none'), (cache_type, cache_type)):
+        app.config['CACHE_TYPE'] = config
+        cache.init_app(app)
+        cache.hits = cache.misses = 0
+        run(client, 300)  #  Warm up
+        latencies = run(client, count)
+        print(f"{label:>8} {percentile(latencies, 50) * 1000:>8.3f} {percentile(latencies, 99) * 1000:>8.3f} "
+              f"{statistics.mean(latencies) * 1000:>8.3f} {cache.stats()['hit_rate']:>9.2%}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--cache', default='memory', choices=['memory', 'redis'])
+    args = parser.parse_args()
+    main(args.requests, args.cache)
@@ -0,0 +1,136 @@
+"""
+Runs mixed read/write traffic from several processes, the way gunicorn
+workers share a database, and reports throughput, latency and errors for
+each database engine profile.
+
+Each process drives the app through the Flask test client: 80% GETs of
+requests and match listings, 20% profile updates and match confirmations.
+
+Usage (from backend/):
+    python -m benchmarks.bench_db_load [--processes 4] [--seconds 10]
+        [--postgres-url postgresql://... [--replica-url postgresql://...]]
+
+The Postgres URLs must point at scratch databases: their tables are
+created and emptied.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+ROWS = 500
+READ_SHARE = 0.8
+
+
+def profiles(args):
+    db_dir = tempfile.mkdtemp()
+    yield 'sqlite rollback journal', {
+        'DATABASE_URL': f"sqlite:///{os.path.join(db_dir, 'rollback.db')}",
+        'SQLITE_JOURNAL_MODE': 'delete', 'SQLITE_SYNCHRONOUS': 'full',
+    }
+    yield 'sqlite wal', {
+        'DATABASE_URL': f"sqlite:///{os.path.join(db_dir, 'wal.db')}",
+        'SQLITE_JOURNAL_MODE': 'wal', 'SQLITE_SYNCHRONOUS': 'normal',
+    }
+    if args.postgres_url:
+        yield 'postgres', {'DATABASE_URL': args.postgres_url}
+        if args.replica_url:
+            yield 'postgres + replica', {'DATABASE_URL': args.postgres_url, 'READ_REPLICA_URL': args.replica_url}
+
+
+def make_app(env):
+    #  Runs in a fresh (spawned) interpreter, so Config picks up the profile's environment
+    os.environ.update(env, CACHE_TYPE='none', PASSWORD_HASH_WORKERS='0')
+    from app import create_app, limiter
+    app = create_app()
+    limiter.enabled = False
+    return app
+
+
+def populate(env):
+    from sqlalchemy import delete, insert
+    app = make_app(env)
+    from app import db
+    from app.models import User, StudentRequest, Match
+    with app.app_context():
+        db.create_all()
+        for model in (Match, StudentRequest, User):
+            db.session.execute(delete(model))
+        db.session.execute(insert(User), [
+            {'id': i, 'name': f'user{i}', 'phone': f'p{i}', 'role': 'student' if i % 2 else 'host',
+             'location': 'Jerusalem'}
+            for i in range(1, ROWS + 1)
+        ])
+        db.session.execute(insert(StudentRequest), [
+            {'id': i, 'student_id': i - 1 + i % 2, 'location': 'Jerusalem', 'num_guests': 2}
+            for i in range(1, ROWS + 1)
+        ])
+        db.session.execute(insert(Match), [
+            {'id': i, 'student_request_id': i, 'host_id': i + i % 2, 'student_id': i - 1 + i % 2}
+            for i in range(1, ROWS + 1)
+        ])
+        db.session.commit()
+
+
+def drive(env, seconds, results):
+    app = make_app(env)
+    client = app.test_client()
+    rng = random.Random(os.getpid())
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        item = rng.randint(1, ROWS)
+        start = time.perf_counter()
+        if rng.random() < READ_SHARE:
+            if rng.random() < 0.5:
+                response = client.get(f'/api/request/{item}')
+            else:
+                response = client.get(f'/api/match/user/{item}')
+        elif rng.random() < 0.5:
+            response = client.put(f'/api/profile/{item}', json={'about_me': f'updated {time.time()}'})
+        else:
+            response = client.put(f'/api/match/{item}/confirm/host')
+        latencies.append(time.perf_counter() - start)
+        if response.status_code >= 500:
+            errors += 1
+    results.put((latencies, errors))
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def main(args):
+    ctx = multiprocessing.get_context('spawn')
+    print(f"{args.processes} processes, {args.seconds}s each, {READ_SHARE:.0%} reads")
+    print(f"{'profile':>24} {'ops/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, env in profiles(args):
+        setup = ctx.Process(target=populate, args=(env,))
+        setup.start()
+        setup.join()
+
+        results = ctx.Queue()
+        workers = [ctx.Process(target=drive, args=(env, args.seconds, results)) for _ in range(args.processes)]
+        for worker in workers:
+            worker.start()
+        collected = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+
+        latencies = [latency for batch, _ in collected for latency in batch]
+        errors = sum(e for _, e in collected)
+        print(f"{name:>24} {len(latencies) / args.seconds:>8.0f} {percentile(latencies, 50) * 1000:>8.2f} "
+              f"{percentile(latencies, 99) * 1000:>8.2f} {errors:>7}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--postgres-url')
+    parser.add_argument('--replica-url')
+    main(parser.parse_args())
@@ -0,0 +1,64 @@
+"""
+Measures what idle event streams cost one web process: memory per open
+subscription, and how long one publish round takes to reach every stream.
+
+Uses Redis pub/sub when EVENTS_REDIS_URL is reachable, otherwise the
+in-process fallback.
+
+Usage (from backend/):
+    python -m benchmarks.bench_events [--connections 10000]
+"""
+import argparse
+import os
+import threading
+import time
+import tracemalloc
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from app import create_app, events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=10000)
+    args = parser.parse_args()
+
+    create_app()
+    n = args.connections
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    subscriptions = [events.subscribe(user_id) for user_id in range(1, n + 1)]
+    per_stream = (tracemalloc.get_traced_memory()[0] - before) / n
+    tracemalloc.stop()
+
+    received = []
+    done = threading.Event()
+
+    def reader(subscription):
+        if subscription.get(timeout=30) is not None:
+            received.append(1)
+            if len(received) == n:
+                done.set()
+
+    #  A pool of reader threads stands in for the greenlets gevent runs per stream
+    readers = [threading.Thread(target=lambda i=i: [reader(s) for s in subscriptions[i::64]]) for i in range(64)]
+    for thread in readers:
+        thread.start()
+
+    start = time.perf_counter()
+    events.publish_many([(user_id, 'match_created', {'student_request_id': user_id}) for user_id in range(1, n + 1)])
+    done.wait(30)
+    elapsed = time.perf_counter() - start
+
+    print(f"backend: {'redis' if events.client else 'in-process'}")
+    print(f"open streams: {events.connections()}, {per_stream:.0f} bytes each")
+    print(f"delivered {len(received)}/{n} events in {elapsed * 1000:.1f} ms")
+
+    for subscription in subscriptions:
+        events.unsubscribe(subscription)
+
+
+if __name__ == '__main__':
+    main()
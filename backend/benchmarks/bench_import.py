@@ -0,0 +1,156 @@
+"""
+Bulk import and export throughput on SQLite.
+
+Writes a users CSV (half hosts, half students, with a share of repeated
+phones, invalid rows and passwords), then a JSONL of availability for the
+hosts and a CSV of requests for the students, imports each the way the
+`flask import-data` command does and times it, along with the peak memory
+the process reached. Then gives every request a match and times
+`flask export-matches` to CSV.
+
+Exits non-zero if an import takes longer than --max-seconds or a row
+count is off.
+
+Usage (from backend/):
+    python -m benchmarks.bench_import [--rows 100000] [--password-share 0.001]
+        [--max-seconds 60] [--output results.json]
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from benchmarks.results import write_results
+
+LOCATIONS = ['Jerusalem', 'Tel Aviv', 'Haifa', 'Beer Sheva', 'Safed']
+
+
+def phone(i):
+    return f"+9725{i:08d}"
+
+
+def write_files(directory, rows, duplicate_share, invalid_share, password_share, seed=0):
+    """
+    Writes the three import files a row at a time and returns their paths.
+    """
+    rng = random.Random(seed)
+    hosts = rows // 2
+    users_path = os.path.join(directory, 'users.csv')
+    with open(users_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'phone', 'role', 'location', 'password'])
+        for i in range(rows):
+            roll = rng.random()
+            if roll < invalid_share:
+                writer.writerow([f'user{i}', 'not a phone', 'host', '', ''])
+                continue
+            if roll < invalid_share + duplicate_share and i:
+                number = rng.randrange(i)  #  Repeats an earlier phone; may repeat an invalid row's slot
+            else:
+                number = i
+            password = 'imported-password' if rng.random() < password_share else ''
+            writer.writerow([f'user{number}', phone(number), 'host' if number < hosts else 'student',
+                             rng.choice(LOCATIONS), password])
+
+    availability_path = os.path.join(directory, 'availability.jsonl')
+    with open(availability_path, 'w', encoding='utf-8') as f:
+        for i in range(hosts):
+            f.write(json.dumps({'phone': phone(i), 'available': rng.random() < 0.75,
+                                'capacity': rng.randint(1, 6), 'week_start': '2026-10-18'}) + '\n')
+
+    requests_path = os.path.join(directory, 'requests.csv')
+    with open(requests_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['phone', 'location', 'num_guests'])
+        for i in range(hosts, rows):
+            writer.writerow([phone(i), rng.choice(LOCATIONS), rng.randint(1, 4)])
+    return users_path, availability_path, requests_path
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(args):
+    directory = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    from sqlalchemy import func, insert, literal, select
+    from app import create_app, db
+    from app.bulk import export_matches, import_records
+    from app.models import User, Match, StudentRequest
+
+    app = create_app('cli')
+    with app.app_context():
+        db.create_all()
+
+    paths = write_files(directory, args.rows, args.duplicates, args.invalid, args.password_share)
+    results = []
+    failed = False
+    print(f"{args.rows} user rows, batches of {app.config['BULK_BATCH_SIZE']}, "
+          f"passwords hashed with {app.config['PASSWORD_HASH_METHOD']}")
+    with app.app_context():
+        for kind, path in zip(('users', 'availability', 'requests'), paths):
+            fmt = 'jsonl' if path.endswith('.jsonl') else 'csv'
+            rss_before = peak_rss_mb()
+            start = time.perf_counter()
+            with open(path, encoding='utf-8', newline='') as lines:
+                report = import_records(kind, lines, fmt)
+            seconds = time.perf_counter() - start
+            report.pop('errors')
+            row = {'name': f"import {kind}", 'seconds': seconds, 'rows_per_s': report['rows'] / seconds,
+                   'peak_rss_growth_mb': peak_rss_mb() - rss_before, **report}
+            results.append(row)
+            print(f"{kind:>13}: {report['rows']} rows in {seconds:.2f}s ({row['rows_per_s']:.0f} rows/s), "
+                  f"{report['inserted']} inserted, {report['updated']} updated, {report['skipped']} skipped, "
+                  f"peak RSS +{row['peak_rss_growth_mb']:.1f} MB")
+            if seconds > args.max_seconds:
+                print(f"FAILED: importing {kind} took longer than {args.max_seconds}s")
+                failed = True
+
+        users = db.session.scalar(select(func.count()).select_from(User))
+        requests = db.session.scalar(select(func.count()).select_from(StudentRequest))
+        if users != results[0]['inserted'] or requests != results[2]['inserted']:
+            print(f"FAILED: {users} users and {requests} requests stored, expected "
+                  f"{results[0]['inserted']} and {results[2]['inserted']}")
+            failed = True
+
+        db.session.execute(insert(Match).from_select(
+            ['student_request_id', 'host_id', 'student_id', 'status'],
+            select(StudentRequest.id, select(func.min(User.id)).where(User.role == 'host').scalar_subquery(),
+                   StudentRequest.student_id, literal('pending')),
+        ))
+        db.session.commit()
+        rss_before = peak_rss_mb()
+        start = time.perf_counter()
+        with open(os.path.join(directory, 'matches.csv'), 'w', encoding='utf-8', newline='') as out:
+            out.writelines(export_matches('csv'))
+        seconds = time.perf_counter() - start
+        with open(os.path.join(directory, 'matches.csv'), encoding='utf-8') as f:
+            exported = sum(1 for _ in f) - 1
+        results.append({'name': 'export matches', 'rows': exported, 'seconds': seconds,
+                        'rows_per_s': exported / seconds, 'peak_rss_growth_mb': peak_rss_mb() - rss_before})
+        print(f"{'matches':>13}: {exported} rows exported in {seconds:.2f}s ({exported / seconds:.0f} rows/s), "
+              f"peak RSS +{results[-1]['peak_rss_growth_mb']:.1f} MB")
+        if exported != requests:
+            print(f"FAILED: exported {exported} matches, expected {requests}")
+            failed = True
+
+    if args.output:
+        write_results(args.output, 'bulk_import', vars(args), results)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='user rows; availability and requests get half each')
+    parser.add_argument('--duplicates', type=float, default=0.05, help='share of user rows repeating a phone')
+    parser.add_argument('--invalid', type=float, default=0.01, help='share of user rows that fail validation')
+    parser.add_argument('--password-share', type=float, default=0.001, help='share of user rows with a password')
+    parser.add_argument('--max-seconds', type=float, default=60, help='fail if an import takes longer')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    sys.exit(main(parser.parse_args()))
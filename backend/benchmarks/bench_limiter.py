@@ -0,0 +1,123 @@
+"""
+Rate limiter overhead per request, for each storage and strategy.
+
+Each mode runs in a fresh process and times sequential requests through
+the test client to a cheap rate-limited route (`/`, anonymous and logged
+in, so keyed per IP and per user) and to the exempt webhook verification
+route, against a run with the limiter disabled. Limits are set high
+enough that no request is refused.
+
+Redis modes run only when --redis-uri points at a reachable server.
+
+Usage (from backend/):
+    python -m benchmarks.bench_limiter [--requests 5000] [--redis-uri redis://localhost:6379/2]
+        [--output results.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.results import write_results
+
+STRATEGIES = ('fixed-window', 'sliding-window-counter', 'moving-window')
+ROUTES = {
+    'anonymous': '/',
+    'logged in': '/',
+    'exempt': '/api/webhook/whatsapp',
+}
+
+
+def time_mode(storage_uri, strategy, count):
+    """
+    Runs in the child process: prints microseconds per request for each
+    route as JSON. An empty storage URI disables the limiter.
+    """
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ['RATELIMIT_STORAGE_URI'] = storage_uri or 'memory://'
+    os.environ['RATELIMIT_STRATEGY'] = strategy
+    os.environ['RATELIMIT_DEFAULT'] = '10000000 per hour'
+    os.environ['PASSWORD_HASH_WORKERS'] = '0'
+    os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+    from app import create_app, db, limiter
+    app = create_app('web')
+    limiter.enabled = bool(storage_uri)
+    with app.app_context():
+        db.create_all()
+
+    timings = {}
+    for name, path in ROUTES.items():
+        client = app.test_client()
+        if name == 'logged in':
+            password = 'benchmark-password'
+            client.post('/api/register', json={'phone': '+972500000001', 'name': 'bench', 'role': 'student',
+                                               'password': password, 'confirmPassword': password})
+            client.post('/api/login', json={'phone': '+972500000001', 'password': password})
+        for _ in range(count // 10):
+            client.get(path)
+        start = time.perf_counter()
+        for _ in range(count):
+            client.get(path)
+        timings[name] = (time.perf_counter() - start) / count * 1e6
+    print(json.dumps(timings))
+
+
+def run_mode(storage_uri, strategy, count):
+    command = [sys.executable, '-m', 'benchmarks.bench_limiter', '--requests', str(count),
+               '--time-mode', storage_uri, strategy]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def redis_reachable(uri):
+    try:
+        import redis
+        redis.Redis.from_url(uri, socket_connect_timeout=0.2).ping()
+        return True
+    except Exception:
+        return False
+
+
+def main(args):
+    if args.time_mode:
+        time_mode(*args.time_mode, args.requests)
+        return
+
+    modes = [('disabled', '', 'fixed-window')]
+    modes += [(f"memory {strategy}", 'memory://', strategy) for strategy in STRATEGIES]
+    if args.redis_uri and redis_reachable(args.redis_uri):
+        modes += [(f"redis {strategy}", args.redis_uri, strategy) for strategy in STRATEGIES]
+    elif args.redis_uri:
+        print(f"Redis at {args.redis_uri} unreachable, skipping Redis modes")
+
+    print(f"{args.requests} sequential requests per route; microseconds per request "
+          f"(+ overhead against the limiter disabled)")
+    print(f"{'mode':>30} " + ' '.join(f"{name:>18}" for name in ROUTES))
+    results = []
+    baseline = None
+    for name, storage_uri, strategy in modes:
+        timings = run_mode(storage_uri, strategy, args.requests)
+        baseline = baseline or timings
+        row = {'name': name}
+        for route, micros in timings.items():
+            key = route.replace(' ', '_')
+            row[f"{key}_us"] = micros
+            row[f"{key}_overhead_us"] = micros - baseline[route]
+        results.append(row)
+        print(f"{name:>30} " + ' '.join(f"{timings[route]:>9.0f} ({timings[route] - baseline[route]:>+5.0f})"
+                                        for route in ROUTES))
+
+    if args.output:
+        write_results(args.output, 'rate_limiter', vars(args), results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--redis-uri', default='redis://localhost:6379/2')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--time-mode', nargs=2, help=argparse.SUPPRESS)
+    main(parser.parse_args())
@@ -0,0 +1,56 @@
+"""
+Times location normalization and nearest-locality lookups with a full
+national set of localities (the bundled seed list padded with synthetic
+points across Israel to CBS scale).
+
+Usage (from backend/):
+    python -m benchmarks.bench_locations [--localities 1300] [--lookups 100000]
+"""
+import argparse
+import random
+import time
+
+from app.locations import SEED_LOCALITIES, LocalityIndex
+
+
+def build_index(count):
+    rng = random.Random(42)
+    localities = [
+        (i, [name, name_he] + aliases, latitude, longitude)
+        for i, (name, name_he, latitude, longitude, aliases) in enumerate(SEED_LOCALITIES, start=1)
+    ]
+    for i in range(len(localities) + 1, count + 1):
+        localities.append((i, [f"Locality {i}"], rng.uniform(29.5, 33.3), rng.uniform(34.3, 35.9)))
+    return LocalityIndex(localities)
+
+
+def main(count, lookups, radius_km):
+    start = time.perf_counter()
+    index = build_index(count)
+    index.nearby(1, radius_km)  #  Builds the KD-tree
+    print(f"index build ({count} localities): {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    names = [f"  {name.upper().replace(' ', '-')} " for name, *_ in SEED_LOCALITIES]
+    start = time.perf_counter()
+    for i in range(lookups):
+        index.key(names[i % len(names)])
+    elapsed = time.perf_counter() - start
+    print(f"key(): {elapsed / lookups * 1e6:.2f} us per lookup")
+
+    keys = list(index.coordinates)
+    start = time.perf_counter()
+    found = 0
+    for i in range(lookups):
+        found += len(index.nearby(keys[i % len(keys)], radius_km))
+    elapsed = time.perf_counter() - start
+    print(f"nearby({radius_km} km): {elapsed / lookups * 1e6:.2f} us per lookup, "
+          f"{found / lookups:.1f} localities on average")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--localities', type=int, default=1300)
+    parser.add_argument('--lookups', type=int, default=100_000)
+    parser.add_argument('--radius', type=float, default=15)
+    args = parser.parse_args()
+    main(args.localities, args.lookups, args.radius)
@@ -0,0 +1,128 @@
+"""
+Logging overhead per request under the HTTP load of benchmarks.load_http.
+
+Runs the load driver once per logging mode, each in a fresh process with
+the app's log output going to a file, and reports each mode's latency
+against a run with logging off. Load latency is dominated by SQLite, so
+each mode also times a sequential loop of cheap requests through the test
+client, which shows the per-request cost with far less noise:
+
+- off: LOG_LEVEL=CRITICAL, so every record is discarded at the logger
+- async: the default queue-backed JSON logger, access log sampled
+- async, unsampled: every access log event written
+- sync, unsampled: JSON written from the request thread (LOG_ASYNC=false)
+
+Usage (from backend/):
+    python -m benchmarks.bench_logging [--users 8] [--duration 15] [--scale 1000] [--requests 5000]
+        [--output results.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.results import write_results
+
+MODES = {
+    'off': {'LOG_LEVEL': 'CRITICAL'},
+    'async': {},
+    'async, unsampled': {'LOG_SAMPLE_RATE': '1'},
+    'sync, unsampled': {'LOG_SAMPLE_RATE': '1', 'LOG_ASYNC': 'false'},
+}
+
+
+def run_load(name, overrides, args, workdir):
+    env = dict(os.environ, **overrides)
+    output = os.path.join(workdir, f"{name.replace(', ', '-')}.json")
+    log_path = os.path.join(workdir, f"{name.replace(', ', '-')}.log")
+    command = [sys.executable, '-m', 'benchmarks.load_http', '--users', str(args.users),
+               '--duration', str(args.duration), '--scale', str(args.scale),
+               '--hash-method', 'pbkdf2:sha256:1000', '--output', output]
+    with open(log_path, 'w') as log_file:
+        subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=log_file, check=True)
+    with open(output) as f:
+        total = next(row for row in json.load(f)['results'] if row['name'] == 'total')
+    with open(log_path) as f:
+        log_lines = sum(1 for line in f if line.startswith('{'))
+    return total, log_lines
+
+
+def time_requests(count):
+    """
+    Runs in the child process: times `count` sequential GETs of a profile
+    through the test client and prints microseconds per request.
+    """
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    from app import create_app, db, limiter
+    from app.models import User
+    app = create_app('web')
+    limiter.enabled = False
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(id=1, name='bench', phone='+972500000000', role='host'))
+        db.session.commit()
+    client = app.test_client()
+    for _ in range(count // 10):
+        client.get('/api/profile/1')
+    start = time.perf_counter()
+    for _ in range(count):
+        client.get('/api/profile/1')
+    print((time.perf_counter() - start) / count * 1e6)
+
+
+def run_sequential(name, overrides, args, workdir):
+    env = dict(os.environ, **overrides)
+    with open(os.path.join(workdir, f"{name.replace(', ', '-')}-sequential.log"), 'w') as log_file:
+        result = subprocess.run([sys.executable, '-m', 'benchmarks.bench_logging', '--time-requests', str(args.requests)],
+                                env=env, stdout=subprocess.PIPE, stderr=log_file, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main(args):
+    if args.time_requests:
+        time_requests(args.time_requests)
+        return
+
+    workdir = tempfile.mkdtemp()
+    print(f"{args.users} users for {args.duration:.0f}s per mode; {args.requests} sequential requests")
+    print(f"{'mode':>18} {'req/s':>8} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8} {'+us/req':>8} "
+          f"{'seq us':>8} {'+seq us':>8} {'lines/req':>9}")
+    results = []
+    baseline = None
+    for name, overrides in MODES.items():
+        total, log_lines = run_load(name, overrides, args, workdir)
+        sequential_us = run_sequential(name, overrides, args, workdir)
+        if baseline is None:
+            baseline = dict(total, sequential_us=sequential_us)
+        row = {
+            'name': name,
+            'requests_per_s': total['requests_per_s'],
+            'mean_ms': total['mean_ms'],
+            'p50_ms': total['p50_ms'],
+            'p99_ms': total['p99_ms'],
+            'overhead_us_per_request': (total['mean_ms'] - baseline['mean_ms']) * 1000,
+            'sequential_us_per_request': sequential_us,
+            'sequential_overhead_us': sequential_us - baseline['sequential_us'],
+            'log_lines_per_request': log_lines / total['count'] if total['count'] else 0.0,
+        }
+        results.append(row)
+        print(f"{name:>18} {row['requests_per_s']:>8.1f} {row['mean_ms']:>8.2f} {row['p50_ms']:>8.2f} "
+              f"{row['p99_ms']:>8.2f} {row['overhead_us_per_request']:>+8.0f} {sequential_us:>8.0f} "
+              f"{row['sequential_overhead_us']:>+8.0f} {row['log_lines_per_request']:>9.2f}")
+
+    if args.output:
+        write_results(args.output, 'logging_overhead', vars(args), results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--scale', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=5000, help='sequential test-client requests per mode')
+    parser.add_argument('--time-requests', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    main(parser.parse_args())
@@ -0,0 +1,116 @@
+"""
+Measures login throughput and latency for a set of password hash methods,
+plus the latency of a cheap endpoint served alongside the login burst, to
+pick a PASSWORD_HASH_METHOD that stays secure and meets the login SLO.
+
+Usage (from backend/):
+    python -m benchmarks.bench_login [--logins 200] [--concurrency 16] [--workers 2]
+        [--methods scrypt:32768:8:1,scrypt:16384:8:1,pbkdf2:sha256:600000]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+_db_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'bench.db')}"
+
+from sqlalchemy import delete, insert
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db, limiter
+from app.models import User
+
+USERS = 100
+PASSWORD = 'correct horse battery staple'
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def populate(method):
+    #  One hash shared by every user: hashing USERS times would dominate the run
+    password_hash = generate_password_hash(PASSWORD, method)
+    db.session.execute(delete(User))
+    db.session.execute(insert(User), [
+        {'id': i, 'name': f'user{i}', 'phone': f'p{i}', 'role': 'student', 'password_hash': password_hash}
+        for i in range(1, USERS + 1)
+    ])
+    db.session.commit()
+
+
+def run(app, logins, concurrency):
+    """
+    Logs in `logins` times from `concurrency` threads while another thread
+    polls a cheap endpoint. Returns (elapsed, login latencies, poll latencies).
+    """
+    login_latencies = []
+    poll_latencies = []
+    done = threading.Event()
+    counter = iter(range(logins))
+    counter_lock = threading.Lock()
+
+    def login_worker():
+        client = app.test_client()
+        while True:
+            with counter_lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            response = client.post('/api/login', json={'phone': f'p{1 + i % USERS}', 'password': PASSWORD})
+            login_latencies.append(time.perf_counter() - start)
+            assert response.status_code in (200, 503), response.status_code
+
+    def poll_worker():
+        client = app.test_client()
+        while not done.is_set():
+            start = time.perf_counter()
+            client.get('/')
+            poll_latencies.append(time.perf_counter() - start)
+            time.sleep(0.005)
+
+    poller = threading.Thread(target=poll_worker)
+    poller.start()
+    threads = [threading.Thread(target=login_worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    poller.join()
+    return elapsed, login_latencies, poll_latencies
+
+
+def main(logins, concurrency, workers, methods):
+    app = create_app()
+    app.config['PASSWORD_HASH_WORKERS'] = workers
+    limiter.enabled = False  #  Measure hashing, not the rate limiter
+    with app.app_context():
+        db.create_all()
+
+    print(f"workers={workers or 'inline'} concurrency={concurrency}")
+    print(f"{'method':>24} {'logins/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'poll p99 ms':>12}")
+    for method in methods:
+        app.config['PASSWORD_HASH_METHOD'] = method
+        with app.app_context():
+            populate(method)
+        run(app, min(logins, 2 * concurrency), concurrency)  #  Warm up the pool
+        elapsed, latencies, polls = run(app, logins, concurrency)
+        print(f"{method:>24} {len(latencies) / elapsed:>9.1f} {percentile(latencies, 50) * 1000:>8.1f} "
+              f"{percentile(latencies, 99) * 1000:>8.1f} {percentile(polls, 99) * 1000:>12.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=2, help='hashing processes; 0 hashes inline')
+    parser.add_argument('--methods', default='scrypt:32768:8:1,scrypt:16384:8:1,pbkdf2:sha256:600000')
+    args = parser.parse_args()
+    main(args.logins, args.concurrency, args.workers, args.methods.split(','))
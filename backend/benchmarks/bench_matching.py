@@ -0,0 +1,59 @@
+"""
+Benchmarks match_students_with_hosts on SQLite as the number of pending
+requests and hosts grows. With --preferences, that share of hosts and
+students state preferences, so hosts are ranked by score rather than
+taken in id order.
+
+Usage (from backend/):
+    python -m benchmarks.bench_matching [--strategy greedy|optimal] [--preferences 0.5]
+        [--output results.json] [sizes...]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+_db_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'bench.db')}"
+
+from app import create_app, db
+from app import matching
+from benchmarks.datagen import populate
+from benchmarks.results import write_results
+
+SIZES = [100, 1_000, 10_000, 100_000]
+
+
+def main(sizes, strategy, preference_share=0.0, output=None):
+    app = create_app('worker')
+    results = []
+
+    with app.app_context():
+        db.create_all()
+        print(f"strategy: {strategy}, preferences: {preference_share:.0%}")
+        print(f"{'rows':>8} {'matched':>8} {'guests':>8} {'solve s':>9} {'total s':>9} {'commits':>8}")
+        for size in sizes:
+            populate(hosts=size, students=size, preference_share=preference_share)
+            stats = {}
+            start = time.perf_counter()
+            matches = matching.match_students_with_hosts(strategy=strategy, stats=stats)
+            elapsed = time.perf_counter() - start
+            print(f"{size:>8} {len(matches):>8} {stats['guests_placed']:>8} "
+                  f"{stats['solve_seconds']:>9.3f} {elapsed:>9.3f} {stats['commits']:>8}")
+            results.append({'name': f'{strategy} x{size}', 'rows': size, 'matched': len(matches),
+                            'guests_placed': stats['guests_placed'], 'solve_seconds': stats['solve_seconds'],
+                            'total_seconds': elapsed, 'commits': stats['commits']})
+
+    if output:
+        write_results(output, 'matching', {'strategy': strategy, 'preferences': preference_share, 'sizes': sizes},
+                      results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--strategy', default='greedy', choices=sorted(matching.STRATEGIES))
+    parser.add_argument('--preferences', type=float, default=0.0, help='share of users with stated preferences')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('sizes', nargs='*', type=int)
+    args = parser.parse_args()
+    main(args.sizes or SIZES, args.strategy, args.preferences, args.output)
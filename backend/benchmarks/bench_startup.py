@@ -0,0 +1,64 @@
+"""
+Measures cold start time of each app profile in a fresh interpreter, and
+checks that the worker and CLI profiles boot without importing the web
+stack (Flask-Admin, CORS, the routes). Exits non-zero if they do, so it can
+run in CI.
+
+Usage (from backend/):
+    python -m benchmarks.bench_startup [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+#  Imported only by the web profile
+WEB_ONLY_MODULES = ('flask_admin', 'flask_cors', 'app.routes')
+
+BOOT = {
+    'web': "from app import create_app; create_app('web')",
+    'worker': "import celery_worker",
+    'cli': "from app import create_app; create_app('cli')",
+}
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+{boot}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'modules': [m for m in {modules!r} if m in sys.modules]}}))
+"""
+
+
+def boot(profile):
+    env = dict(os.environ, DATABASE_URL='sqlite://', PYTHONWARNINGS='ignore')
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(boot=BOOT[profile], modules=WEB_ONLY_MODULES)],
+        env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(runs):
+    failed = False
+    print(f"{'profile':>8} {'median ms':>10} {'min ms':>8}  web modules imported")
+    for profile in BOOT:
+        results = [boot(profile) for _ in range(runs)]
+        seconds = [r['seconds'] for r in results]
+        modules = results[-1]['modules']
+        print(f"{profile:>8} {statistics.median(seconds) * 1000:>10.0f} {min(seconds) * 1000:>8.0f}  "
+              f"{', '.join(modules) or '-'}")
+        if profile != 'web' and modules:
+            failed = True
+    if failed:
+        print("FAIL: a non-web profile imported the web stack")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    sys.exit(main(args.runs))
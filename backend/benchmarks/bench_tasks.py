@@ -0,0 +1,141 @@
+"""
+Micro-benchmarks for the Celery tasks, run through a real in-process
+Celery worker on an in-memory broker, with the stub WhatsApp API standing
+in for the Graph API, so everything runs offline.
+
+For each task, reports the time until the task returns and the time until
+the work it fans out to (chunk tasks, outbox drains) has settled.
+
+Usage (from backend/):
+    python -m benchmarks.bench_tasks [--hosts 5000] [--students 5000] [--concurrency 4]
+        [--rate 1000] [--output results.json]
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.stub_whatsapp import start_stub_server
+
+_db_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'bench.db')}"
+_stub, _stub_url = start_stub_server()
+os.environ['WHATSAPP_API_URL'] = _stub_url
+
+from celery.contrib.testing.worker import start_worker
+from celery.signals import after_task_publish, task_postrun
+from sqlalchemy import func, select, update
+
+import celery_worker
+from app import celery, db
+from app.models import Match, OutboundMessage
+from benchmarks.datagen import populate
+from benchmarks.results import write_results
+
+
+#  Tasks published and finished, to tell when fanned-out work has settled
+_published = 0
+_finished = 0
+
+
+@after_task_publish.connect
+def _count_published(**kwargs):
+    global _published
+    _published += 1
+
+
+@task_postrun.connect
+def _count_finished(**kwargs):
+    global _finished
+    _finished += 1
+
+
+def work_settled():
+    if _finished < _published:
+        return False
+    with celery_worker.get_app_context():
+        return not db.session.scalar(
+            select(func.count()).select_from(OutboundMessage)
+            .where(OutboundMessage.status.in_(('pending', 'sending')))
+        )
+
+
+def wait_until(predicate, timeout=600, interval=0.05):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError("work did not settle in time")
+        time.sleep(interval)
+
+
+def measure(name, task, items, prepare=None):
+    """
+    Runs `task` once and returns its timings. `items` is called afterwards
+    to count what it processed, for the throughput figure.
+    """
+    if prepare is not None:
+        with celery_worker.get_app_context():
+            prepare()
+    sent_before = len(_stub.received)
+    start = time.perf_counter()
+    result = task.delay().get(timeout=600, interval=0.01)
+    returned = time.perf_counter() - start
+    wait_until(work_settled)
+    settled = time.perf_counter() - start
+    count = items(result)
+    row = {
+        'name': name,
+        'task_seconds': returned,
+        'settled_seconds': settled,
+        'items': count,
+        'items_per_s': count / settled if settled else 0.0,
+        'messages_sent': len(_stub.received) - sent_before,
+    }
+    print(f"{name:>28} {returned:>9.3f} {settled:>10.3f} {count:>8} {row['items_per_s']:>9.0f} "
+          f"{row['messages_sent']:>9}")
+    return row
+
+
+def expire_all_matches():
+    db.session.execute(update(Match).where(Match.status == 'pending')
+                       .values(expires_at=datetime.utcnow() - timedelta(minutes=1)))
+    db.session.commit()
+
+
+def main(args):
+    flask_app = celery_worker.flask_app
+    flask_app.config['WHATSAPP_RATE_PER_SECOND'] = args.rate
+    celery.conf.update(broker_url='memory://', result_backend='cache+memory://')
+
+    with flask_app.app_context():
+        db.create_all()
+        populate(args.hosts, args.students, matched_share=0.0)
+
+    results = []
+    print(f"{args.hosts} hosts, {args.students} students, worker concurrency {args.concurrency}")
+    print(f"{'task':>28} {'task s':>9} {'settled s':>10} {'items':>8} {'items/s':>9} {'messages':>9}")
+    with start_worker(celery, pool='threads', concurrency=args.concurrency,
+                      perform_ping_check=False, shutdown_timeout=30):
+        results.append(measure('run_matching', celery_worker.run_matching,
+                               lambda stats: stats['requests_matched']))
+        results.append(measure('send_weekly_availability', celery_worker.send_weekly_availability_requests,
+                               lambda report: args.hosts))
+        results.append(measure('check_expired_confirmations', celery_worker.check_for_expired_confirmations,
+                               lambda expired: expired, prepare=expire_all_matches))
+        results.append(measure('drain_outbox (idle)', celery_worker.drain_outbox,
+                               lambda stats: stats['sent']))
+
+    _stub.shutdown()
+    if args.output:
+        write_results(args.output, 'celery_tasks', vars(args), results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hosts', type=int, default=5000)
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=1000, help='WhatsApp messages per second')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    main(parser.parse_args())
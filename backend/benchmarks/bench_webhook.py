@@ -0,0 +1,162 @@
+"""
+Load test for the WhatsApp webhook: client threads post Graph API style
+availability replies ("Yes <n>", "No", other text) from seeded hosts as
+fast as they can, re-delivering a share of them the way Meta retries.
+
+Reports the acknowledgement latency and rate, then waits for the worker
+to apply everything and reports the end-to-end processing rate: the
+availability written and each reply queued in the outbox. Exits non-zero
+if any message was answered twice or not at all.
+
+The app is served in-process by a threaded WSGI server on a temporary
+SQLite database, with a real Celery worker on an in-memory broker, so it
+runs offline; without Redis the inbox batches in-process.
+
+Usage (from backend/):
+    python -m benchmarks.bench_webhook [--messages 20000] [--clients 16] [--hosts 5000]
+        [--concurrency 4] [--duplicates 0.1] [--output results.json]
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.results import summarize, write_results
+
+REPLIES = ['Yes', 'Yes 2', 'yes 4', 'Yes, 3', 'No', 'no thanks', 'maybe next week']
+
+
+def payload(message_id, phone, text):
+    return {'object': 'whatsapp_business_account', 'entry': [{'changes': [{'field': 'messages', 'value': {
+        'messages': [{'id': message_id, 'from': phone.lstrip('+'), 'type': 'text', 'text': {'body': text}}],
+    }}]}]}
+
+
+def main(args):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    from benchmarks.stub_whatsapp import start_stub_server
+    stub, stub_url = start_stub_server()
+    os.environ['WHATSAPP_API_URL'] = stub_url
+
+    from celery.contrib.testing.worker import start_worker
+    from sqlalchemy import func, select
+    from werkzeug.serving import make_server
+
+    import celery_worker
+    from app import create_app, celery, db, limiter
+    from app.models import OutboundMessage
+    from benchmarks.datagen import host_phone, populate
+
+    app = create_app('web')
+    limiter.enabled = False  #  Measure the webhook, not the rate limiter
+    #  The memory transport polls once a second by default; Redis pushes
+    celery.conf.update(broker_url='memory://', result_backend='cache+memory://',
+                       broker_transport_options={'polling_interval': 0.01})
+    #  Sending replies and matching have their own benchmarks; park those
+    #  tasks on a queue this worker does not consume
+    celery.conf.task_routes = {name: {'queue': 'not-consumed'}
+                               for name in ('celery_worker.drain_outbox', 'celery_worker.match_location')}
+    with app.app_context():
+        db.create_all()
+        populate(args.hosts, 0)
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    rng = random.Random(0)
+    deliveries = []
+    for i in range(args.messages):
+        body = payload(f"wamid.bench{i}", host_phone(rng.randint(1, args.hosts)), rng.choice(REPLIES))
+        body = json.dumps(body).encode()
+        deliveries.append(body)
+        if rng.random() < args.duplicates:
+            deliveries.append(body)
+    rng.shuffle(deliveries)
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    position = iter(range(len(deliveries)))
+
+    def client():
+        #  http.client rather than requests, so the clients leave more CPU to the server
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=30)
+        headers = {'Content-Type': 'application/json'}
+        samples, failed = [], 0
+        for i in position:
+            start = time.perf_counter()
+            try:
+                connection.request('POST', '/api/webhook/whatsapp', body=deliveries[i], headers=headers)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                ok = False
+            samples.append(time.perf_counter() - start)
+            failed += not ok
+        with lock:
+            latencies.extend(samples)
+            errors.append(failed)
+
+    def replies_queued():
+        with celery_worker.get_app_context():
+            return db.session.scalar(select(func.count()).select_from(OutboundMessage)
+                                     .where(OutboundMessage.idempotency_key.like('webhook-reply:%')))
+
+    with start_worker(celery, pool='threads', concurrency=args.concurrency, perform_ping_check=False,
+                      shutdown_timeout=30):
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client) for _ in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        acked = time.perf_counter() - start
+
+        deadline = time.monotonic() + 600
+        while replies_queued() < args.messages and time.monotonic() < deadline:
+            time.sleep(0.1)
+        processed = time.perf_counter() - start
+        time.sleep(1)  #  Let any late duplicate surface before counting
+        replies = replies_queued()
+
+    server.shutdown()
+    stub.shutdown()
+
+    ack = summarize(latencies)
+    results = [
+        {'name': 'acknowledge', 'posts': len(deliveries), 'posts_per_s': len(deliveries) / acked,
+         'errors': sum(errors), **ack},
+        {'name': 'processed', 'messages': args.messages, 'replies': replies,
+         'messages_per_s': args.messages / processed, 'seconds': processed},
+    ]
+    print(f"{len(deliveries)} posts ({len(deliveries) - args.messages} re-deliveries) from {args.clients} clients")
+    print(f"acknowledged in {acked:.2f}s: {results[0]['posts_per_s']:.0f} posts/s, p50 {ack['p50_ms']:.2f}ms, "
+          f"p99 {ack['p99_ms']:.2f}ms, max {ack['max_ms']:.2f}ms, {sum(errors)} errors")
+    print(f"processed in {processed:.2f}s: {results[1]['messages_per_s']:.0f} messages/s, {replies} replies queued")
+
+    if args.output:
+        write_results(args.output, 'webhook', vars(args), results)
+    if replies != args.messages or sum(errors):
+        print(f"FAILED: expected {args.messages} replies and no errors")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--hosts', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=4, help='worker threads')
+    parser.add_argument('--duplicates', type=float, default=0.1, help='share of messages delivered twice')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    sys.exit(main(parser.parse_args()))
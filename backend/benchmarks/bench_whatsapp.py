@@ -0,0 +1,50 @@
+"""
+Compares sending a weekly fan-out one message at a time with a fresh
+connection each (the old behaviour) against the outbox's pooled,
+concurrent sender, using the local stub WhatsApp API.
+
+Usage (from backend/):
+    python -m benchmarks.bench_whatsapp [--messages 500] [--latency 0.05]
+"""
+import argparse
+import os
+import time
+from types import SimpleNamespace
+
+import requests
+
+from benchmarks.stub_whatsapp import start_stub_server
+
+
+def main(count, latency):
+    server, url = start_stub_server(latency=latency)
+    os.environ['WHATSAPP_API_URL'] = url
+    from app import whatsapp
+    from app.outbox import TokenBucket, send_batch
+
+    messages = [(f"+97250{i:07d}", whatsapp.generate_availability_request_message()) for i in range(count)]
+
+    start = time.perf_counter()
+    for phone, message in messages:
+        requests.post(url, json={"to": phone, "text": {"body": message}})
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    #  A bucket that never runs dry, so only the sender is measured
+    results = send_batch([SimpleNamespace(phone=phone, body=body) for phone, body in messages], TokenBucket(count))
+    pooled = time.perf_counter() - start
+
+    sent = sum(error is None for _, error in results)
+    print(f"messages: {count}, stub latency: {latency * 1000:.0f} ms")
+    print(f"sequential: {sequential:8.3f} s  ({count / sequential:8.1f} msg/s)")
+    print(f"pooled:     {pooled:8.3f} s  ({count / pooled:8.1f} msg/s, {sent} sent, "
+          f"concurrency {whatsapp.MAX_CONCURRENCY})")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+    main(args.messages, args.latency)
@@ -0,0 +1,118 @@
+"""
+Behaviour checks for regressions the benchmarks would not notice, each
+run against a fresh SQLite database. Exits non-zero if any check fails,
+so it can run in CI next to query_plans.
+
+Usage (from backend/):
+    python -m benchmarks.checks
+"""
+import os
+import sys
+import tempfile
+
+_db_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'checks.db')}"
+os.environ.setdefault('RATELIMIT_STORAGE_URI', 'memory://')
+
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, select
+from werkzeug.http import http_date
+
+from app import create_app, db
+from app.matching import match_students_with_hosts
+from app.models import User, HostAvailability, StudentRequest, Match, current_week_start
+
+
+def reset():
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+
+
+def repeated_runs_respect_capacity():
+    """
+    Matching one location again and again with the capacity-aware strategy
+    never places more guests on a host than they advertised for the week.
+    """
+    failures = []
+    for runs in (1, 4):
+        reset()
+        host = User(name='Host', phone='+972500000000', role='host', location='Haifa')
+        db.session.add(host)
+        db.session.flush()
+        db.session.add(HostAvailability(host_id=host.id, week_start=current_week_start(), available=True,
+                                        capacity=2))
+        for i in range(4):
+            student = User(name=f'Student {i}', phone=f'+97250000010{i}', role='student')
+            db.session.add(student)
+            db.session.flush()
+            db.session.add(StudentRequest(student_id=student.id, location='Haifa', num_guests=2))
+        db.session.commit()
+
+        for _ in range(runs):
+            match_students_with_hosts('optimal', location='Haifa')
+        placed = db.session.scalar(
+            select(func.coalesce(func.sum(StudentRequest.num_guests), 0))
+            .select_from(Match)
+            .join(StudentRequest, StudentRequest.id == Match.student_request_id)
+            .where(Match.host_id == host.id, Match.status != 'expired')
+        )
+        if placed > 2:
+            failures.append(f"{runs} runs placed {placed} guests on a host with capacity 2")
+    return failures
+
+
+def status_change_revalidates():
+    """
+    A match page fetched before the match was confirmed is not reported
+    unchanged afterwards, whichever validator the client revalidates with.
+    """
+    reset()
+    host = User(name='Host', phone='+972500000000', role='host', location='Haifa')
+    student = User(name='Student', phone='+972500000001', role='student')
+    db.session.add_all([host, student])
+    db.session.flush()
+    request = StudentRequest(student_id=student.id, location='Haifa', num_guests=1, status='matched')
+    db.session.add(request)
+    db.session.flush()
+    match = Match(student_request_id=request.id, host_id=host.id, student_id=student.id,
+                  expires_at=datetime.utcnow() + timedelta(days=1))
+    db.session.add(match)
+    db.session.commit()
+    host_id, match_id = host.id, match.id
+
+    client = current_app.test_client()
+    page = client.get(f'/api/match/user/{host_id}')
+    client.put(f'/api/match/{match_id}/confirm/host')
+    client.put(f'/api/match/{match_id}/confirm/student')
+
+    failures = []
+    validators = {
+        'If-None-Match': page.headers.get('ETag'),
+        'If-Modified-Since': page.headers.get('Last-Modified') or http_date(datetime.utcnow() + timedelta(days=1)),
+    }
+    for header, value in validators.items():
+        response = client.get(f'/api/match/user/{host_id}', headers={header: value})
+        if response.status_code != 200 or response.get_json()[0]['status'] != 'confirmed':
+            failures.append(f"{header}: {response.status_code} after the match was confirmed")
+    return failures
+
+
+CHECKS = [repeated_runs_respect_capacity, status_change_revalidates]
+
+
+def main():
+    app = create_app('web')
+    failed = False
+    with app.app_context():
+        for check in CHECKS:
+            failures = check()
+            print(f"{'FAIL' if failures else 'ok  '} {check.__name__}{': ' if failures else ''}{'; '.join(failures)}")
+            failed = failed or bool(failures)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
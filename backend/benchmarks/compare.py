@@ -0,0 +1,58 @@
+"""
+Compares two benchmark result files written with --output, printing each
+numeric metric side by side with its relative change.
+
+Usage (from backend/):
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 10]
+
+Exits non-zero if a latency (``*_ms``, ``*seconds``) grew or a throughput
+(``*_per_s``) shrank by more than the threshold percentage.
+"""
+import argparse
+import json
+import sys
+
+
+def regressed(metric, change, threshold):
+    if metric.endswith('_ms') or metric.endswith('seconds'):
+        return change > threshold
+    if metric.endswith('_per_s'):
+        return change < -threshold
+    return False
+
+
+def main(baseline_path, candidate_path, threshold):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+    if baseline['benchmark'] != candidate['benchmark']:
+        print(f"Different benchmarks: {baseline['benchmark']} vs {candidate['benchmark']}")
+        return 2
+
+    print(f"{baseline['benchmark']}: {baseline['git_commit']} -> {candidate['git_commit']}")
+    before = {row['name']: row for row in baseline['results']}
+    failed = False
+    for row in candidate['results']:
+        old = before.get(row['name'])
+        if old is None:
+            continue
+        for metric, value in row.items():
+            previous = old.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(previous, (int, float)) or isinstance(value, bool):
+                continue
+            change = (value - previous) / previous * 100 if previous else 0.0
+            flag = regressed(metric, change, threshold)
+            failed = failed or flag
+            print(f"{'REGRESSED' if flag else '':>9} {row['name']:>28} {metric:>16} "
+                  f"{previous:>12.3f} {value:>12.3f} {change:>+8.1f}%")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed change, in percent')
+    args = parser.parse_args()
+    sys.exit(main(args.baseline, args.candidate, args.threshold))
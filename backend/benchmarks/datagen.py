@@ -0,0 +1,168 @@
+"""
+Synthetic data for benchmarks: hosts with weekly availability, students
+with requests, and matches for a share of those requests, at any scale.
+
+Usage (from backend/), against a scratch database that will be emptied:
+    python -m benchmarks.datagen --database-url sqlite:////tmp/bench.db
+        [--hosts 10000] [--students 10000] [--requests-per-student 1] [--matched 0.3] [--history-weeks 0]
+        [--preferences 0.5]
+"""
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert
+
+LOCATIONS = ['Jerusalem', 'Tel Aviv', 'Haifa', 'Beer Sheva', 'Safed',
+             'Eilat', 'Netanya', 'Ashdod', 'Tiberias', 'Modiin']
+KASHRUT = ['none', 'kosher-style', 'kosher', 'mehadrin']
+LANGUAGES = ['he', 'en', 'ru', 'fr', 'es', 'ar', 'am']
+CHUNK_SIZE = 5000
+
+
+def host_phone(host_id):
+    return f"+97250{host_id:07d}"
+
+
+def student_phone(student_id):
+    return f"+97252{student_id:07d}"
+
+
+def random_preferences(rng, role):
+    """
+    Returns a JSON preferences object like a host or student would fill in.
+    """
+    preferences = {
+        'kashrut': rng.choice(KASHRUT),
+        'shabbat': rng.random() < 0.3,
+        'languages': rng.sample(LANGUAGES, rng.randint(1, 3)),
+    }
+    if role == 'host':
+        preferences.update(smoking=rng.random() < 0.15, pets=rng.random() < 0.3, family_size=rng.randint(1, 8))
+    else:
+        preferences.update(smoke_free=rng.random() < 0.5, pet_allergy=rng.random() < 0.1,
+                           family=rng.random() < 0.4)
+    return json.dumps(preferences)
+
+
+def _insert(model, rows):
+    from app import db
+    for offset in range(0, len(rows), CHUNK_SIZE):
+        db.session.execute(insert(model), rows[offset:offset + CHUNK_SIZE])
+
+
+def populate(hosts, students, requests_per_student=1, available_share=0.75, matched_share=0.0,
+             seed=0, password_hash=None, history_weeks=0, preference_share=0.0):
+    """
+    Empties the matching tables and fills them with `hosts` hosts (ids
+    1..hosts, with availability for the current week and each of the
+    `history_weeks` weeks before it) and `students` students (the ids
+    after), each with `requests_per_student` requests. `preference_share`
+    of the users get random preferences and their feature vectors. `matched_share` of
+    the requests get a pending match with a host in their location.
+    Must run in an app context; commits.
+
+    Returns the number of rows written per table.
+    """
+    from app import db
+    from app.models import User, HostAvailability, HostAvailabilityArchive, StudentRequest, Match, OutboundMessage
+    from app.models import TaskCheckpoint, current_week_start
+    from app.preferences import encode_features
+
+    rng = random.Random(seed)
+    for model in (OutboundMessage, TaskCheckpoint, Match, StudentRequest, HostAvailability, HostAvailabilityArchive,
+                  User):
+        db.session.execute(delete(model))
+
+    users = [
+        {'id': i, 'name': f'host{i}', 'phone': host_phone(i), 'role': 'host',
+         'location': LOCATIONS[i % len(LOCATIONS)], 'password_hash': password_hash}
+        for i in range(1, hosts + 1)
+    ]
+    users += [
+        {'id': hosts + i, 'name': f'student{i}', 'phone': student_phone(i), 'role': 'student',
+         'location': rng.choice(LOCATIONS), 'password_hash': password_hash}
+        for i in range(1, students + 1)
+    ]
+    #  A separate generator, so the rest of the data is the same at any share
+    preference_rng = random.Random(seed)
+    for user in users:
+        user['preferences'] = (random_preferences(preference_rng, user['role'])
+                               if preference_rng.random() < preference_share else None)
+        user['features'] = encode_features(user['role'], user['preferences'])
+    _insert(User, users)
+
+    for weeks_ago in range(history_weeks + 1):
+        week_start = current_week_start() - timedelta(weeks=weeks_ago)
+        _insert(HostAvailability, [
+            {'host_id': i, 'available': rng.random() < available_share, 'capacity': rng.randint(1, 6),
+             'week_start': week_start}
+            for i in range(1, hosts + 1)
+        ])
+
+    now = datetime.utcnow()
+    total = students * requests_per_student
+    requests = []
+    for i in range(total):
+        requests.append({
+            'id': i + 1,
+            'student_id': hosts + 1 + i % students,
+            'location': LOCATIONS[(i * 7) % len(LOCATIONS)],
+            'num_guests': rng.randint(1, 4),
+            'created_at': now - timedelta(seconds=total - i),  #  Oldest first, like real arrivals
+            'status': 'pending',
+        })
+
+    matches = []
+    if hosts:
+        hosts_by_location = {}
+        for i in range(1, hosts + 1):
+            hosts_by_location.setdefault(LOCATIONS[i % len(LOCATIONS)], []).append(i)
+        for request in requests:
+            candidates = hosts_by_location.get(request['location'])
+            if candidates and rng.random() < matched_share:
+                request['status'] = 'matched'
+                matches.append({
+                    'id': len(matches) + 1,
+                    'student_request_id': request['id'],
+                    'host_id': rng.choice(candidates),
+                    'student_id': request['student_id'],
+                    'status': 'pending',
+                    'created_at': now,
+                    'expires_at': now + timedelta(hours=24),
+                })
+    _insert(StudentRequest, requests)
+    _insert(Match, matches)
+    db.session.commit()
+
+    return {'user': len(users), 'host_availability': hosts * (history_weeks + 1), 'student_request': len(requests),
+            'match': len(matches)}
+
+
+def main(args):
+    os.environ['DATABASE_URL'] = args.database_url
+    from app import create_app, db
+    app = create_app('cli')
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        counts = populate(args.hosts, args.students, args.requests_per_student,
+                          matched_share=args.matched, seed=args.seed, history_weeks=args.history_weeks,
+                          preference_share=args.preferences)
+        print(f"{counts} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--hosts', type=int, default=10_000)
+    parser.add_argument('--students', type=int, default=10_000)
+    parser.add_argument('--requests-per-student', type=int, default=1)
+    parser.add_argument('--matched', type=float, default=0.0, help='share of requests given a pending match')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--history-weeks', type=int, default=0, help='past weeks of availability per host')
+    parser.add_argument('--preferences', type=float, default=0.0, help='share of users with stated preferences')
+    main(parser.parse_args())
@@ -0,0 +1,173 @@
+"""
+HTTP load driver for the user-facing flows: each virtual user registers,
+logs in, then loops over viewing and updating their profile, creating and
+listing requests, and confirming matches. Reports throughput and latency
+percentiles per endpoint.
+
+By default the app is served in-process by a threaded WSGI server on a
+temporary SQLite database seeded with benchmarks.datagen, with Celery on an
+in-memory broker and the stub WhatsApp API, so it runs offline. Point
+--base-url at a running server (seeded with datagen at the same --scale and --matched 1)
+to load-test a real deployment.
+
+Usage (from backend/):
+    python -m benchmarks.load_http [--users 20] [--duration 30] [--scale 1000]
+        [--hash-method pbkdf2:sha256:1000] [--base-url http://host:5000] [--output results.json]
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+from benchmarks.results import summarize, write_results
+
+#  Relative weights of the steps a logged-in user repeats
+STEPS = {
+    'get profile': 4,
+    'update profile': 1,
+    'create request': 1,
+    'list requests': 3,
+    'list matches': 2,
+    'confirm match': 1,
+}
+
+
+def serve_in_process(scale, hash_method):
+    """
+    Starts the app on a local threaded server and returns its base URL.
+    """
+    from benchmarks.stub_whatsapp import start_stub_server
+    _, stub_url = start_stub_server()
+    os.environ['WHATSAPP_API_URL'] = stub_url
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    if hash_method:
+        os.environ['PASSWORD_HASH_METHOD'] = hash_method
+
+    from werkzeug.serving import make_server
+    from app import create_app, celery, db, limiter
+    from benchmarks.datagen import populate
+
+    app = create_app('web')
+    limiter.enabled = False  #  Measure the app, not the rate limiter
+    celery.conf.update(broker_url='memory://', result_backend='cache+memory://')
+    with app.app_context():
+        db.create_all()
+        populate(scale, scale, matched_share=1.0)
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)  #  No per-request access log
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+class VirtualUser:
+    def __init__(self, base_url, number, scale, record):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.phone = f"+97254{number:07d}"
+        self.scale = scale
+        self.record = record
+        self.user_id = None
+        self.rng = random.Random(number)
+
+    def call(self, name, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=30, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        self.record(name, time.perf_counter() - start, ok)
+        return response if ok else None
+
+    def sign_up(self):
+        password = 'benchmark-password'
+        self.call('register', 'POST', '/api/register', json={
+            'phone': self.phone, 'name': f'load {self.phone}', 'role': 'student',
+            'password': password, 'confirmPassword': password,
+        })
+        response = self.call('login', 'POST', '/api/login', json={'phone': self.phone, 'password': password})
+        if response is not None:
+            self.user_id = response.json()['user']['id']
+
+    def step(self):
+        name = self.rng.choices(list(STEPS), weights=list(STEPS.values()))[0]
+        if name == 'get profile':
+            self.call(name, 'GET', f'/api/profile/{self.user_id}')
+        elif name == 'update profile':
+            self.call(name, 'PUT', f'/api/profile/{self.user_id}', json={'about_me': f'updated {time.time()}'})
+        elif name == 'create request':
+            self.call(name, 'POST', '/api/request', json={
+                'student_id': self.user_id, 'location': 'Jerusalem', 'num_guests': self.rng.randint(1, 4),
+            })
+        elif name == 'list requests':
+            self.call(name, 'GET', f'/api/request/student/{self.user_id}?limit=20')
+        elif name == 'list matches':
+            self.call(name, 'GET', f'/api/match/user/{self.rng.randint(1, self.scale)}?limit=20')
+        else:
+            #  datagen gives every seeded request a match; confirming one twice is harmless
+            self.call(name, 'PUT', f'/api/match/{self.rng.randint(1, self.scale)}/confirm/host')
+
+    def run(self, deadline):
+        self.sign_up()
+        if self.user_id is None:
+            return
+        while time.monotonic() < deadline:
+            self.step()
+
+
+def main(args):
+    base_url = args.base_url or serve_in_process(args.scale, args.hash_method)
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+
+    def record(name, seconds, ok):
+        with lock:
+            latencies[name].append(seconds)
+            if not ok:
+                errors[name] += 1
+
+    start = time.monotonic()
+    deadline = start + args.duration
+    users = [VirtualUser(base_url, i, args.scale, record) for i in range(args.users)]
+    threads = [threading.Thread(target=user.run, args=(deadline,)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    results = []
+    print(f"{args.users} users for {elapsed:.1f}s against {base_url}")
+    print(f"{'endpoint':>16} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name in ['register', 'login'] + list(STEPS) + ['total']:
+        samples = latencies[name] if name != 'total' else [s for v in latencies.values() for s in v]
+        failed = errors[name] if name != 'total' else sum(errors.values())
+        if not samples:
+            continue
+        row = {'name': name, 'requests_per_s': len(samples) / elapsed, 'errors': failed, **summarize(samples)}
+        results.append(row)
+        print(f"{name:>16} {row['count']:>7} {row['requests_per_s']:>8.1f} {row['p50_ms']:>8.2f} "
+              f"{row['p90_ms']:>8.2f} {row['p99_ms']:>8.2f} {failed:>7}")
+
+    if args.output:
+        write_results(args.output, 'http_load', vars(args), results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--scale', type=int, default=1000, help='seeded hosts and students')
+    parser.add_argument('--hash-method', help='PASSWORD_HASH_METHOD for the in-process server')
+    parser.add_argument('--base-url', help='load-test this server instead of an in-process one')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    main(parser.parse_args())
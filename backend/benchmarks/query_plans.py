@@ -0,0 +1,109 @@
+"""
+Checks that every hot query is answered from an index rather than a full
+table scan, and that keyset pages are read in index order rather than
+sorted, using SQLite's EXPLAIN QUERY PLAN. Exits non-zero if any query
+regresses, so it can run in CI.
+
+Usage (from backend/):
+    python -m benchmarks.query_plans
+"""
+import os
+import sys
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app import create_app, db
+from app.availability import archive_availability
+from app.expiry import mark_expired_matches
+from app.fanout import host_id_pages
+from app.matching import load_excluded_hosts, load_pending_requests, load_available_hosts
+from app.models import User, HostAvailability, StudentRequest, Match, OutboundMessage, current_week_start
+
+#  Keyset pages that must come straight off an index: sorting would read
+#  every matching row for each page
+ORDERED_QUERIES = {'host id keyset page', 'requests by student page', 'matches for host page',
+                   'matches for student page'}
+
+
+def hot_queries():
+    """
+    Returns (name, statement) for each query on a hot path.
+    """
+    captured = {}
+
+    def capture(name, fn):
+        statements = []
+        listener = lambda conn, cursor, statement, parameters, context, executemany: statements.append(
+            (statement, parameters))
+        db.event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            fn()
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', listener)
+        captured[name] = statements[-1]
+
+    capture('pending requests', load_pending_requests)
+    capture('pending requests in location', lambda: load_pending_requests(['Haifa']))
+    capture('hosts excluded from requests', lambda: load_excluded_hosts([1, 2]))
+    capture('pending request locations', lambda: db.session.scalars(
+        select(StudentRequest.location).where(StudentRequest.status == 'pending').distinct()).all())
+    capture('host locations', lambda: db.session.scalars(
+        select(User.location).where(User.role == 'host').distinct()).all())
+    capture('available hosts in locations', lambda: load_available_hosts({'Haifa', 'Safed'}))
+    capture('host id keyset page', lambda: next(host_id_pages(1000), None))
+    capture('requests by student page', lambda: StudentRequest.query.filter(
+        StudentRequest.student_id == 1, StudentRequest.id > 0).order_by(StudentRequest.id).limit(51).all())
+    capture('matches for student page', lambda: Match.query.filter(
+        Match.student_id == 1, Match.id > 0).order_by(Match.id).limit(51).all())
+    capture('availability for hosts this week', lambda: db.session.execute(
+        select(HostAvailability.id, HostAvailability.available, HostAvailability.capacity).where(
+            HostAvailability.host_id.in_([1, 2]), HostAvailability.week_start == current_week_start())).all())
+    capture('previous capacity for hosts', lambda: db.session.execute(
+        select(HostAvailability.host_id, HostAvailability.capacity).where(
+            HostAvailability.host_id.in_([1, 2]), HostAvailability.week_start < current_week_start())
+        .order_by(HostAvailability.week_start)).all())
+    capture('availability to archive', lambda: archive_availability(current_week_start() - timedelta(weeks=4)))
+    capture('user by phone', lambda: User.query.filter_by(phone='+972500000000').first())
+    capture('matches for host page', lambda: Match.query.filter(
+        Match.host_id == 1, Match.id > 0).order_by(Match.id).limit(51).all())
+    capture('expired matches', lambda: mark_expired_matches(datetime.utcnow()))
+    capture('due outbox messages', lambda: db.session.execute(
+        select(OutboundMessage.id).where(
+            OutboundMessage.status == 'pending',
+            OutboundMessage.next_attempt_at <= datetime.utcnow(),
+        ).order_by(OutboundMessage.next_attempt_at, OutboundMessage.id).limit(500)
+    ).all())
+    return captured
+
+
+def regressions(statement, parameters, ordered=False):
+    """
+    Returns the plan lines that read a whole table without an index, or
+    with `ordered`, that sort the rows, followed by every plan line.
+    """
+    plan = db.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+    details = [row[-1] for row in plan]
+    bad = [d for d in details if d.startswith('SCAN') and 'INDEX' not in d]
+    if ordered:
+        bad += [d for d in details if d.startswith('USE TEMP B-TREE FOR ORDER BY')]
+    return bad, details
+
+
+def main():
+    app = create_app()
+    failed = False
+    with app.app_context():
+        db.create_all()
+        for name, (statement, parameters) in hot_queries().items():
+            bad, details = regressions(statement, parameters, ordered=name in ORDERED_QUERIES)
+            print(f"{'FAIL' if bad else 'ok  '} {name}: {'; '.join(details)}")
+            failed = failed or bool(bad)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Helpers for recording benchmark results as JSON, so runs can be compared
+with `python -m benchmarks.compare`.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def summarize(latencies):
+    """
+    Returns latency statistics in milliseconds for a list of durations in seconds.
+    """
+    if not latencies:
+        return {'count': 0}
+    return {
+        'count': len(latencies),
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies) * 1000,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, benchmark, params, results):
+    """
+    Writes one run to `path` as JSON: the benchmark name, its parameters,
+    and `results`, a list of dicts each identified by its 'name'.
+    """
+    run = {
+        'benchmark': benchmark,
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'params': params,
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(run, f, indent=2, default=str)
+        f.write('\n')
+    print(f"Results written to {path}")
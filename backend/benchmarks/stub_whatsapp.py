@@ -0,0 +1,63 @@
+"""
+A local stand-in for the WhatsApp Graph API messages endpoint, so
+outbound messaging can be exercised offline.
+
+Usage (from backend/):
+    python -m benchmarks.stub_whatsapp [--port 8099] [--latency 0.05]
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubWhatsAppHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  #  Keep-alive, like the real API
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        self.server.received.append(payload)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        body = json.dumps({
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": payload.get("to"), "wa_id": payload.get("to")}],
+            "messages": [{"id": f"wamid.stub{len(self.server.received)}"}]
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(port=0, latency=0.0):
+    """
+    Starts the stub server on a background thread. Returns the server and
+    the messages URL to point WHATSAPP_API_URL at.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubWhatsAppHandler)
+    server.daemon_threads = True
+    server.received = []
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/v17.0/STUB/messages"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+    server, url = start_stub_server(args.port, args.latency)
+    print(f"Stub WhatsApp API listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
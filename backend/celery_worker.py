@@ -1,74 +1,194 @@
-from celery import Celery
 from app.matching import match_students_with_hosts
-from app.whatsapp import send_whatsapp_message, generate_availability_request_message
-from app.models import User, Match
+from app.fanout import get_checkpoint, set_checkpoint, host_id_pages, queue_availability_requests
+from app.outbox import DrainGuard, claim_lease_seconds, drain_outbox as drain_outbox_messages, seconds_until_next_due
+from app.expiry import expire_matches
+from app.availability import HostPhoneIndex, process_replies, archive_availability as archive_availability_rows
+from app.models import current_week_start
 from datetime import datetime, timedelta
-from app import create_app  # Import create_app to have app context
+from celery import chord
+from app import create_app, celery, inbox  # Import create_app to have app context
+import logging
 
-celery = Celery('tasks', broker='redis://localhost:6379/0')
+#  Under the app logger, so it shares its JSON handler
+log = logging.getLogger('app.worker')
 
-#  Get the Flask app instance by calling the factory function
-flask_app = create_app()
+#  Get the Flask app instance by calling the factory function.
+#  This also configures the shared Celery app from the Flask config.
+#  The worker profile skips the routes, limiter and admin views.
+flask_app = create_app('worker')
 
-#  Configure Celery to use the Flask app's context
-celery.conf.update(
-    broker_url=flask_app.config['CELERY_BROKER_URL'],
-    result_backend=flask_app.config['CELERY_RESULT_BACKEND'],
-)
+#  Phone -> host lookups for webhook replies, shared by the tasks in this process
+host_phone_index = HostPhoneIndex(ttl=flask_app.config['HOST_PHONE_CACHE_SECONDS'])
+
+#  One outbox drain at a time across the workers, and one pending reschedule
+drain_guard = DrainGuard.connect(flask_app.config['OUTBOX_REDIS_URL'])
 
 def get_app_context():
     """
-    Pushes an application context manually.
+    Returns an application context for a task to enter with `with`.
     Necessary for Celery tasks to access Flask resources.
     """
-    ctx = flask_app.app_context()
-    ctx.push()
-    return ctx
+    #  Not pushed here: `with` pushes it, and a second push would never be
+    #  popped, leaving the worker thread's session (and its transaction) open
+    return flask_app.app_context()
 
 @celery.task
 def send_weekly_availability_requests():
     """
-    Sends weekly availability requests to all hosts.
+    Fans the weekly availability request out to all hosts.
+
+    Host ids are paged with keyset pagination and each page is handed to a
+    queue_availability_chunk task, so chunks run in parallel across workers.
+    The chunks form a chord whose callback is a single drain_outbox, so the
+    messages are sent by one drain once every chunk has queued its share.
+    The last dispatched id is checkpointed, so a restarted run resumes where
+    it stopped; the outbox idempotency keys make re-run chunks harmless.
     """
+    week = datetime.utcnow().strftime('%G-W%V')
+    checkpoint = f"weekly-availability:{week}"
     with get_app_context():
-        hosts = User.query.filter_by(role='host').all()
-        for host in hosts:
-            message = generate_availability_request_message()
-            send_whatsapp_message(host.phone, message)
+        resumed_from = get_checkpoint(checkpoint)
+        pages = list(host_id_pages(flask_app.config['FANOUT_CHUNK_SIZE'], resumed_from))
+    if pages:
+        chord(queue_availability_chunk.si(week, first_id, last_id) for first_id, last_id in pages)(drain_outbox.si())
+        with get_app_context():
+            set_checkpoint(checkpoint, pages[-1][1])
+    return {'week': week, 'resumed_from': resumed_from, 'chunks': len(pages)}
+
+@celery.task(acks_late=True)
+def queue_availability_chunk(week, first_id, last_id):
+    """
+    Queues the weekly availability request for one chunk of hosts and
+    reports how long the chunk took. The messages are sent by the drain
+    the fan-out schedules after its last chunk.
+    """
+    with get_app_context():
+        report = queue_availability_requests(week, first_id, last_id)
+    log.info("Availability chunk %s-%s: %s queued in %.3fs", first_id, last_id, report['queued'], report['seconds'],
+             extra={'queued': report['queued'], 'seconds': report['seconds']})
+    return report
 
 @celery.task
 def check_for_expired_confirmations():
     """
-    Checks for matches that have not been confirmed within 24 hours
-    and takes appropriate action (e.g., cancel the match, notify admins).
+    Expires matches that have not been confirmed in time, re-queues their
+    student requests for matching and notifies the host and student.
+    """
+    with get_app_context():
+        expired, locations = expire_matches()
+    for location in locations:
+        match_location.delay(location)
+    if expired:
+        drain_outbox.delay()
+    return expired
+
+@celery.task
+def archive_availability():
+    """
+    Moves availability older than AVAILABILITY_HOT_WEEKS weeks to the
+    archive table. Run weekly, after the new week starts.
     """
+    before = current_week_start() - timedelta(weeks=flask_app.config['AVAILABILITY_HOT_WEEKS'])
     with get_app_context():
-        #  Calculate the time 24 hours ago
-        cutoff_time = datetime.utcnow() - timedelta(hours=24)
-
-        #  Find matches created before the cutoff time that are not confirmed
-        expired_matches = Match.query.filter(
-            Match.created_at < cutoff_time,
-            (Match.host_confirmed == False) | (Match.student_confirmed == False)
-        ).all()
-
-        for match in expired_matches:
-            #  Logic to handle expired matches:
-            #  -  Potentially set the match status to "expired" or "cancelled"
-            #  -  Potentially notify the student and host that the match has expired
-            #  -  Potentially re-queue the student request for matching
-            #  For this example, I'll just print a message:
-            print(f"Match {match.id} has expired.")
-            #  Example of updating match status (if you have a status field):
-            #  match.status = 'expired'
-            #  db.session.commit()
+        moved = archive_availability_rows(before, flask_app.config['AVAILABILITY_ARCHIVE_CHUNK_SIZE'])
+    log.info("Archived %d availability rows from before %s", moved, before)
+    return {'before': before.isoformat(), 'archived': moved}
+
+def _run_matching(location=None):
+    with get_app_context():
+        stats = {}
+        matches = match_students_with_hosts(
+            strategy=flask_app.config['MATCHING_STRATEGY'],
+            stats=stats,
+            chunk_size=flask_app.config['MATCHING_COMMIT_CHUNK_SIZE'],
+            location=location,
+            radius_km=flask_app.config['MATCHING_RADIUS_KM']
+        )
+    if matches:
+        #  save_matches queued the host and student notifications with the matches
+        drain_outbox.delay()
+    return stats
 
 @celery.task
 def run_matching():
     """
-    Runs the matching algorithm.
+    Runs the matching algorithm over every pending request.
+
+    New requests and newly available hosts are matched as they happen by
+    match_location, so this periodic run is a reconciliation pass that
+    picks up whatever the incremental path missed.
+    """
+    return _run_matching()
+
+@celery.task
+def match_location(location):
+    """
+    Matches the pending requests in a single location. Scheduled when a
+    request is created or a host becomes available there.
+    """
+    return _run_matching(location)
+
+@celery.task
+def drain_outbox():
+    """
+    Sends pending outbox messages at the configured WhatsApp rate, then
+    reschedules itself for any messages still waiting on a retry.
+
+    Only one drain sends at a time, so the token bucket reflects the real
+    send rate for the phone number ID; a drain started while another runs
+    returns at once. The running drain looks for due messages after it
+    lets go of the lock, so none queued in the meantime are left behind.
+    """
+    rate = flask_app.config['WHATSAPP_RATE_PER_SECOND']
+    batch_size = flask_app.config['OUTBOX_BATCH_SIZE']
+    lease = claim_lease_seconds(flask_app.config['OUTBOX_LEASE_SECONDS'], batch_size, rate)
+    token = drain_guard.acquire(lease)
+    if token is None:
+        return {'sent': 0, 'retried': 0, 'dead': 0, 'skipped': True}
+    try:
+        with get_app_context():
+            stats = drain_outbox_messages(
+                rate_per_second=rate,
+                batch_size=batch_size,
+                max_attempts=flask_app.config['OUTBOX_MAX_ATTEMPTS'],
+                max_seconds=flask_app.config['OUTBOX_DRAIN_SECONDS'],
+                lease_seconds=flask_app.config['OUTBOX_LEASE_SECONDS'],
+                async_http=flask_app.config['OUTBOX_ASYNC_HTTP'],
+                keep_lock=lambda: drain_guard.renew(token, lease)
+            )
+    finally:
+        drain_guard.release(token)
+    with get_app_context():
+        next_due = seconds_until_next_due()
+    if next_due is not None and drain_guard.reschedule(next_due):
+        drain_outbox.apply_async(countdown=next_due)
+    return stats
+@celery.task
+def process_inbound_messages(messages=None):
+    """
+    Applies inbound WhatsApp messages queued by the webhook, a batch per
+    transaction: availability replies update the hosts' availability, and
+    every message is answered through the outbox.
+
+    Called with `messages` when the web process batches in-process,
+    otherwise drains the Redis inbox until it is empty.
     """
+    totals = {'messages': 0, 'ignored': 0, 'hosts_updated': 0, 'replies': 0}
+    locations = set()
     with get_app_context():
-        matches = match_students_with_hosts()
-        for match in matches:
-            send_whatsapp_message(match['host_phone'], f"New match: {match['student']} wants to stay with you.")
\ No newline at end of file
+        while True:
+            claim, batch = (None, messages) if messages is not None else inbox.pop_batch()
+            if batch:
+                stats, batch_locations = process_replies(batch, host_phone_index)
+                for key in totals:
+                    totals[key] += stats[key]
+                locations |= batch_locations
+            if claim is not None:
+                inbox.ack(claim)  #  Only now that the batch is committed
+            if messages is not None or (not batch and not inbox.finish_drain()):
+                break
+    for location in locations:
+        match_location.delay(location)
+    if totals['replies']:
+        drain_outbox.delay()
+    return totals
@@ -0,0 +1,48 @@
+"""add match status and expiry
+
+Revision ID: 4a9d0b6e3c57
+Revises: e1a7f3c95b28
+Create Date: 2026-10-18 13:58:26.931407
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4a9d0b6e3c57'
+down_revision = 'e1a7f3c95b28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('match', sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'))
+    op.add_column('match', sa.Column('expires_at', sa.DateTime(), nullable=True))
+
+    #  Existing matches get the same 24 hour window they were always checked against
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("UPDATE \"match\" SET expires_at = datetime(created_at, '+24 hours')")
+    else:
+        op.execute("UPDATE \"match\" SET expires_at = created_at + interval '24 hours'")
+    op.execute("UPDATE \"match\" SET status = 'confirmed' WHERE host_confirmed AND student_confirmed")
+    #  Matches already past that window are expired here, without the notifications and
+    #  re-matching check_for_expired_confirmations would otherwise send about them
+    match = sa.table('match', sa.column('status'), sa.column('expires_at', sa.DateTime()))
+    op.execute(match.update().where(match.c.status == 'pending', match.c.expires_at < datetime.utcnow())
+               .values(status='expired'))
+
+    op.drop_index('ix_match_unconfirmed_created_at', table_name='match')
+    op.create_index('ix_match_status_expires_at', 'match', ['status', 'expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_match_status_expires_at', table_name='match')
+    op.create_index('ix_match_unconfirmed_created_at', 'match', ['created_at'], unique=False,
+                    sqlite_where=sa.text('host_confirmed = 0 OR student_confirmed = 0'),
+                    postgresql_where=sa.text('host_confirmed = false OR student_confirmed = false'))
+    with op.batch_alter_table('match') as batch_op:
+        batch_op.drop_column('expires_at')
+        batch_op.drop_column('status')
@@ -0,0 +1,29 @@
+"""add task checkpoint
+
+Revision ID: 8b4e61c0f2d3
+Revises: 3f1c2b7d9a10
+Create Date: 2026-10-18 10:03:17.502214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4e61c0f2d3'
+down_revision = '3f1c2b7d9a10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('task_checkpoint',
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('task_checkpoint')
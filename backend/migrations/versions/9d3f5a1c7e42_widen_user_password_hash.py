@@ -0,0 +1,33 @@
+"""widen user password hash
+
+Revision ID: 9d3f5a1c7e42
+Revises: 4a9d0b6e3c57
+Create Date: 2026-10-18 15:12:40.118302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3f5a1c7e42'
+down_revision = '4a9d0b6e3c57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    #  scrypt hashes are 162 characters, longer than the old column
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password_hash',
+               existing_type=sa.String(length=128),
+               type_=sa.String(length=255),
+               existing_nullable=True)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password_hash',
+               existing_type=sa.String(length=255),
+               type_=sa.String(length=128),
+               existing_nullable=True)
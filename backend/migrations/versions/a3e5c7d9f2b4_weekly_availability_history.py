@@ -0,0 +1,86 @@
+"""keep availability per week and archive past weeks
+
+Revision ID: a3e5c7d9f2b4
+Revises: 9d3f5a1c7e42
+Create Date: 2026-10-18 18:04:51.372915
+
+"""
+from datetime import date, datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3e5c7d9f2b4'
+down_revision = '9d3f5a1c7e42'
+branch_labels = None
+depends_on = None
+
+
+def _as_date(value):
+    #  SQLite hands dates back as text
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def _monday(day):
+    day = day or datetime.utcnow().date()
+    return day - timedelta(days=day.weekday())
+
+
+def upgrade():
+    #  Rows were stamped with the day they were first written; key them by
+    #  the week's Monday instead, keeping the newest row where two collide
+    bind = op.get_bind()
+    rows = bind.execute(sa.text("SELECT id, host_id, week_start FROM host_availability ORDER BY id DESC")).all()
+    kept, stale, moved = set(), [], []
+    for row_id, host_id, week_start in rows:
+        week_start = _as_date(week_start)
+        monday = _monday(week_start)
+        if (host_id, monday) in kept:
+            stale.append(row_id)
+            continue
+        kept.add((host_id, monday))
+        if week_start != monday:
+            moved.append({'row_id': row_id, 'monday': monday})
+    if stale:
+        bind.execute(sa.text("DELETE FROM host_availability WHERE id = :row_id"), [{'row_id': i} for i in stale])
+    if moved:
+        #  Clear first so no intermediate state trips the unique index
+        bind.execute(sa.text("UPDATE host_availability SET week_start = NULL WHERE id = :row_id"), moved)
+        bind.execute(sa.text("UPDATE host_availability SET week_start = :monday WHERE id = :row_id"), moved)
+
+    op.drop_index('ix_host_availability_available_host_id_capacity', table_name='host_availability')
+    op.create_index('ix_host_availability_week_start_available', 'host_availability',
+                    ['week_start', 'available', 'host_id', 'capacity'], unique=False)
+
+    op.create_table('host_availability_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('host_id', sa.Integer(), nullable=False),
+    sa.Column('available', sa.Boolean(), nullable=True),
+    sa.Column('capacity', sa.Integer(), nullable=True),
+    sa.Column('week_start', sa.Date(), nullable=False),
+    sa.ForeignKeyConstraint(['host_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('uq_host_availability_archive_week_start_host_id', 'host_availability_archive',
+                    ['week_start', 'host_id'], unique=True)
+
+
+def downgrade():
+    #  Bring archived weeks back so no history is lost
+    op.execute(
+        "INSERT INTO host_availability (id, host_id, available, capacity, week_start) "
+        "SELECT id, host_id, available, capacity, week_start FROM host_availability_archive"
+    )
+    op.drop_index('uq_host_availability_archive_week_start_host_id', table_name='host_availability_archive')
+    op.drop_table('host_availability_archive')
+    op.drop_index('ix_host_availability_week_start_available', table_name='host_availability')
+    op.create_index('ix_host_availability_available_host_id_capacity', 'host_availability', ['host_id', 'capacity'],
+                    unique=False, sqlite_where=sa.text('available = 1'), postgresql_where=sa.text('available = true'))
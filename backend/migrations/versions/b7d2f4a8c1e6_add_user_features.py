@@ -0,0 +1,40 @@
+"""add user preference vectors
+
+Revision ID: b7d2f4a8c1e6
+Revises: a3e5c7d9f2b4
+Create Date: 2026-10-18 21:37:12.804411
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.preferences import encode_features
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2f4a8c1e6'
+down_revision = 'a3e5c7d9f2b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('features', sa.LargeBinary(), nullable=True))
+
+    #  Table constructs rather than SQL text, which would need "user" quoted on PostgreSQL
+    user = sa.table('user', sa.column('id'), sa.column('role'), sa.column('preferences'), sa.column('about_me'),
+                    sa.column('features', sa.LargeBinary()))
+    bind = op.get_bind()
+    users = bind.execute(sa.select(user.c.id, user.c.role, user.c.preferences, user.c.about_me)).all()
+    if users:
+        bind.execute(
+            user.update().where(user.c.id == sa.bindparam('user_id')).values(features=sa.bindparam('new_features')),
+            [{'user_id': user_id, 'new_features': encode_features(role, preferences, about_me)}
+             for user_id, role, preferences, about_me in users],
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('features')
@@ -0,0 +1,47 @@
+"""add indexes for hot query paths
+
+Revision ID: c5d2e8a4b7f1
+Revises: 8b4e61c0f2d3
+Create Date: 2026-10-18 11:20:05.640391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d2e8a4b7f1'
+down_revision = '8b4e61c0f2d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    #  Keep the newest row per (host_id, week_start) so the unique index can be built
+    op.execute(
+        "DELETE FROM host_availability WHERE id NOT IN "
+        "(SELECT MAX(id) FROM host_availability GROUP BY host_id, week_start)"
+    )
+
+    op.create_index('ix_user_role_location', 'user', ['role', 'location'], unique=False)
+    op.create_index('uq_host_availability_host_id_week_start', 'host_availability', ['host_id', 'week_start'], unique=True)
+    op.create_index('ix_host_availability_available_host_id_capacity', 'host_availability', ['host_id', 'capacity'], unique=False,
+                    sqlite_where=sa.text('available = 1'), postgresql_where=sa.text('available = true'))
+    op.create_index('ix_student_request_status_location_created_at', 'student_request', ['status', 'location', 'created_at'], unique=False)
+    op.create_index('ix_student_request_student_id', 'student_request', ['student_id'], unique=False)
+    op.create_index('ix_match_student_request_id', 'match', ['student_request_id'], unique=False)
+    op.create_index('ix_match_host_id', 'match', ['host_id'], unique=False)
+    op.create_index('ix_match_unconfirmed_created_at', 'match', ['created_at'], unique=False,
+                    sqlite_where=sa.text('host_confirmed = 0 OR student_confirmed = 0'),
+                    postgresql_where=sa.text('host_confirmed = false OR student_confirmed = false'))
+
+
+def downgrade():
+    op.drop_index('ix_match_unconfirmed_created_at', table_name='match')
+    op.drop_index('ix_match_host_id', table_name='match')
+    op.drop_index('ix_match_student_request_id', table_name='match')
+    op.drop_index('ix_student_request_student_id', table_name='student_request')
+    op.drop_index('ix_student_request_status_location_created_at', table_name='student_request')
+    op.drop_index('ix_host_availability_available_host_id_capacity', table_name='host_availability')
+    op.drop_index('uq_host_availability_host_id_week_start', table_name='host_availability')
+    op.drop_index('ix_user_role_location', table_name='user')
@@ -0,0 +1,25 @@
+"""add user (role, id) index
+
+Revision ID: d4b8e2f6a913
+Revises: b7d2f4a8c1e6
+Create Date: 2026-10-19 09:12:44.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4b8e2f6a913'
+down_revision = 'b7d2f4a8c1e6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    #  Lets host_id_pages read host ids in order instead of sorting every host for each page
+    op.create_index('ix_user_role_id', 'user', ['role', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_role_id', table_name='user')
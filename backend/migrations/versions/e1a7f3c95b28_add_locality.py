@@ -0,0 +1,34 @@
+"""add locality
+
+Revision ID: e1a7f3c95b28
+Revises: c5d2e8a4b7f1
+Create Date: 2026-10-18 12:41:52.207733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a7f3c95b28'
+down_revision = 'c5d2e8a4b7f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('locality',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.Column('name_he', sa.String(length=255), nullable=True),
+    sa.Column('normalized_name', sa.String(length=255), nullable=False),
+    sa.Column('aliases', sa.Text(), nullable=True),
+    sa.Column('latitude', sa.Float(), nullable=False),
+    sa.Column('longitude', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('normalized_name')
+    )
+
+
+def downgrade():
+    op.drop_table('locality')
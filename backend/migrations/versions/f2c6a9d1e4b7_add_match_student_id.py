@@ -0,0 +1,34 @@
+"""add match student id
+
+Revision ID: f2c6a9d1e4b7
+Revises: d4b8e2f6a913
+Create Date: 2026-10-18 11:40:17.502816
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c6a9d1e4b7'
+down_revision = 'd4b8e2f6a913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('match', sa.Column('student_id', sa.Integer(), nullable=True))
+    op.execute('UPDATE "match" SET student_id = (SELECT student_id FROM student_request '
+               'WHERE student_request.id = "match".student_request_id)')
+    with op.batch_alter_table('match') as batch_op:
+        batch_op.alter_column('student_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('fk_match_student_id_user', 'user', ['student_id'], ['id'])
+    #  Lets a student's match pages be read in id order instead of sorting all their matches
+    op.create_index('ix_match_student_id_id', 'match', ['student_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_match_student_id_id', table_name='match')
+    with op.batch_alter_table('match') as batch_op:
+        batch_op.drop_constraint('fk_match_student_id_user', type_='foreignkey')
+        batch_op.drop_column('student_id')